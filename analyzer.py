@@ -0,0 +1,675 @@
+"""
+G-Code-Analyse: Extrusion je Tool aus einzelnen G-Code-Zeilen ermitteln.
+
+- scan_line: schneller Scanner, liest nur das führende T-Wort und das erste E-Wort
+- scan_line_pygcode: Referenz-Scanner über pygcode.Line (langsam, zum Vergleich)
+- ToolUsage: summiert E-Werte je Tool inkl. Stamping-Distance beim Werkzeugwechsel
+- UsageIndex: kumulierter Verbrauch mit Stützpunkten, Fortschritt → Zeile über M73-Marken,
+  Zeile → Verbrauch per Lookup
+- iter_line_chunks: liest den G-Code vorwärts in festen Blöcken (Datei, mmap, gzip oder .bgcode)
+- iter_tail_chunks: liest vom Dateiende rückwärts (Slicer-Konfiguration am Ende der Datei)
+- build_usage_index_parallel: derselbe Index, Bereiche der Datei in mehreren Prozessen gescannt
+"""
+import os
+import gzip
+import mmap
+import re
+import multiprocessing
+from bisect import bisect_right
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import bgcode_reader
+try:
+    from pygcode import Line
+except ImportError:  # pygcode wird nur für den Parser-Modus "pygcode" gebraucht
+    Line = None
+
+# Bei Änderungen an Scanner/Verbrauchsregeln erhöhen – macht gecachte Ergebnisse ungültig
+PARSER_VERSION = 4
+
+# ----- Datei lesen -----
+
+READ_BLOCK = 1 << 20   # Bytes pro Leseblock
+
+
+def _read_blocks(path, block_size):
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+def _mmap_blocks(path, block_size):
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # madvise braucht seitenweise ausgerichtete Bereiche
+            block_size = -(-block_size // mmap.PAGESIZE) * mmap.PAGESIZE
+            advise = hasattr(mm, 'madvise')
+            if advise:
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            for pos in range(0, len(mm), block_size):
+                yield mm[pos:pos + block_size]
+                if advise:
+                    # gelesene Seiten freigeben, damit RSS nicht mit der Dateigröße wächst
+                    mm.madvise(mmap.MADV_DONTNEED, pos, min(block_size, len(mm) - pos))
+
+
+def _gzip_blocks(path, block_size):
+    with gzip.open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+def _bgcode_blocks(path, block_size):
+    # Blockgröße gibt die Datei vor (ein G-Code-Block, meist 64 kB)
+    return bgcode_reader.iter_gcode_blocks(path)
+
+
+READERS = {
+    "stream": _read_blocks,
+    "mmap": _mmap_blocks,
+    "gzip": _gzip_blocks,
+    "bgcode": _bgcode_blocks,
+}
+
+
+def iter_line_chunks(path, mode="stream", block_size=READ_BLOCK):
+    """
+    Liefert die Zeilen der Datei (ohne Zeilenende) als Listen, ein Block pro Liste.
+    Der Lesezeiger bewegt sich nur vorwärts; im Speicher liegt nie mehr als ein
+    Block plus die angefangene letzte Zeile. Ungültiges UTF-8 wird ignoriert.
+    Dateien mit Endung .gz werden immer über gzip gelesen, .bgcode wird direkt dekodiert.
+    """
+    if path.endswith('.gz'):
+        mode = "gzip"
+    elif path.lower().endswith('.bgcode'):
+        mode = "bgcode"
+    if mode not in READERS:
+        raise ValueError(f"Unbekannter Lese-Modus '{mode}' (erlaubt: {', '.join(READERS)})")
+    return split_line_chunks(READERS[mode](path, block_size))
+
+
+def split_line_chunks(blocks):
+    """Zerlegt eine Folge von Byte-Blöcken in Zeilenlisten (wie iter_line_chunks)."""
+    rest = b''
+    for block in blocks:
+        cut = block.rfind(b'\n')
+        if cut < 0:
+            rest += block
+            continue
+        # UTF-8-Folgebytes enthalten nie b'\n', der Schnitt zerteilt also kein Zeichen
+        text = (rest + block[:cut]).decode('utf-8', errors='ignore')
+        rest = block[cut + 1:]
+        yield text.split('\n')
+    if rest:
+        yield [rest.decode('utf-8', errors='ignore')]
+
+
+def iter_tail_chunks(path, block_size=READ_BLOCK, limit=None):
+    """
+    Liefert die Zeilen vom Dateiende her blockweise rückwärts; innerhalb eines Blocks
+    stehen die Zeilen in Dateireihenfolge. Gelesen werden höchstens `limit` Bytes,
+    eine dabei angeschnittene Zeile am Anfang des Bereichs entfällt.
+    """
+    with open(path, 'rb') as f:
+        pos = f.seek(0, 2)
+        stop = 0 if limit is None else max(0, pos - limit)
+        rest = b''
+        while pos > stop:
+            start = max(stop, pos - block_size)
+            f.seek(start)
+            data = f.read(pos - start) + rest
+            pos = start
+            if pos > 0:
+                # angefangene erste Zeile gehört zum davorliegenden Block
+                cut = data.find(b'\n')
+                if cut < 0:
+                    rest = data
+                    continue
+                rest = data[:cut]
+                data = data[cut + 1:]
+            yield data.decode('utf-8', errors='ignore').split('\n')
+
+# ----- Scanner -----
+
+# Wortsyntax wie in pygcode.words: G/M als Code, L/N/T als positive Ganzzahl,
+# O verschluckt den Rest der Zeile, alle anderen Buchstaben als Float.
+# Zeichen vor einem Buchstaben werden (wie bei pygcode) übersprungen.
+_BLOCK_RE = re.compile(
+    r'(?:[^A-Za-z]*?'
+    r'(?:[GgMm]\s*\d+(?:\.\d)?'
+    r'|[LlNnTt]\s*\d+'
+    r'|[Oo].+'
+    r'|[A-FH-KP-SU-Za-fh-kp-su-z]\s*-?(?:\d+\.?\d*|\.\d+)))*\s*'
+)
+_TOOL_RE = re.compile(r'[^A-Za-z]*[Tt]\s*(\d+)')
+_E_RE = re.compile(r'[Ee]\s*(-?(?:\d+\.?\d*|\.\d+))')
+_BRACKET_RE = re.compile(r'\([^\)]*\)')
+# Fortschrittsmarke von PrusaSlicer (P = normaler Modus, Q = Silent-Modus wird ignoriert)
+_M73_RE = re.compile(r'^M73 P(\d+(?:\.\d*)?)', re.M)
+
+
+def scan_line(raw):
+    """
+    Liefert (tool, e) für eine G-Code-Zeile oder None, wenn die Zeile weder
+    ein Tool noch eine Extrusion enthält bzw. nicht geparst werden kann.
+    tool ist gesetzt, wenn das erste Wort ein T-Wort ist, e ist der Wert des ersten E-Worts.
+
+    Mehrfache Wörter: zwei T-Wörter (T1T1, T1 E1 T2) verwirft pygcode.Line als ganze Zeile,
+    hier ebenso. Doppelte G-Codes derselben Gruppe oder doppelte Parameter (G1 G1 E1,
+    G1 X1 X2 E1) lehnt pygcode ebenfalls ab, dieser Scanner wertet sie aus – solche Zeilen
+    erzeugt kein Slicer, nachgebaut wird nur der Fall, der einen Werkzeugwechsel vortäuscht.
+    """
+    s = raw.strip()
+    if not s or s[0] == ';' or s[0] == 'M':
+        return None
+    # Kommentare wie pygcode.comment.split_line: ';' hat Vorrang vor '(...)'
+    cut = s.find(';')
+    if cut >= 0:
+        s = s[:cut]
+    elif '(' in s:
+        s = _BRACKET_RE.sub('', s)
+    # Ohne T und E ändert die Zeile nichts am Verbrauch
+    if 'E' not in s and 'e' not in s and 'T' not in s and 't' not in s:
+        return None
+    if _BLOCK_RE.fullmatch(s) is None:
+        return None
+    for o in ('O', 'o'):
+        cut = s.find(o)
+        if cut >= 0:
+            s = s[:cut]
+    tool = None
+    if 'T' in s or 't' in s:
+        if s.count('T') + s.count('t') > 1:
+            return None
+        m = _TOOL_RE.match(s)
+        if m:
+            tool = int(m.group(1))
+    e = None
+    m = _E_RE.search(s)
+    if m:
+        e = float(m.group(1))
+    if tool is None and e is None:
+        return None
+    return tool, e
+
+
+def scan_line_pygcode(raw):
+    """Wie scan_line, aber über pygcode.Line (ursprünglicher Weg)."""
+    s = raw.strip()
+    if not s or s.startswith(';') or s.startswith('M'):
+        return None
+    try:
+        ln = Line(raw)
+    except Exception:
+        return None
+    words = ln.block.words
+    tool = None
+    if words and words[0].letter == 'T':
+        tool = int(words[0].value)
+    e = None
+    for w in words:
+        if w.letter == 'E':
+            e = float(w.value)
+            break
+    if tool is None and e is None:
+        return None
+    return tool, e
+
+
+SCANNERS = {
+    "fast": scan_line,
+    "pygcode": scan_line_pygcode,
+}
+
+
+def get_scanner(mode):
+    if mode not in SCANNERS:
+        raise ValueError(f"Unbekannter Parser-Modus '{mode}' (erlaubt: {', '.join(SCANNERS)})")
+    if mode == "pygcode" and Line is None:
+        raise ImportError("Parser-Modus 'pygcode' benötigt das Paket pygcode (pip install pygcode)")
+    return SCANNERS[mode]
+
+# ----- Verbrauch je Tool -----
+
+class ToolUsage:
+    """
+    Laufender Zustand der Extrusionsanalyse.
+    - E-Werte werden dem aktiven Tool gutgeschrieben, solange die Summe positiv bleibt
+    - Bei jedem Werkzeugwechsel außer dem ersten wird die Stamping-Distance des alten Tools addiert
+    - Negative Summen werden auf 0 gesetzt
+    on_tool_change(n) wird vor und nach jeder Zeile mit Werkzeugwechsel mit der Anzahl
+    bis dahin gelesener Zeilen aufgerufen (Stützpunkte für den UsageIndex).
+    tool_changes sammelt die Zeilennummern der Werkzeugwechsel.
+    """
+
+    def __init__(self, stamping, mmu, scan=scan_line, on_tool_change=None):
+        self.usage = defaultdict(float)
+        self.stamping = stamping
+        self.mmu = mmu
+        self.scan = scan
+        self.on_tool_change = on_tool_change
+        self.cur_tool = 0 if mmu else 5
+        self.first_tool_change = True
+        self.lines_done = 0
+        self.tool_changes = []
+
+    def feed(self, lines):
+        scan = self.scan
+        usage = self.usage
+        mark = self.on_tool_change
+        done = self.lines_done
+        n = -1
+        for n, raw in enumerate(lines):
+            hit = scan(raw)
+            if hit is None:
+                continue
+            tool, e = hit
+            if tool is not None:
+                if mark:
+                    mark(done + n)
+                self.tool_changes.append(done + n)
+                print(f"Tool change \n {raw}")
+                if not self.first_tool_change:
+                    # no real tool change but mmu is active
+                    if not self.mmu:
+                        print("ERROR MMU RECOGNIZED BUT THERE SHOULD BE NONE!")
+                    usage[self.cur_tool] += self.stamping[self.cur_tool]
+                self.first_tool_change = False
+                self.cur_tool = tool
+            cur = self.cur_tool
+            if e:
+                # Extrude purge line is not included in Prusa Slicer Concumptions.
+                # E0 (z. B. G92 E0) legt wie bisher keinen Eintrag für das Tool an
+                u = usage[cur]
+                if u + e > 0:
+                    usage[cur] = u + e
+            if cur in usage and usage[cur] < 0:
+                usage[cur] = 0
+            if tool is not None and mark:
+                mark(done + n + 1)
+        self.lines_done = done + n + 1
+
+    def snapshot(self):
+        return dict(self.usage)
+
+    def checkpoint_values(self):
+        """Werte für einen Stützpunkt im UsageIndex."""
+        return tuple(self.usage.values())
+
+
+class RangeUsage(ToolUsage):
+    """
+    ToolUsage für einen Bereich mitten in der Datei (build_usage_index_parallel). Der Verbrauch
+    vor dem Bereich ist im Worker unbekannt, daher zwei Rechnungen je Tool:
+    - usage: wie ToolUsage ab 0 – exakt für Tools, die bisher nichts verbraucht haben
+    - linear: Summe aller E-Werte ohne die Regel "Summe bleibt positiv" – exakt, solange der
+      Vorstand des Tools über need[tool] liegt, denn dann greift die Regel im Bereich nie
+    cur_tool und first_tool_change setzt der Aufrufer auf den Stand am Bereichsanfang.
+    """
+
+    def __init__(self, stamping, mmu, scan=scan_line, on_tool_change=None):
+        super().__init__(stamping, mmu, scan, on_tool_change)
+        self.linear = defaultdict(float)
+        self.need = {}
+
+    def feed(self, lines):
+        scan = self.scan
+        usage = self.usage
+        linear = self.linear
+        need = self.need
+        mark = self.on_tool_change
+        done = self.lines_done
+        n = -1
+        for n, raw in enumerate(lines):
+            hit = scan(raw)
+            if hit is None:
+                continue
+            tool, e = hit
+            if tool is not None:
+                if mark:
+                    mark(done + n)
+                self.tool_changes.append(done + n)
+                print(f"Tool change \n {raw}")
+                if not self.first_tool_change:
+                    if not self.mmu:
+                        print("ERROR MMU RECOGNIZED BUT THERE SHOULD BE NONE!")
+                    usage[self.cur_tool] += self.stamping[self.cur_tool]
+                    linear[self.cur_tool] += self.stamping[self.cur_tool]
+                self.first_tool_change = False
+                self.cur_tool = tool
+            cur = self.cur_tool
+            if e:
+                u = usage[cur]
+                if u + e > 0:
+                    usage[cur] = u + e
+                # Vorstand + v muss positiv bleiben, sonst hätte ToolUsage e verworfen
+                v = linear[cur] + e
+                linear[cur] = v
+                if cur not in need or -v > need[cur]:
+                    need[cur] = -v
+            if cur in usage and usage[cur] < 0:
+                usage[cur] = 0
+            if tool is not None and mark:
+                mark(done + n + 1)
+        self.lines_done = done + n + 1
+
+    def checkpoint_values(self):
+        return tuple(self.usage.values()), tuple(self.linear.get(t, 0.0) for t in self.usage)
+
+# ----- Verbrauchsindex -----
+
+class UsageIndex:
+    """
+    Kumulierter Verbrauch je Tool, alle `every` Zeilen und an jedem Werkzeugwechsel
+    als Stützpunkt gespeichert. usage_at() sucht den Stützpunkt per Binärsuche und
+    interpoliert linear bis zum nächsten – der G-Code muss dafür nicht erneut gelesen
+    werden. Zwischen zwei Stützpunkten ist immer nur ein Tool aktiv.
+
+    tools hält die Tools in der Reihenfolge ihres ersten Auftretens; jeder Stützpunkt
+    speichert die Werte als Tupel über ein Präfix dieser Liste.
+
+    progress_pcts/progress_lines bilden die M73-Marken ab (Prozent aufsteigend → Zeile);
+    line_at_progress() rechnet darüber den Drucker-Fortschritt in eine Zeile um.
+    """
+
+    def __init__(self, total_lines, lines, values, tools, complete=True, tool_changes=None,
+                 progress_pcts=None, progress_lines=None):
+        self.total_lines = total_lines
+        self.lines = lines
+        self.values = values
+        self.tools = tools
+        self.tool_changes = tool_changes if tool_changes is not None else []
+        self.progress_pcts = progress_pcts if progress_pcts is not None else []
+        self.progress_lines = progress_lines if progress_lines is not None else []
+        # Während der Index noch aufgebaut wird (pipeline.py): complete=False,
+        # expected_lines ist dann die Schätzung der Gesamtzeilen; error: Aufbau abgebrochen
+        self.complete = complete
+        self.expected_lines = total_lines
+        self.error = None
+
+    def _exact(self, i):
+        return dict(zip(self.tools, self.values[i]))
+
+    def usage_at(self, line):
+        line = max(0, min(line, self.total_lines))
+        i = bisect_right(self.lines, line) - 1
+        if self.lines[i] == line or i == len(self.lines) - 1:
+            return self._exact(i)
+        lo, hi = self.values[i], self.values[i + 1]
+        f = (line - self.lines[i]) / (self.lines[i + 1] - self.lines[i])
+        usage = {}
+        for k, t in enumerate(self.tools[:len(hi)]):
+            a = lo[k] if k < len(lo) else 0.0
+            usage[t] = a + (hi[k] - a) * f
+        return usage
+
+    def line_at_progress(self, prog):
+        """
+        Zeile zum Fortschritt in %: Binärsuche über die M73-Marken, dazwischen linear.
+        Ohne Marken (oder ab 100 %) linear über die Zeilenzahl.
+        """
+        end = self.expected_lines
+        pcts = self.progress_pcts
+        if not pcts or prog >= 100:
+            return int(end * min(prog, 100) / 100)
+        i = bisect_right(pcts, prog) - 1
+        if i < 0:
+            p0, l0, p1, l1 = 0.0, 0, pcts[0], self.progress_lines[0]
+        elif i + 1 < len(pcts):
+            p0, l0, p1, l1 = pcts[i], self.progress_lines[i], pcts[i + 1], self.progress_lines[i + 1]
+        else:
+            p0, l0, p1, l1 = pcts[i], self.progress_lines[i], 100.0, end
+        if p1 <= p0:
+            return l0
+        return int(l0 + (l1 - l0) * (prog - p0) / (p1 - p0))
+
+    def usage_at_progress(self, prog):
+        return self.usage_at(self.line_at_progress(prog))
+
+    def line_when(self, tool, mm):
+        """Erste Zeile, an der der Verbrauch von tool mm erreicht (interpoliert), sonst None."""
+        if tool not in self.tools:
+            return None
+        k = self.tools.index(tool)
+        prev = 0.0
+        for i in range(1, len(self.lines)):
+            v = self.values[i]
+            cur = v[k] if k < len(v) else 0.0
+            if cur >= mm:
+                f = (mm - prev) / (cur - prev) if cur > prev else 1.0
+                return int(self.lines[i - 1] + (self.lines[i] - self.lines[i - 1]) * max(0.0, min(f, 1.0)))
+            prev = cur
+        return None
+
+    def as_dict(self):
+        return {"total_lines": self.total_lines, "lines": self.lines, "values": self.values, "tools": self.tools,
+                "tool_changes": self.tool_changes,
+                "progress_pcts": self.progress_pcts, "progress_lines": self.progress_lines}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["total_lines"], data["lines"], [tuple(v) for v in data["values"]], data["tools"],
+                   tool_changes=data.get("tool_changes"),
+                   progress_pcts=data.get("progress_pcts"), progress_lines=data.get("progress_lines"))
+
+
+def build_usage_index(path, stamping, mmu, scan=scan_line, every=1000, reader="stream"):
+    """Einmaliger Durchlauf über den G-Code (nur vorwärts, blockweise), liefert einen UsageIndex."""
+    return index_line_chunks(iter_line_chunks(path, reader), stamping, mmu, scan, every)
+
+
+def index_line_chunks(chunks, stamping, mmu, scan=scan_line, every=1000, index=None):
+    """
+    Baut den UsageIndex aus einer Folge von Zeilenlisten. Wird ein leerer, unvollständiger
+    Index übergeben, wächst er während des Durchlaufs und kann parallel abgefragt werden
+    (Werte werden vor den Zeilennummern angehängt, total_lines erst danach erhöht).
+    """
+    if index is None:
+        index = UsageIndex(0, [0], [()], [], complete=False)
+    tracker = ToolUsage(stamping, mmu, scan)
+    _index_chunks(chunks, tracker, index, every)
+    index.tools = list(tracker.usage)
+    index.expected_lines = index.total_lines = tracker.lines_done
+    index.complete = True
+    return index
+
+
+def _index_chunks(chunks, tracker, index, every):
+    """Zeilenlisten durch tracker schicken, Stützpunkte und M73-Marken an index anhängen."""
+    lines = index.lines
+    values = index.values
+    pcts = index.progress_pcts
+    pct_lines = index.progress_lines
+
+    def checkpoint(n):
+        if n > lines[-1]:
+            if len(tracker.usage) != len(index.tools):
+                index.tools = list(tracker.usage)
+            values.append(tracker.checkpoint_values())
+            lines.append(n)
+
+    tracker.on_tool_change = checkpoint
+    tracker.tool_changes = index.tool_changes
+    for chunk in chunks:
+        # M73-Marken (M-Zeilen überspringt der Scanner) per Regex über den ganzen Block
+        text = '\n'.join(chunk)
+        pos = nl = 0
+        for m in _M73_RE.finditer(text):
+            nl += text.count('\n', pos, m.start())
+            pos = m.start()
+            p = float(m.group(1))
+            if not pcts or p > pcts[-1]:
+                # Zeile vor Prozentwert anhängen, parallele Leser bisecten über pcts
+                pct_lines.append(tracker.lines_done + nl)
+                pcts.append(p)
+        for i in range(0, len(chunk), every):
+            tracker.feed(chunk[i:i + every])
+            checkpoint(tracker.lines_done)
+            index.total_lines = tracker.lines_done
+
+# ----- Paralleler Index -----
+
+# Kandidaten für Werkzeugwechsel: erstes Wort T, ggf. hinter Klammer-Kommentar (bestätigt der Scanner)
+_TOOL_LINE_RE = re.compile(rb'^[^A-Za-z;\n]*[(Tt][^\n]*', re.M)
+
+
+def _line_start(f, pos, block_size):
+    """Offset hinter dem letzten Zeilenende vor pos (0, wenn es keins gibt)."""
+    while pos > 0:
+        lo = max(0, pos - block_size)
+        f.seek(lo)
+        cut = f.read(pos - lo).rfind(b'\n')
+        if cut >= 0:
+            return lo + cut + 1
+        pos = lo
+    return 0
+
+
+def split_ranges(path, parts, block_size=READ_BLOCK):
+    """
+    Teilt die Datei in höchstens parts Bereiche (start, end). Jeder Bereich beginnt hinter dem
+    letzten Zeilenende vor einer Blockgrenze – genau dort, wo split_line_chunks beim Lesen am
+    Stück einen Block abschließt. Die Bereiche liefern dadurch dieselben Zeilenlisten.
+    """
+    size = os.path.getsize(path)
+    blocks = -(-size // block_size)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for k in range(1, parts):
+            start = _line_start(f, blocks * k // parts * block_size, block_size)
+            if start > bounds[-1]:
+                bounds.append(start)
+    if size > bounds[-1]:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _range_blocks(path, start, end, block_size=READ_BLOCK):
+    # Blöcke im selben Raster wie _read_blocks, damit split_line_chunks gleich schneidet
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            block = f.read(min(end, (pos // block_size + 1) * block_size) - pos)
+            if not block:
+                break
+            pos += len(block)
+            yield block
+
+
+def _find_tool(data, scan, tool):
+    for m in _TOOL_LINE_RE.finditer(data):
+        hit = scan(m.group().decode('utf-8', errors='ignore'))
+        if hit is not None and hit[0] is not None:
+            tool = hit[0]
+    return tool
+
+
+def last_tool_change(path, start, end, scan=scan_line):
+    """Erste Phase: Tool des letzten Werkzeugwechsels im Bereich, None ohne Wechsel."""
+    tool = None
+    rest = b''
+    for block in _range_blocks(path, start, end):
+        data = rest + block
+        cut = data.rfind(b'\n') + 1
+        rest = data[cut:]
+        tool = _find_tool(data[:cut], scan, tool)
+    return _find_tool(rest, scan, tool)
+
+
+def index_range(path, start, end, stamping, mmu, scan, every, cur_tool, first_tool_change):
+    """Zweite Phase (im Worker): Index eines Bereichs, Zeilen ab 0, Werte als (usage, linear)."""
+    tracker = RangeUsage(stamping, mmu, scan)
+    tracker.cur_tool = cur_tool
+    tracker.first_tool_change = first_tool_change
+    index = UsageIndex(0, [0], [()], [], complete=False)
+    _index_chunks(split_line_chunks(_range_blocks(path, start, end)), tracker, index, every)
+    index.tools = list(tracker.usage)
+    return index, tracker.need
+
+
+def _merge_range(index, totals, part, need):
+    """
+    Bereichsindex an index anhängen. totals ist der Verbrauch je Tool vor dem Bereich; liefert den
+    Stand danach oder None, wenn ein Tool mit Vorstand ≤ need im Bereich die Regel
+    "Summe bleibt positiv" berührt (dann muss der Bereich der Reihe nach gerechnet werden).
+    """
+    if any(0 != totals.get(t, 0.0) <= need.get(t, float('-inf')) for t in part.tools):
+        return None
+    offset = index.total_lines
+    after = totals
+    for n, (exact, linear) in zip(part.lines[1:], part.values[1:]):
+        after = dict(totals)
+        for t, x, v in zip(part.tools, exact, linear):
+            u = totals.get(t, 0.0)
+            after[t] = x if u == 0 else u + v
+        if offset + n > index.lines[-1]:
+            index.values.append(tuple(after.values()))
+            index.lines.append(offset + n)
+    index.tool_changes.extend(offset + n for n in part.tool_changes)
+    for p, n in zip(part.progress_pcts, part.progress_lines):
+        if not index.progress_pcts or p > index.progress_pcts[-1]:
+            index.progress_lines.append(offset + n)
+            index.progress_pcts.append(p)
+    index.total_lines = offset + part.total_lines
+    return after
+
+
+def build_usage_index_parallel(path, stamping, mmu, scan=scan_line, every=1000, workers=None):
+    """
+    Wie build_usage_index, aber die Datei wird an Zeilengrenzen in Bereiche geteilt und in
+    workers Prozessen gescannt:
+    1. je Bereich das Tool des letzten Werkzeugwechsels (nur Zeilen, die mit T beginnen können)
+       → aktives Tool und "erster Wechsel schon gewesen" am Anfang jedes Bereichs
+    2. je Bereich Verbrauch, Stützpunkte, Werkzeugwechsel und M73-Marken (RangeUsage)
+    3. Bereiche der Reihe nach anhängen; Stamping-Distance und erster Werkzeugwechsel wie bei
+       ToolUsage. Würde in einem Bereich die Regel "Summe bleibt positiv" bei einem Tool mit
+       Vorstand greifen, wird nur dieser Bereich im aufrufenden Prozess nachgerechnet.
+    Stützpunkte, Werkzeugwechsel und Marken sind dieselben wie beim Lesen am Stück, die Werte
+    bis auf die Reihenfolge der Gleitkomma-Additionen. .gz und .bgcode liest build_usage_index.
+    """
+    if path.endswith('.gz') or path.lower().endswith('.bgcode'):
+        return build_usage_index(path, stamping, mmu, scan, every)
+    workers = workers or os.cpu_count()
+    # etwas mehr Bereiche als Prozesse: Mischen beginnt, während hintere Bereiche noch laufen
+    ranges = split_ranges(path, workers * 2)
+    index = UsageIndex(0, [0], [()], [], complete=False)
+    # forkserver statt fork: der Aufrufer hat weitere Threads (Flask, Drucker); ein Lock, das einer
+    # davon beim Fork hält (z. B. stdout), bliebe im Worker für immer gesperrt
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+        n = len(ranges)
+        starts = [s for s, _ in ranges]
+        ends = [e for _, e in ranges]
+        tools = []
+        tool, first = (0 if mmu else 5), True
+        for last in pool.map(last_tool_change, [path] * n, starts, ends, [scan] * n):
+            tools.append((tool, first))
+            if last is not None:
+                tool, first = last, False
+        parts = pool.map(index_range, [path] * n, starts, ends, [stamping] * n, [mmu] * n, [scan] * n,
+                         [every] * n, [t for t, _ in tools], [f for _, f in tools])
+        totals = {}
+        for (start, end), (tool, first), (part, need) in zip(ranges, tools, parts):
+            after = _merge_range(index, totals, part, need)
+            if after is None:
+                print(f"Bereich {start}–{end}: Verbrauch nahe 0, wird der Reihe nach gerechnet")
+                tracker = ToolUsage(stamping, mmu, scan)
+                tracker.usage.update(totals)
+                tracker.cur_tool = tool
+                tracker.first_tool_change = first
+                tracker.lines_done = index.total_lines
+                _index_chunks(split_line_chunks(_range_blocks(path, start, end)), tracker, index, every)
+                after = dict(tracker.usage)
+            totals = after
+    index.tools = list(totals)
+    index.expected_lines = index.total_lines
+    index.complete = True
+    return index
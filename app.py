@@ -1,48 +1,79 @@
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, abort, g, jsonify, render_template, request
 import threading
 from datetime import datetime
 from zoneinfo import ZoneInfo  
 import os
-import json
 import time
 import settings
 import sys
-from monitor import get_current_status, prepare_gcode, parse_gcode_metadata, live_analyze_gen, get_current_job, init_wait_for_job, mm_to_g, ProgressMonitor_thread_fn, add_slicer_to_usage, stop_event
+import asyncio
+import functools
+import traceback
+from monitor import get_current_status, remote_key, start_pipeline, prepare_gcode, pipeline_fallback, parse_gcode_metadata, index_gcode, live_analyze_gen, get_current_job, init_wait_for_job, mm_to_g, ProgressMonitor_thread_fn, add_slicer_to_usage, clear_analysis_noti
 import logging
 import random
+import signal
+import cache
+import metrics
+from events import EventBroker
+from pipeline import PipelineError
+import engine
+from spool_store import open_store, SpoolIndex
+from history_log import PrintHistory, parse_time
+from printers import PRINTERS, init_registry, default_printer, spool_printer
 
 # Configuration
 WEB_PORT = 5000
 SPOOL_DB_FILE = os.path.join('data', 'spool_db.json')
-username = "maker" #os.getenv("USERNAME") 
-password = os.getenv("PASSWORD")
-ip = os.getenv("PRUSA_IP")
+
+# Wer spool_db (Liste oder Spulen) ändert, hält spool_lock; der verzögerte Schreiber kopiert darunter
+spool_lock = threading.RLock()
+spool_store = open_store(SPOOL_DB_FILE, data_lock=spool_lock)   # JSON-Datei oder SQLite (SPOOL_STORE=sqlite), schreibt verzögert
+print_history = PrintHistory()            # data/print_history.jsonl, übernimmt einmalig print_history.json
 
 def load_spool_db():
-    if not os.path.exists(SPOOL_DB_FILE):
-        return []
-    with open(SPOOL_DB_FILE, 'r') as f:
-        return json.load(f)
+    return spool_store.load()
 
 def save_spool_db(db):
-    with open(SPOOL_DB_FILE, 'w') as f:
-        json.dump(db, f, indent=2)
+    spool_index.rebuild(db)
+    spool_store.save_all(db)
+    notify_printers()
+
+def save_spools(*spools):
+    """Nur einzelne geänderte/neue Spulen speichern (SQLite: eine Zeile je Spule)."""
+    for spool in spools:
+        spool_index.update(spool)
+    spool_store.save(spool_db, spools)
+    notify_printers()
+
+def spools_locked(fn):
+    """Decorator für Routen, die spool_db ändern: ganze Anfrage unter spool_lock."""
+    @functools.wraps(fn)
+    def inner(*args, **kwargs):
+        with spool_lock:
+            return fn(*args, **kwargs)
+    return inner
+
+def notify_printers():
+    # die Spulen-DB ist gemeinsam: jedes Drucker-Dashboard bekommt die Änderung mit
+    for printer in PRINTERS.values():
+        if printer.broker:
+            printer.broker.trigger()
 
 INITIAL_WEIGHT_G = 1000.0  # kg pro Spule
 TARE_WEIGHT_G = 200
 
 #GLOBALS
 spool_db = []
+spool_index = SpoolIndex(spool_printer)   # id/Drucker/Slot → Spulen aus spool_db, siehe spool_store.py
 gcode_path = ""
 meta = ""
 slicing =  ""
 densities = ""
 stamping =  ""
-usage_history = []  # runtime data populated by monitor
+# usage_history und Slot-Mapping (z.B. {0: 2, 1: 0} bedeutet Tool0 → Slot2, Tool1 → Slot0) je Drucker, siehe printers.py
 #tool_progress = 0.0
 #TOOLSTATE = "unknown"   # PRINTING, PAUSED, etc.
-# Temporäres Mapping: z.B. {0: 2, 1: 0} bedeutet Tool0 → Slot2, Tool1 → Slot0
-temporary_slot_map = {}
 POLL_INTERVAL = 5    # Sekunden
 
 
@@ -51,10 +82,46 @@ log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 app.logger.disabled = True
 log.disabled = True
+
+@app.before_request
+def start_request_timer():
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Label ist die Route (/printer/<name>/status), nicht der Pfad: feste Anzahl Zeitreihen
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    if 't0' in g:
+        metrics.http_seconds.observe(time.perf_counter() - g.t0, route, request.method)
+    metrics.http_requests.inc(route, request.method, str(response.status_code))
+    return response
+
+def analyzer_lag():
+    """Drucker-Fortschritt minus analysierter Fortschritt (%) je Drucker, nur während eines Live-Drucks."""
+    lag = {}
+    for printer in PRINTERS.values():
+        cur = printer.state.snapshot()
+        history = printer.usage_history
+        if cur.tool_state in ("PRINTING", "PAUSED") and cur.tool_live != 'file' and history \
+                and isinstance(cur.tool_progress, (int, float)):
+            lag[(printer.name,)] = cur.tool_progress - history[-1][0]
+    return lag
+
+metrics.GaugeFn("analyzer_lag_percent", "Drucker-Fortschritt minus analysierter Fortschritt in Prozentpunkten",
+                ("printer",), analyzer_lag)
+
+def get_printer(name=None):
+    """Routen ohne /printer/<name>/ gelten für den ersten Drucker; unbekannter Name → 404."""
+    if name is None:
+        return default_printer()
+    if name not in PRINTERS:
+        abort(404, f"Drucker {name} nicht konfiguriert")
+    return PRINTERS[name]
         
 def init_spools():
     global spool_db
     spool_db = load_spool_db()
+    spool_index.rebuild(spool_db)
     if not spool_db:
         # Beispiel-Initialisierung mit 5 Spulen
         spool_db = [
@@ -72,9 +139,9 @@ def init_spools():
         save_spool_db(spool_db)
 
     
-def refill_spools(usage_history, densities):
+def refill_spools(printer, usage_history, densities):
     """
-    Aktualisiert die Mini‑DB (spool_db) für alle Spulen basierend auf dem zuletzt
+    Aktualisiert die Mini‑DB (spool_db) für alle Spulen des Druckers basierend auf dem zuletzt
     erfassten Druckverbrauch.
     """
     global spool_db
@@ -91,56 +158,61 @@ def refill_spools(usage_history, densities):
     
     now = datetime.now(ZoneInfo("Europe/Berlin"))
 
-    for entry in spool_db:
-        slot = entry['usage']['slot']
-        if slot is None:
-            print(f"[refill_spools] Spule {entry['id']} hat keinen Slot – übersprungen")
-            continue
+    with spool_lock:
+        for entry in spool_index.of_printer(printer.name):
+            slot = entry['usage']['slot']
+            if slot is None:
+                print(f"[refill_spools] Spule {entry['id']} hat keinen Slot – übersprungen")
+                continue
 
-        used_mm = last_usage.get(slot, 0.0)
-        if used_mm < 1:
-            print(f"[refill_spools] Slot {slot} hat nur {used_mm}mm – ignoriert")
-            continue
+            used_mm = last_usage.get(slot, 0.0)
+            if used_mm < 1:
+                print(f"[refill_spools] Slot {slot} hat nur {used_mm}mm – ignoriert")
+                continue
 
-        #used_g = mm_to_g(used_mm, densities[slot] if isinstance(densities, list) else densities)
-        try:
-            density = densities[slot] if isinstance(densities, list) else densities
-        except IndexError:
-            print(f"⚠️ Dichte für Slot {slot} nicht gefunden – nehme Standardwert 1.24g/cm³")
-            density = 1.24
+            #used_g = mm_to_g(used_mm, densities[slot] if isinstance(densities, list) else densities)
+            try:
+                density = densities[slot] if isinstance(densities, list) else densities
+            except IndexError:
+                print(f"⚠️ Dichte für Slot {slot} nicht gefunden – nehme Standardwert 1.24g/cm³")
+                density = 1.24
 
-        used_g = mm_to_g(used_mm, density)
+            used_g = mm_to_g(used_mm, density)
 
-        old = entry['data']['remaining_g']
-        #new_value = max(0.0, old - used_g) #avoid negative. not used because useful for spool join
-        new_value = old - used_g
+            old = entry['data']['remaining_g']
+            #new_value = max(0.0, old - used_g) #avoid negative. not used because useful for spool join
+            new_value = old - used_g
 
-        print(f"[refill_spools] Spule {entry['id']} – Slot {slot}")
-        print(f"    Verbrauch: {used_mm} mm → {used_g:.2f} g")
-        print(f"    Vorher: {old:.2f} g → Nachher: {new_value:.2f} g")
+            print(f"[refill_spools] Spule {entry['id']} – Slot {slot}")
+            print(f"    Verbrauch: {used_mm} mm → {used_g:.2f} g")
+            print(f"    Vorher: {old:.2f} g → Nachher: {new_value:.2f} g")
 
-        entry['data']['remaining_g'] = new_value
+            entry['data']['remaining_g'] = new_value
 
-        if entry['data']['first_used'] is None:
-            entry['data']['first_used'] = now.strftime('%Y-%m-%dT%H:%M%z')
-        entry['data']['last_used'] = now.strftime('%Y-%m-%dT%H:%M%z')
+            if entry['data']['first_used'] is None:
+                entry['data']['first_used'] = now.strftime('%Y-%m-%dT%H:%M%z')
+            entry['data']['last_used'] = now.strftime('%Y-%m-%dT%H:%M%z')
 
-    save_spool_db(spool_db)
+        save_spool_db(spool_db)
+    # Verbrauch eines ganzen Drucks nicht im Schreibfenster liegen lassen (ohne spool_lock, siehe spool_store)
+    spool_store.flush()
     print("[refill_spools] Speicherung abgeschlossen")
     return spool_db
     
-def log_print_history(filename, usage, densities, slotmap):
+def log_print_history(printer, filename, usage, densities, slotmap):
     now = datetime.now(ZoneInfo("Europe/Berlin"))
+    cur = printer.state.snapshot()
     record = {
         "timestamp": now.strftime('%Y-%m-%dT%H:%M%z'),
+        "printer": printer.name,
         "file": filename,
-        "progress": settings.tool_progress,
-        "status": settings.tool_state,
+        "progress": cur.tool_progress,
+        "status": cur.tool_state,
         "spools": {}
     }
 
     print(f"\n[log_print_history] Datei: {filename}")
-    print(f"[log_print_history] Status: {settings.tool_state}, Fortschritt: {settings.tool_progress}%")
+    print(f"[log_print_history] Status: {cur.tool_state}, Fortschritt: {cur.tool_progress}%")
     print(f"[log_print_history] Usage (mm): {usage}")
 
     for slot, used_mm in usage.items():
@@ -158,51 +230,61 @@ def log_print_history(filename, usage, densities, slotmap):
 
         print(f"[log_print_history] Slot {slot} → {used_mm} mm = {used_g:.2f} g")
 
-        for spool in spool_db:
-            if spool["usage"]["slot"] == slot:
-                record["spools"][spool["id"]] = round(used_g, 2)
-                print(f"  → zugewiesen an Spule {spool['id']}")
+        for spool in spool_index.in_slot(printer.name, slot):
+            record["spools"][spool["id"]] = round(used_g, 2)
+            print(f"  → zugewiesen an Spule {spool['id']}")
 
-    try:
-        with open('data/print_history.json', 'r') as f:
-            data = json.load(f)
-        print("[log_print_history] Bestehende Historie geladen")
-    except FileNotFoundError:
-        data = []
-        print("[log_print_history] Keine bestehende Historie – neue Datei wird erstellt")
-
-    data.append(record)
-    with open('data/print_history.json', 'w') as f:
-        json.dump(data, f, indent=2)
+    print_history.append(record)
     print(f"[log_print_history] Historie aktualisiert\n")
 
 @app.route("/spools")
 def get_spool_list():
     return jsonify(spool_db)  # Liste von Spulen-Objekten für die DB-Anzeige
 
+def spool_weights(printer):
+    return { s["usage"]["slot"]: s["data"]["remaining_g"] for s in spool_index.of_printer(printer.name) if s["usage"]["slot"] is not None }
+
 @app.route("/spool_weights")
-def get_spool_weights():
-    return jsonify({ s["usage"]["slot"]: s["data"]["remaining_g"] for s in spool_db if s["usage"]["slot"] is not None })
+@app.route("/printer/<name>/spool_weights")
+def get_spool_weights(name=None):
+    return jsonify(spool_weights(get_printer(name)))
+
+def status_payload(printer):
+    # ohne API-Statistik: die ändert sich mit jedem Poll und würde jede Dashboard-Version ungültig machen
+    cur = printer.state.snapshot()   # alle Werte aus demselben Stand
+    return {
+        'tool_state': cur.tool_state,
+        'tool_progress': cur.tool_progress,
+        'tool_job': cur.tool_job,
+        'tool_live': cur.tool_live,
+        'tool_mmu': cur.tool_mmu,
+        'download': {
+            'bytes_done': cur.download_bytes,
+            'bytes_total': cur.download_total,
+            'rate_bps': round(cur.download_rate),
+        },
+    }
 
 @app.route('/status')
-def status():
-    return jsonify({
-        'tool_state': settings.tool_state,
-        'tool_progress': settings.tool_progress,
-        'tool_job': settings.tool_job,
-        'tool_live': settings.tool_live,
-        'tool_mmu': settings.tool_mmu
-    })
-
+@app.route('/printer/<name>/status')
+def status(name=None):
+    printer = get_printer(name)
+    return jsonify(dict(status_payload(printer), api=printer.client.stats()))
+
+@app.route('/printers')
+def get_printers():
+    return jsonify([{ "name": p.name, "ip": p.ip, "status": status_payload(p) } for p in PRINTERS.values()])
         
 @app.route('/refill', methods=['POST'])
-def refill_endpoint():
-    global usage_history, densities
-    new_state = refill_spools(usage_history, densities)
+@app.route('/printer/<name>/refill', methods=['POST'])
+def refill_endpoint(name=None):
+    printer = get_printer(name)
+    new_state = refill_spools(printer, printer.usage_history, printer.state.densities)
     return jsonify(new_state), 200
 
 
 @app.route('/reset')
+@spools_locked
 def refillforce_endpoint():
     # Falls „Reset“ das Gewicht zurücksetzen soll (z. B. auf 1000g):
     global spool_db
@@ -222,12 +304,9 @@ def index():
     - Alle Spulen unten (spool_db)
     - Statusbar am unteren Rand
     """
+    printer = default_printer()
     # 1) Mapping aktive Spulen: slot -> Restgewicht
-    active_spools = {}
-    for entry in spool_db:
-        slot = entry['usage']['slot']
-        if slot is not None:
-            active_spools[slot] = entry['data']['remaining_g']
+    active_spools = spool_weights(printer)
 
     # 2) Nur diese Slots für Chart/Color
     tool_indices = list(active_spools.keys())
@@ -240,30 +319,52 @@ def index():
         tool_colors=tool_colors,
         max_weight=1000,
         spool_db=spool_db,
-        tool_state=settings.tool_state,
-        tool_live=settings.tool_live,
-        tool_progress=settings.tool_progress,
-        tool_job=settings.tool_job,
-        tool_mmu=settings.tool_mmu
+        tool_state=printer.state.tool_state,
+        tool_live=printer.state.tool_live,
+        tool_progress=printer.state.tool_progress,
+        tool_job=printer.state.tool_job,
+        tool_mmu=printer.state.tool_mmu,
+        printers=list(PRINTERS)
     )
 
 
 @app.route('/data')
-def data():
-    return jsonify(usage_history)
+@app.route('/printer/<name>/data')
+def data(name=None):
+    """
+    Ohne Parameter die ganze Liste. Mit ?since=<cursor> nur neue Einträge:
+    {"cursor": ..., "reset": bool, "entries": [...]}; reset=true heißt Chart leeren,
+    entries enthält dann die ganze Liste.
+    """
+    printer = get_printer(name)
+    since = request.args.get('since')
+    if since is None:
+        return jsonify(printer.usage_history)
+    history, gen = printer.usage_history, printer.usage_history_gen
+    try:
+        since_gen, since_len = (int(x) for x in since.split(':'))
+    except ValueError:
+        since_gen, since_len = None, 0
+    reset = since_gen != gen or since_len > len(history)
+    start = 0 if reset else since_len
+    return jsonify({"cursor": f"{gen}:{len(history)}", "reset": reset, "entries": history[start:]})
     
 @app.route('/delete_spool/<id>', methods=['POST'])
+@spools_locked
 def delete_spool(id):
     global spool_db
     before = len(spool_db)
     spool_db = [s for s in spool_db if s['id'] != id]
     if len(spool_db) < before:
-        save_spool_db(spool_db)
+        spool_index.rebuild(spool_db)
+        spool_store.delete(spool_db, id)
+        notify_printers()
         return '', 204
     else:
         return 'Spule nicht gefunden', 404
     
 @app.route('/add_spool', methods=['POST'])
+@spools_locked
 def add_spool():
     global spool_db
     new_spool = {
@@ -275,10 +376,11 @@ def add_spool():
         "usage": { "slot": None }
     }
     spool_db.append(new_spool)
-    save_spool_db(spool_db)
+    save_spools(new_spool)
     return jsonify(new_spool), 201
     
 @app.route('/update_spool', methods=['POST'])
+@spools_locked
 def update_spool():
     global spool_db
     data = request.get_json()
@@ -286,9 +388,10 @@ def update_spool():
     field = data.get("field")
     value = data.get("value")
 
-    target_spool = next((s for s in spool_db if s['id'] == id), None)
+    target_spool = spool_index.get(id)
     if not target_spool:
         return 'Spule nicht gefunden', 404
+    changed = [target_spool]
 
     if field in ('name', 'material', 'color'):
         target_spool[field] = value
@@ -310,134 +413,225 @@ def update_spool():
         except (ValueError, TypeError):
             new_slot = None
 
-        if new_slot is not None:
-            conflicting = next((s for s in spool_db if s['usage']['slot'] == new_slot and s['id'] != id), None)
-            if conflicting:
-                conflicting['usage']['slot'] = None
         target_spool['usage']['slot'] = new_slot
+        changed += release_slot(target_spool)
+    elif field == 'printer':
+        if value not in PRINTERS:
+            return f"Unbekannter Drucker {value}", 400
+        target_spool['usage']['printer'] = value
+        changed += release_slot(target_spool)
     else:
         return "Ungültiges Feld", 400
     now = datetime.now(ZoneInfo("Europe/Berlin"))
     target_spool['data']['last_used'] = now.strftime('%Y-%m-%dT%H:%M%z')
-    save_spool_db(spool_db)
+    save_spools(*changed)
     return '', 204
+
+def release_slot(spool):
+    """Andere Spulen desselben Druckers im Slot von spool verlieren ihren Slot; liefert sie zurück."""
+    slot, printer = spool['usage']['slot'], spool_printer(spool)
+    if slot is None:
+        return []
+    conflicting = [s for s in spool_index.in_slot(printer, slot) if s is not spool]
+    for s in conflicting:
+        s['usage']['slot'] = None
+    return conflicting
+
 @app.route('/set_spool_weight/<int:tool>/<weight>', methods=['POST'])
-def set_spool_weight(tool, weight):
+@app.route('/printer/<name>/set_spool_weight/<int:tool>/<weight>', methods=['POST'])
+@spools_locked
+def set_spool_weight(tool, weight, name=None):
+    printer = get_printer(name)
     try:
         w = float(weight)
     except ValueError:
         return "Ungültiges Gewicht", 400
 
     global spool_db
-    updated = False
+    updated = []
     now = datetime.now(ZoneInfo("Europe/Berlin"))
-    for entry in spool_db:
-        if entry['usage']['slot'] == tool:
-            entry['data']['remaining_g'] = w
-            entry['data']['first_used'] = entry['data']['first_used'] or now.strftime('%Y-%m-%dT%H:%M%z')
-            entry['data']['last_used'] = now.strftime('%Y-%m-%dT%H:%M%z')
-            updated = True
+    for entry in spool_index.in_slot(printer.name, tool):
+        entry['data']['remaining_g'] = w
+        entry['data']['first_used'] = entry['data']['first_used'] or now.strftime('%Y-%m-%dT%H:%M%z')
+        entry['data']['last_used'] = now.strftime('%Y-%m-%dT%H:%M%z')
+        updated.append(entry)
 
     if updated:
-        save_spool_db(spool_db)
+        save_spools(*updated)
         return ('', 204)
     else:
         return f"Kein Eintrag mit Slot {tool} gefunden", 404
         
+def history_response(spool_id=None):
+    """
+    ?limit=&offset= (vom neuesten Eintrag aus gezählt), ?since=&until= (ISO-Zeitpunkt).
+    Antwort bleibt eine chronologische Liste; Gesamtzahl der Treffer im Header X-Total-Count.
+    """
+    try:
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = parse_time(since) if since else None
+        until = parse_time(until) if until else None
+    except ValueError:
+        return "Ungültiger Zeitraum", 400
+    if (limit is not None and limit < 0) or offset < 0:
+        return "limit/offset dürfen nicht negativ sein", 400
+    records, total = print_history.query(spool_id, since, until, limit, offset)
+    response = jsonify(records)
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
 @app.route('/history')
 def get_history():
-    with open('data/print_history.json', 'r') as f:
-        return jsonify(json.load(f))
+    return history_response()
 
 @app.route('/history_by_spool/<spool_id>')
 def get_history_by_spool(spool_id):
-    with open('data/print_history.json', 'r') as f:
-        all_jobs = json.load(f)
-    relevant = [job for job in all_jobs if spool_id in job.get("spools", {})]
-    return jsonify(relevant)
+    return history_response(spool_id)
     
 @app.route('/noti')
-def get_notification():
-    return jsonify({ "noti": settings.noti })
+@app.route('/printer/<name>/noti')
+def get_notification(name=None):
+    return jsonify({ "noti": get_printer(name).state.noti })
+
+def dashboard_state(printer):
+    """Alles, was das Dashboard eines Druckers anzeigt – ein Schlüssel je bisherigem Poll-Endpoint."""
+    return {
+        "status": status_payload(printer),
+        "prognosis": prognosis_payload(printer),
+        "data_cursor": printer.data_cursor(),
+        "spool_weights": spool_weights(printer),
+        "spools": spool_db,
+        "noti": printer.state.noti,
+        "slot_override": printer.slot_map,
+        "history_mtime": print_history.mtime(),
+    }
 
-@app.route('/prognosis')
-def get_prognosis():
+def setup_printers(config=None):
+    """Drucker-Registry laden (printers.py), je Drucker ein EventBroker für /events und /snapshot."""
+    init_registry(config)
+    # Spulen ohne usage.printer gehören dem ersten Drucker
+    spool_index.rebuild(spool_db)
+    for printer in PRINTERS.values():
+        printer.broker = EventBroker(functools.partial(dashboard_state, printer))
+
+setup_printers()
+
+@app.route('/events')
+@app.route('/printer/<name>/events')
+def events(name=None):
+    """SSE: beim Verbinden 'snapshot', danach 'update' mit den geänderten Schlüsseln."""
+    return Response(get_printer(name).broker.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/snapshot')
+@app.route('/printer/<name>/snapshot')
+def snapshot(name=None):
+    """Gesamter Dashboard-Zustand in einer Antwort; unverändert → 304 über das ETag."""
+    broker = get_printer(name).broker
+    version, body = broker.snapshot()
+    etag = broker.etag(version)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    return Response(f'{{"version":{version},"state":{body}}}', mimetype='application/json', headers=headers)
+
+@app.route('/metrics')
+def get_metrics():
+    # Prometheus-Textformat; gerechnet wird nur hier, die Hot Paths zählen nur hoch
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache')
+def get_cache():
+    return jsonify({ "dir": cache.CACHE_DIR, "entries": cache.list_entries() })
+
+@app.route('/cache/purge', methods=['POST'])
+def purge_cache():
+    # ?key=<hash-präfix> löscht einen Eintrag, ?all=1 den ganzen Cache
+    key = request.args.get('key')
+    if key is None and request.args.get('all') == '1':
+        return jsonify({ "removed": cache.purge() })
+    if not key:
+        # leerer Präfix passt auf jeden Eintrag
+        abort(400, "key=<hash-präfix> oder all=1 angeben")
+    return jsonify({ "removed": cache.purge(key) })
+
+def prognosis_totals(printer, cur):
+    """
+    Slicer-Gramm je Slot nach printer.slot_map: {slot: g}, None = keine Prognose möglich.
+    cur ist ein Snapshot von printer.state. Neu berechnet nur, wenn sich Job-Metadaten oder
+    Mapping ändern (beide werden ersetzt, nicht verändert – der Vergleich über die Identität genügt).
+    printer.prognosis_basis: (slicing_g, densities, tool_mmu, slot_map, Ergebnis) der letzten Berechnung.
+    """
+    source, densities, mmu, slot_map, totals = printer.prognosis_basis
+    if (source is cur.slicing_g and densities is cur.densities
+            and mmu == cur.tool_mmu and slot_map is printer.slot_map):
+        return totals
+    source, densities, mmu, slot_map = cur.slicing_g, cur.densities, cur.tool_mmu, printer.slot_map
     try:
-        if not settings.tool_state in ("PRINTING", "PAUSED") or settings.tool_live in ('file', 'blocked'):
-            return jsonify({})
-
-        if not settings.slicing_g:
-            print("⚠️  Keine Prognose möglich – keine Slicer-Metadaten gefunden.")
-            return jsonify({})
-
-        # Step 1: Override-Mapping vorbereiten
-        slot_map = temporary_slot_map
-        used_available = settings.tool_live == 'live'
-
-        # Step 2: usage_history remappen
-        remapped_history = [
-            (progress, apply_slot_override(usage_dict))
-            for progress, usage_dict in usage_history
-        ]
-
-        # Step 3: slicing_g und densities remappen
-        slicing_g = remap_metadata_list(settings.slicing_g, slot_map)
-        densities = remap_metadata_list(settings.densities, slot_map)
-
-        prognosis = {}
-
-        if settings.tool_mmu:
-            for slot in range(len(slicing_g)):
-                total_g = slicing_g[slot] if slot < len(slicing_g) else 0.0
-
-                if used_available:
-                    used_g = sum(
-                        mm_to_g(u, densities[slot])
-                        for _, u_dict in remapped_history
-                        for s, u in u_dict.items()
-                        if s == slot
-                    )
-                    rest_g = max(0.0, total_g - used_g)
-
-                for spool in spool_db:
-                    if spool["usage"]["slot"] == slot:
-                        actual = spool["data"]["remaining_g"]
-                        prognosis[slot] = actual - total_g
+        slicing_g = remap_metadata_list(source, slot_map)
+        # wie bisher: ohne remappbare Dichte-Liste keine Prognose
+        remap_metadata_list(densities, slot_map)
+        if mmu:
+            totals = {slot: slicing_g[slot] for slot in range(len(slicing_g))}
         else:
             # non-MMU Fall → Slot 5
-            total_g = slicing_g if isinstance(slicing_g, float) else sum(slicing_g)
+            totals = {5: slicing_g if isinstance(slicing_g, float) else sum(slicing_g)}
+    except Exception as e:
+        print("❌ Fehler in /prognosis:", e)
+        totals = None
+    printer.prognosis_basis = (source, densities, mmu, slot_map, totals)
+    return totals
 
-            if used_available:
-                used_g = sum(
-                    mm_to_g(u, densities)
-                    for _, u_dict in remapped_history
-                    for u in u_dict.values()
-                )
-                rest_g = max(0.0, total_g - used_g)
+def prognosis_payload(printer):
+    """Prognose Restgewicht je Slot nach dem Druck (für /prognosis und /events)."""
+    cur = printer.state.snapshot()
+    if not cur.tool_state in ("PRINTING", "PAUSED") or cur.tool_live in ('file', 'blocked'):
+        return {}
 
-            non_mmu_spool = next((s for s in spool_db if s["usage"]["slot"] == 5), None)
-            if non_mmu_spool:
-                actual = non_mmu_spool["data"]["remaining_g"]
-                prognosis[5] = actual - total_g
+    if not cur.slicing_g:
+        print("⚠️  Keine Prognose möglich – keine Slicer-Metadaten gefunden.")
+        return {}
 
-        return jsonify(prognosis)
+    totals = prognosis_totals(printer, cur)
+    if not totals:
+        return {}
 
+    spools = spool_index.of_printer(printer.name)
+    try:
+        if cur.tool_mmu:
+            # bei mehreren Spulen im selben Slot zählt die letzte
+            remaining = {s["usage"]["slot"]: s["data"]["remaining_g"] for s in spools}
+        else:
+            non_mmu_spool = next((s for s in spools if s["usage"]["slot"] == 5), None)
+            remaining = {5: non_mmu_spool["data"]["remaining_g"]} if non_mmu_spool else {}
+        return {slot: remaining[slot] - total_g for slot, total_g in totals.items() if slot in remaining}
     except Exception as e:
         print("❌ Fehler in /prognosis:", e)
-        return jsonify({})
-        
+        return {}
+
+@app.route('/prognosis')
+@app.route('/printer/<name>/prognosis')
+def get_prognosis(name=None):
+    return jsonify(prognosis_payload(get_printer(name)))
+
 @app.route('/slot_override')
-def get_slot_override():
-    return jsonify(temporary_slot_map)
+@app.route('/printer/<name>/slot_override')
+def get_slot_override(name=None):
+    return jsonify(get_printer(name).slot_map)
 
 @app.route('/slot_override', methods=['POST'])
-def set_slot_override():
-    global temporary_slot_map
+@app.route('/printer/<name>/slot_override', methods=['POST'])
+def set_slot_override(name=None):
+    printer = get_printer(name)
     try:
         data = request.get_json()
         # Umwandlung sicherstellen: Schlüssel und Werte als int
-        temporary_slot_map = {int(k): int(v) for k, v in data.items()}
-        print(f"[Override] Temporäres Mapping gesetzt: {temporary_slot_map}")
+        printer.slot_map = {int(k): int(v) for k, v in data.items()}
+        print(f"[Override] Temporäres Mapping {printer.name} gesetzt: {printer.slot_map}")
+        printer.broker.trigger()
         return jsonify(success=True)
     except Exception as e:
         print(f"❌ Fehler beim Setzen des Slot-Overrides: {e}")
@@ -487,16 +681,34 @@ def remap_metadata_list(meta_list, slot_map, count=6):
     print(f"➡️ Remapped-Liste: {remapped}")
     return remapped
     
-def apply_slot_override(usage_dict):
+def runout_thresholds(printer):
+    """Tool → mm, bei dem die zugeordnete Spule leer ist (Ereignisse für den PollScheduler)."""
+    cur = printer.state.snapshot()
+    remaining = spool_weights(printer)
+    # non-MMU: Verbrauch läuft unter Tool 5 (analyzer.ToolUsage), Spule in Slot 5 wie bei /prognosis
+    tools = range(cur.tool_count_mmu) if cur.tool_mmu else [5]
+    thresholds = {}
+    for tool in tools:
+        slot = printer.slot_map.get(tool, tool)
+        if slot not in remaining:
+            continue
+        try:
+            density = cur.densities[tool] if isinstance(cur.densities, list) else cur.densities
+        except IndexError:
+            density = 1.24
+        thresholds[tool] = max(remaining[slot], 0.0) / mm_to_g(1.0, density)
+    return thresholds
+
+def apply_slot_override(usage_dict, slot_map):
     """
-    Gibt eine remappte Kopie von usage_dict zurück basierend auf temporary_slot_map.
+    Gibt eine remappte Kopie von usage_dict zurück basierend auf slot_map (Printer.slot_map).
     Werte werden ersetzt, nicht addiert. Nicht gemappte Werte bleiben erhalten.
     """
     print("\n[apply_slot_override] Start")
     print(f"Original usage_dict: {usage_dict}")
-    print(f"Aktives Mapping: {temporary_slot_map}")
+    print(f"Aktives Mapping: {slot_map}")
 
-    if not temporary_slot_map:
+    if not slot_map:
         print("ℹ️ Kein Mapping aktiv – Original usage_dict wird zurückgegeben")
         return usage_dict.copy()
 
@@ -504,10 +716,10 @@ def apply_slot_override(usage_dict):
     assigned = {}
 
     for orig_tool, value in usage_dict.items():
-        if orig_tool not in temporary_slot_map:
+        if orig_tool not in slot_map:
             continue
 
-        new_tool = temporary_slot_map[orig_tool]
+        new_tool = slot_map[orig_tool]
 
         if new_tool in assigned and assigned[new_tool] != orig_tool:
             print(f"⚠️ Konflikt: Ziel-Slot {new_tool} wurde bereits durch Tool {assigned[new_tool]} gemappt – Tool {orig_tool} wird ignoriert")
@@ -525,150 +737,326 @@ def apply_slot_override(usage_dict):
     print(f"➡️ Remapped usage_dict: {remapped}")
     return remapped
     
-def main():
-    global usage_history
-    init_spools()
+def shutdown(signum, frame):
+    print(f"Signal {signum} – speichere Spulen-DB und beende")
+    spool_store.flush()
+    os._exit(0)
+
+def begin_job(printer, meta):
+    """Job-Metadaten übernehmen; liefert (filament used [mm], stamping distance)."""
+    state = printer.state
+    tools = meta['nozzle_diameter']
+    slicing_m = meta['filament used [mm]']
+    stamping = meta['filament_stamping_distance']
+
+    # Job-Metadaten in einem Schritt: /prognosis sieht nie Gramm des neuen und MMU-Flag des alten Jobs
+    state.update(
+        slicing_g=meta['filament used [g]'],
+        densities=meta['filament_density'],
+        tool_mmu=type(tools) != float,
+    )
+    print(f"{type(tools)} Tools used for this print {tools}. MMU is {state.tool_mmu}")
+    return slicing_m, stamping
+
+def load_job(printer, gcode_path, cache_key, pipe=None):
+    """
+    Metadaten, begin_job und Verbrauchsindex; liefert (slicing_m, stamping, Index).
+    Mit pipe aus der laufenden Pipeline (PipelineError, wenn sie vor den Metadaten abbricht).
+    """
+    meta = parse_gcode_metadata(gcode_path, cache_key, pipe=pipe)
+    slicing_m, stamping = begin_job(printer, meta)
+    # Einmaliger Index-Durchlauf: danach ist jeder Fortschritt nur noch ein Lookup
+    usage_index = index_gcode(gcode_path, stamping, printer.state.tool_mmu, cache_key=cache_key, pipe=pipe)
+    # schneller pollen kurz vor Werkzeugwechseln und leeren Spulen
+    printer.scheduler.watch(usage_index, runout_thresholds(printer))
+    return slicing_m, stamping, usage_index
+
+def end_job(printer, filename, usage, slicing_m):
+    """Nach der Live-Analyse: Remapping, Vergleich, Spulen abbuchen, Historie. Liefert den beendeten Job."""
+    state = printer.state
+    print(f"[{printer.name}] LIVE END")
+    printer.scheduler.clear()
+    remapped_history = [(progress, apply_slot_override(usage, printer.slot_map)) for progress, usage in printer.usage_history]
+    remapped_usage = apply_slot_override(usage, printer.slot_map)
+    printer.set_usage_history(remapped_history)
+    usage = remapped_usage
+    cur = state.snapshot()
+    print("\nDruck beendet. Vergleich:")
+    try:
+        if cur.tool_mmu:
+          tool_range = range(cur.tool_count_mmu)
+          for t in range(cur.tool_count_mmu):
+            calc_g=mm_to_g(usage.get(t,0.0),cur.densities[t]); sl_g=cur.slicing_g[t] if t<len(cur.slicing_g) else 0.0
+            print(f" T{t}: berechnet {calc_g:.1f}g vs slicer {sl_g:.1f}g diff {calc_g-sl_g:+.1f}g")
+            calc_m=usage.get(t,0.0); sl_m=slicing_m[t] #if t<len(slicing_m) else 0.0
+            print(f" T{t}: berechnet {calc_m:.1f}mm vs slicer {sl_m:.1f}mm diff {calc_m-sl_m:+.1f}mm")
+        else:
+            calc_g=mm_to_g((list(usage.values())[-1]),cur.densities); sl_g=cur.slicing_g
+            print(f" T{cur.tool_count}: berechnet {calc_g:.1f}g vs slicer {sl_g:.1f}g diff {calc_g-sl_g:+.1f}g")
+            calc_m=(list(usage.values())[-1]); sl_m=slicing_m
+            print(f" T{cur.tool_count}: berechnet {calc_m:.1f}mm vs slicer {sl_m:.1f}mm diff {calc_m-sl_m:+.1f}mm")
+    except Exception as e:
+            print("❌ error in Main final:", e)    
+    
+    #if ((state.tool_state in ('FINISHED')) or (progress >= 100) or (not  doSync)) and state.prusa_usage: # Extrude purge line is not included in Prusa Slicer Concumptions. Dont use this for the moment 
+    #  print(f"Printer is {progress} and marked as {state.tool_state}. Not synchronise anymore")  
+    #  usage_history = add_slicer_to_usage(usage_history, slicing_m, densities)
+    #  print(f"finally add slicer values {usage_history}")
+    old_job_progressed = cur.tool_job
+    print(f"[main {datetime.now().strftime('%H:%M:%S')} ] {printer.name} DO REFILL")
+    refill_spools(printer, printer.usage_history, cur.densities)
+    print(f"[main {datetime.now().strftime('%H:%M:%S')} ] {printer.name} DO LOGS")
+    log_print_history(printer, filename, usage, cur.densities, [s["usage"]["slot"] for s in spool_index.of_printer(printer.name)])
+    printer.set_usage_history([])
+    print(f"[main {datetime.now().strftime('%H:%M:%S')} ] {printer.name} usage_history geleert")
+    state.update(noti="CleanUp")
+    print(f"[main {datetime.now().strftime('%H:%M:%S')} ] {printer.name} CLEAN UP")
+    return old_job_progressed
+
+def job_gone(old_job_progressed):
+    # der alte Job ist vom Drucker verschwunden – meldet der ProgressMonitor bzw. engine.poll_loop
+    return lambda cur: not (cur.tool_job is not None or old_job_progressed == cur.tool_job)
+
+def stop_monitoring(printer):
+    printer.state.update(
+        tool_progress = "-",
+        tool_state = "NO MONITORING",   # PRINTING, PAUSED, etc.
+        tool_job = "NO MONITORING", # file
+        tool_live = "NO MONITORING",
+    )
+
+def run_printer(printer, input_file=None):
+    """Überwachungsschleife eines Druckers (eigener Thread, MONITOR_ENGINE=threads); input_file: lokale Datei einmal analysieren."""
+    state = printer.state
     pm = None
-    # Starte Webserver im Hintergrund
-    threading.Thread(target=app.run, kwargs={'host':'0.0.0.0','port':WEB_PORT}, daemon=False).start()
-    print(f"Webserver läuft auf http://0.0.0.0:{WEB_PORT}")
     run_looping = True
-    settings.reboot = False
-    if len(sys.argv)==2: 
-      file_analyse = True
-    else:
-      file_analyse = False
-    while run_looping and not settings.reboot:
+    state.update(reboot=False)
+    file_analyse = input_file is not None
+    while run_looping and not state.reboot:
         gcode_path = ""
         meta = ""
         slicing =  ""
         densities = ""
         stamping =  ""
 
-        settings.init(password, ip)
+        printer.reset()
         # Starte ProgressMonitor-Thread
         #pm = ProgressMonitor()
         #pm.start()
         #ProgressMonitor_thread_fn
         if pm is None or not pm.is_alive():
-            pm = threading.Thread(target = ProgressMonitor_thread_fn)
+            pm = threading.Thread(target = ProgressMonitor_thread_fn, args=(printer,), name=f"monitor-{printer.name}")
             pm.start()
         else:
             print("ProgressMonitor_thread_fn already running")
         # G-Code-Datei ermitteln und vorbereiten
+        remote = None
         if file_analyse:
-            inp=sys.argv[1]; filename=os.path.basename(inp); dl=False
-            settings.tool_live = 'file'
+            inp=input_file; filename=os.path.basename(inp); dl=False
+            state.update(tool_live='file')
             file_analyse = False
             #run_looping = False
         else:
-            settings.noti = "" 
-            job_init = init_wait_for_job()
+            state.update(noti="")
+            job_init = init_wait_for_job(printer)
             filename = job_init['file']['display_name']
+            remote = remote_key(job_init['file'])   # Cache-Suche schon vor dem Download
             dl=True
             inp=None
             #filename = job_init.get('file').get('display_name')
-        settings.noti = "" 
-        gcode_path = prepare_gcode(inp, filename, use_download=dl)
-
-        print(f"State {settings.tool_state}  ")
-        # Metadaten einlesen
-        meta = parse_gcode_metadata(gcode_path)
-        
-        tools = meta['nozzle_diameter']
-        settings.slicing_g = meta['filament used [g]']
-        slicing_m = meta['filament used [mm]']
-        settings.densities = meta['filament_density']
-        stamping = meta['filament_stamping_distance']
-
-        if type(tools) != float:    
-            settings.tool_mmu = True
-        else:
-            settings.tool_mmu = False
-        print(f"{type(tools)} Tools used for this print {tools}. MMU is {settings.tool_mmu}")
+        state.update(noti="")
+        pipe = start_pipeline(printer, filename, use_download=dl, remote=remote)
+        gcode_path, cache_key = prepare_gcode(printer, inp, filename, use_download=dl, pipe=pipe)
+        if not pipe:
+            cache.store_alias(remote, cache_key)
+
+        print(f"[{printer.name}] State {state.tool_state}  ")
+        # Metadaten einlesen und indexieren
+        try:
+            slicing_m, stamping, usage_index = load_job(printer, gcode_path, cache_key, pipe)
+        except PipelineError:
+            # Pipeline vor den Metadaten abgebrochen: Download abwarten, klassisch analysieren
+            gcode_path, cache_key = pipeline_fallback(printer, pipe)
+            pipe = None
+            slicing_m, stamping, usage_index = load_job(printer, gcode_path, cache_key)
         
         # Aufruf des Generators live_analyze:
         # live_analyze yieldet fortlaufend (progress, usage_dict).
-        usage_history = []  # runtime data populated by monitor
-        remapped_history = []
-        if settings.tool_live in ('file', 'blocked') or not dl:
+        printer.set_usage_history([])  # runtime data populated by monitor
+        if state.tool_live in ('file', 'blocked') or not dl:
           doSync = False
-          settings.noti = "no sync"
+          state.update(noti="no sync")
         else:
           doSync = True      
           
-        gen = live_analyze_gen(gcode_path, slicing_m, densities, stamping, sync=doSync)
-        for progress, usage in gen:
-            # Hier wird der Generator konsumiert!
-            # Zwischenstände landen in usage_history via yield und Flask-/Data-Endpoint.
-            usage_history.append((progress, usage))
+        gen = live_analyze_gen(printer, gcode_path, slicing_m, densities, stamping, sync=doSync, index=usage_index)
+        while gen is not None:
+          try:
+            for progress, usage in gen:
+                # Hier wird der Generator konsumiert!
+                # Zwischenstände landen in usage_history via yield und Flask-/Data-Endpoint.
+                printer.usage_history.append((progress, usage))
+                printer.broker.trigger()
             
-            #print(f"Generator liefert: {progress:.1f}% - {usage}. State {settings.tool_state}")
-
-          # Externen Abbruch erkennen:
-            if (doSync) and (settings.tool_state in ('CANCELLED', 'ERROR', 'IDLE','FINISHED', 'STOPPED')):
-                if (settings.tool_state in ( 'FINISHED')): settings.tool_progress=100
-                print(f"{settings.tool_state} erkannt, beende Live-Analyse!")
-                gen.close()   # wirft GeneratorExit INSIDE dem Generator
-                break
-            if settings.reboot or settings.reboot_analzye:
-                print(f"settings.reboot {settings.reboot} settings.reboot_analzye {settings.reboot_analzye} erkannt, beende Live-Analyse!")
-                gen.close()   # wirft GeneratorExit INSIDE dem Generator
-                break
-        if settings.noti=="Analyse Offline" or settings.noti=="Analyse Online": settings.noti=""
-        print("LIVE END")
-        remapped_history = [(progress, apply_slot_override(usage)) for progress, usage in usage_history]
-        remapped_usage = apply_slot_override(usage)
-        usage_history = remapped_history
-        usage = remapped_usage
-        print("\nDruck beendet. Vergleich:")
-        try:
-            if settings.tool_mmu:
-              tool_range = range(settings.tool_count_mmu)
-              for t in range(settings.tool_count_mmu):
-                calc_g=mm_to_g(usage.get(t,0.0),settings.densities[t]); sl_g=settings.slicing_g[t] if t<len(settings.slicing_g) else 0.0
-                print(f" T{t}: berechnet {calc_g:.1f}g vs slicer {sl_g:.1f}g diff {calc_g-sl_g:+.1f}g")
-                calc_m=usage.get(t,0.0); sl_m=slicing_m[t] #if t<len(slicing_m) else 0.0
-                print(f" T{t}: berechnet {calc_m:.1f}mm vs slicer {sl_m:.1f}mm diff {calc_m-sl_m:+.1f}mm")
-            else:
-                calc_g=mm_to_g((list(usage.values())[-1]),settings.densities); sl_g=settings.slicing_g
-                print(f" T{settings.tool_count}: berechnet {calc_g:.1f}g vs slicer {sl_g:.1f}g diff {calc_g-sl_g:+.1f}g")
-                calc_m=(list(usage.values())[-1]); sl_m=slicing_m
-                print(f" T{settings.tool_count}: berechnet {calc_m:.1f}mm vs slicer {sl_m:.1f}mm diff {calc_m-sl_m:+.1f}mm")
-        except Exception as e:
-                print("❌ error in Main final:", e)    
-        
-        #if ((settings.tool_state in ('FINISHED')) or (progress >= 100) or (not  doSync)) and settings.prusa_usage: # Extrude purge line is not included in Prusa Slicer Concumptions. Dont use this for the moment 
-        #  print(f"Printer is {progress} and marked as {settings.tool_state}. Not synchronise anymore")  
-        #  usage_history = add_slicer_to_usage(usage_history, slicing_m, densities)
-        #  print(f"finally add slicer values {usage_history}")
-        old_job_progressed = settings.tool_job
-        print(f"[main {datetime.now().strftime('%H:%M:%S')} ] DO REFILL")
-        refill_spools(usage_history, settings.densities)
-        print(f"[main {datetime.now().strftime('%H:%M:%S')} ]  DO LOGS")
-        log_print_history(filename, usage, settings.densities, [s["usage"]["slot"] for s in spool_db])
-        usage_history = []
-        print(f"[main {datetime.now().strftime('%H:%M:%S')} ]  usage_history geleert")
-        settings.noti = "CleanUp"
-        print(f"[main {datetime.now().strftime('%H:%M:%S')} ] CLEAN UP")
-        if settings.tool_job is not None or old_job_progressed == settings.tool_job:
-          print(f"[main {datetime.now().strftime('%H:%M:%S')} ] WAIT MORE TO CLEAN UP")
-          time.sleep(10)
-        if settings.tool_job is not None or old_job_progressed == settings.tool_job:
-          print(f"[main {datetime.now().strftime('%H:%M:%S')} ] WAIT EVEN MORE TO CLEAN UP")
-          time.sleep(25)
-        settings.noti = ""
-        print(f"[main {datetime.now().strftime('%H:%M:%S')} ] Resume Monitoring. Old Job: {old_job_progressed}. New Job: {settings.tool_job}")
+                #print(f"Generator liefert: {progress:.1f}% - {usage}. State {state.tool_state}")
+
+              # Externen Abbruch erkennen:
+                if (doSync) and (state.tool_state in ('CANCELLED', 'ERROR', 'IDLE','FINISHED', 'STOPPED')):
+                    if (state.tool_state in ( 'FINISHED')): state.update(tool_progress=100)
+                    print(f"{state.tool_state} erkannt, beende Live-Analyse!")
+                    gen.close()   # wirft GeneratorExit INSIDE dem Generator
+                    break
+                if state.reboot or state.reboot_analzye:
+                    print(f"reboot {state.reboot} reboot_analzye {state.reboot_analzye} erkannt, beende Live-Analyse!")
+                    gen.close()   # wirft GeneratorExit INSIDE dem Generator
+                    break
+            gen = None
+          except PipelineError:
+            # Pipeline-Index abgebrochen: weiter mit der fertig geladenen Datei ohne Pipeline
+            gcode_path, cache_key = pipeline_fallback(printer, pipe)
+            pipe = None
+            slicing_m, stamping, usage_index = load_job(printer, gcode_path, cache_key)
+            gen = live_analyze_gen(printer, gcode_path, slicing_m, densities, stamping, sync=doSync, index=usage_index)
+        clear_analysis_noti(state)
+        old_job_progressed = end_job(printer, filename, usage, slicing_m)
+        # warten, bis der alte Job vom Drucker verschwunden ist
+        gone = job_gone(old_job_progressed)
+        if not gone(state.snapshot()):
+          print(f"[main {datetime.now().strftime('%H:%M:%S')} ] {printer.name} WAIT MORE TO CLEAN UP")
+          state.wait_for(gone, 10)
+        if not gone(state.snapshot()):
+          print(f"[main {datetime.now().strftime('%H:%M:%S')} ] {printer.name} WAIT EVEN MORE TO CLEAN UP")
+          state.wait_for(gone, 25)
+        state.update(noti="")
+        print(f"[main {datetime.now().strftime('%H:%M:%S')} ] {printer.name} Resume Monitoring. Old Job: {old_job_progressed}. New Job: {state.tool_job}")
 
     # Cleanup
-    stop_event.set()
-    print("Stop")
+    spool_store.flush()
+    printer.stop_event.set()
+    print(f"Stop {printer.name}")
     pm.join()
-    print("END")
-    settings.tool_progress = "-"
-    settings.tool_state = "NO MONITORING"   # PRINTING, PAUSED, etc.
-    settings.tool_job = "NO MONITORING" # file
-    settings.tool_live = "NO MONITORING"
+    print(f"END {printer.name}")
+    stop_monitoring(printer)
+
+async def run_printer_async(printer, input_file=None):
+    """
+    Wie run_printer als asyncio-Task (engine.py): Poll-Task statt ProgressMonitor-Thread,
+    Warten auf Job, Druckstart, Datei und Fortschritt über Zustandsänderungen,
+    Metadaten/Index im Executor.
+    """
+    state = printer.state
+    waiter = engine.StateWaiter(state)
+    poll = None
+    state.update(reboot=False)
+    try:
+        while not state.reboot:
+            printer.reset()
+            if poll is None or poll.done():
+                poll = asyncio.create_task(engine.poll_loop(printer), name=f"poll-{printer.name}")
+            remote = None
+            if input_file is not None:
+                inp=input_file; filename=os.path.basename(inp); dl=False
+                state.update(tool_live='file')
+                input_file = None
+            else:
+                state.update(noti="")
+                job_init = await engine.wait_for_job(printer, waiter)
+                filename = job_init['file']['display_name']
+                remote = remote_key(job_init['file'])
+                dl=True
+                inp=None
+            state.update(noti="")
+            pipe = start_pipeline(printer, filename, use_download=dl, remote=remote)
+            gcode_path, cache_key = await engine.prepare_gcode(printer, waiter, inp, filename, dl, pipe)
+            if not pipe:
+                cache.store_alias(remote, cache_key)
+
+            print(f"[{printer.name}] State {state.tool_state}  ")
+            try:
+                slicing_m, stamping, usage_index = await engine.parse(load_job, printer, gcode_path, cache_key, pipe)
+            except PipelineError:
+                # Pipeline vor den Metadaten abgebrochen: Download abwarten, klassisch analysieren
+                gcode_path, cache_key = await engine.in_executor(pipeline_fallback, printer, pipe)
+                pipe = None
+                slicing_m, stamping, usage_index = await engine.parse(load_job, printer, gcode_path, cache_key)
+
+            printer.set_usage_history([])
+            doSync = not (state.tool_live in ('file', 'blocked') or not dl)
+            if not doSync:
+                state.update(noti="no sync")
+            usage = {}
+            gen = engine.live_analyze(printer, waiter, usage_index, sync=doSync)
+            while gen is not None:
+                current, gen = gen, None
+                try:
+                    async for progress, usage in current:
+                        printer.usage_history.append((progress, usage))
+                        printer.broker.trigger()
+                        # Externen Abbruch erkennen:
+                        if doSync and state.tool_state in ('CANCELLED', 'ERROR', 'IDLE','FINISHED', 'STOPPED'):
+                            if state.tool_state == 'FINISHED': state.update(tool_progress=100)
+                            print(f"{state.tool_state} erkannt, beende Live-Analyse!")
+                            break
+                        if state.reboot or state.reboot_analzye:
+                            print(f"reboot {state.reboot} reboot_analzye {state.reboot_analzye} erkannt, beende Live-Analyse!")
+                            break
+                except PipelineError:
+                    # Pipeline-Index abgebrochen: weiter mit der fertig geladenen Datei ohne Pipeline
+                    gcode_path, cache_key = await engine.in_executor(pipeline_fallback, printer, pipe)
+                    pipe = None
+                    slicing_m, stamping, usage_index = await engine.parse(load_job, printer, gcode_path, cache_key)
+                    gen = engine.live_analyze(printer, waiter, usage_index, sync=doSync)
+                finally:
+                    await current.aclose()
+            clear_analysis_noti(state)
+            # Abbuchen und Historie schreiben Dateien → nicht im Event-Loop
+            old_job_progressed = await engine.in_executor(end_job, printer, filename, usage, slicing_m)
+            gone = job_gone(old_job_progressed)
+            if not gone(state.snapshot()):
+                print(f"[main {datetime.now().strftime('%H:%M:%S')} ] {printer.name} WAIT MORE TO CLEAN UP")
+                await waiter.wait_for(gone, 35)
+            state.update(noti="")
+            print(f"[main {datetime.now().strftime('%H:%M:%S')} ] {printer.name} Resume Monitoring. Old Job: {old_job_progressed}. New Job: {state.tool_job}")
+    finally:
+        if poll is not None:
+            poll.cancel()
+        waiter.close()
+        printer.stop_event.set()   # laufenden Download beenden
+        spool_store.flush()
+        print(f"END {printer.name}")
+        stop_monitoring(printer)
+
+async def run_printers_async(input_file=None):
+    tasks = []
+    for printer in PRINTERS.values():
+        tasks.append(asyncio.create_task(run_printer_async(printer, input_file), name=f"printer-{printer.name}"))
+        input_file = None
+    # ein abgestürzter Drucker beendet nicht die anderen (wie ein Thread)
+    for printer, result in zip(PRINTERS.values(), await asyncio.gather(*tasks, return_exceptions=True)):
+        if isinstance(result, BaseException):
+            print(f"❌ Drucker {printer.name} beendet mit Fehler:")
+            traceback.print_exception(type(result), result, result.__traceback__)
+
+def main():
+    # der Webserver-Thread hält den Prozess am Leben, atexit allein reicht daher nicht
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    init_spools()
+    # Starte Webserver im Hintergrund
+    threading.Thread(target=app.run, kwargs={'host':'0.0.0.0','port':WEB_PORT}, daemon=False).start()
+    print(f"Webserver läuft auf http://0.0.0.0:{WEB_PORT}")
+    # eine Überwachungsschleife je Drucker; eine Datei auf der Kommandozeile analysiert der erste
+    input_file = sys.argv[1] if len(sys.argv)==2 else None
+    if engine.MONITOR_ENGINE == 'threads':
+        for printer in PRINTERS.values():
+            printer.thread = threading.Thread(target=run_printer, args=(printer, input_file), name=f"printer-{printer.name}")
+            printer.thread.start()
+            input_file = None
+        for printer in PRINTERS.values():
+            printer.thread.join()
+    else:
+        asyncio.run(run_printers_async(input_file))
+    spool_store.flush()
 
 if __name__ == '__main__':
     main()
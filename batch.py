@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Offline-Vorabprüfung vieler G-Code-Jobs gegen den aktuellen Spulenbestand.
+
+Analysiert alle .gcode/.bgcode-Dateien (Verzeichnisse werden durchsucht) parallel in
+einem Prozess-Pool: Metadaten wie parse_gcode_metadata, Verbrauch je Tool über den
+Verbrauchsindex (inkl. Stamping-Distance). Ergebnis je Datei und Tool in mm und g,
+als JSON oder CSV. Jobs, die die zugeordneten Spulen (Slot = Tool, Spulen-DB wie app.py)
+nicht abdecken, werden markiert; Exit-Code 2, wenn das auf mindestens einen Job zutrifft.
+
+Startet weder Webserver noch Drucker-Verbindung.
+
+CLI:
+  python batch.py jobs/ [weitere Dateien/Verzeichnisse] [--format json|csv] [--out datei]
+                  [--jobs N] [--printer NAME] [--cumulative]
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from monitor import PARSER_MODE, parse_gcode_metadata, index_gcode, finish_gcode, mm_to_g
+from printers import load_config
+from spool_store import open_store
+
+SPOOL_DB_FILE = os.path.join('data', 'spool_db.json')
+GCODE_EXTENSIONS = ('.gcode', '.bgcode')
+CSV_FIELDS = ('file', 'tool', 'mm', 'g', 'slicer_g', 'spool', 'remaining_g', 'short_g', 'ok')
+
+
+def find_jobs(paths):
+    """Dateien und Verzeichnisse (rekursiv) → sortierte Liste der G-Code-Dateien."""
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                jobs += [os.path.join(root, f) for f in files if f.lower().endswith(GCODE_EXTENSIONS)]
+        else:
+            jobs.append(path)
+    return sorted(jobs)
+
+
+def per_tool(value, tool):
+    """Metadatenwert eines Tools (Liste je Tool oder ein Wert für alle)."""
+    if isinstance(value, list):
+        return value[tool] if tool < len(value) else None
+    return value
+
+
+def _worker_init():
+    # Fortschrittsmeldungen aus monitor/analyzer nicht in die JSON/CSV-Ausgabe auf stdout
+    sys.stdout = sys.stderr
+
+
+def analyze_job(path, parser=PARSER_MODE):
+    """Verbrauch eines Jobs: {"file", "mmu", "tools": {tool: {"mm", "g", "slicer_g"}}} (läuft im Worker-Prozess)."""
+    try:
+        gcode_path, key = finish_gcode(path)
+        meta = parse_gcode_metadata(gcode_path, key)
+        mmu = type(meta['nozzle_diameter']) != float
+        index = index_gcode(gcode_path, meta['filament_stamping_distance'], mmu, parser, cache_key=key)
+        tools = {}
+        for tool, mm in sorted(index.usage_at(index.total_lines).items()):
+            density = per_tool(meta.get('filament_density'), tool)
+            tools[tool] = {
+                "mm": round(mm, 1),
+                "g": round(mm_to_g(mm, density if density is not None else 1.24), 2),
+                "slicer_g": per_tool(meta.get('filament used [g]'), tool),
+            }
+    except Exception as e:
+        return {"file": path, "error": f"{type(e).__name__}: {e}"}
+    return {"file": path, "mmu": mmu, "tools": tools}
+
+
+def load_stock(printer=None):
+    """Slot → Spule (id, remaining_g) der Spulen eines Druckers (Standard: erster Drucker)."""
+    default = load_config()[0]['name']
+    printer = printer or default
+    stock = {}
+    for spool in open_store(SPOOL_DB_FILE, delay=0).load():
+        slot = spool['usage']['slot']
+        if slot is not None and (spool['usage'].get('printer') or default) == printer:
+            # bei mehreren Spulen im selben Slot zählt die letzte (wie /prognosis)
+            stock[slot] = {"id": spool['id'], "remaining_g": spool['data']['remaining_g']}
+    return stock
+
+
+def check_stock(results, stock, cumulative=False):
+    """Spulen je Tool eintragen und Jobs markieren, die der Bestand nicht abdeckt."""
+    remaining = {slot: s["remaining_g"] for slot, s in stock.items()}
+    for result in results:
+        if "error" in result:
+            result["ok"] = False
+            continue
+        problems = []
+        for tool, usage in result["tools"].items():
+            usage["ok"] = True
+            if usage["g"] <= 0:
+                continue
+            spool = stock.get(tool)
+            usage["spool"] = spool["id"] if spool else None
+            usage["remaining_g"] = round(remaining[tool], 2) if spool else None
+            if spool is None:
+                usage["ok"] = False
+                problems.append(f"T{tool}: keine Spule zugeordnet")
+            elif remaining[tool] < usage["g"]:
+                usage["ok"] = False
+                usage["short_g"] = round(usage["g"] - remaining[tool], 2)
+                problems.append(f"T{tool}: {usage['short_g']:.1f} g zu wenig auf Spule {spool['id']}")
+            if spool is not None and cumulative:
+                # Jobs nacheinander gedruckt: der nächste Job sieht den Rest
+                remaining[tool] -= usage["g"]
+        result["ok"] = not problems
+        result["problems"] = problems
+    return results
+
+
+def write_json(results, out):
+    json.dump(results, out, indent=2, ensure_ascii=False)
+    out.write('\n')
+
+
+def write_csv(results, out):
+    writer = csv.DictWriter(out, CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for result in results:
+        if "error" in result:
+            writer.writerow({"file": result["file"], "ok": False})
+            continue
+        for tool, usage in result["tools"].items():
+            writer.writerow(dict(usage, file=result["file"], tool=tool))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="G-Code-Jobs offline gegen den Spulenbestand prüfen")
+    parser.add_argument('paths', nargs='+', help=".gcode/.bgcode-Dateien oder Verzeichnisse")
+    parser.add_argument('--format', choices=('json', 'csv'), default='json')
+    parser.add_argument('--out', help="Ausgabedatei (Standard: stdout)")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="Worker-Prozesse")
+    parser.add_argument('--printer', help="Spulen dieses Druckers (Standard: erster Drucker)")
+    parser.add_argument('--cumulative', action='store_true',
+                        help="Jobs nacheinander vom selben Bestand abziehen (Reihenfolge wie sortiert)")
+    args = parser.parse_args(argv)
+
+    jobs = find_jobs(args.paths)
+    if not jobs:
+        print("Keine .gcode/.bgcode-Dateien gefunden", file=sys.stderr)
+        return 1
+    print(f"[batch] {len(jobs)} Jobs, {args.jobs} Prozesse", file=sys.stderr)
+    with ProcessPoolExecutor(args.jobs, initializer=_worker_init) as pool:
+        results = list(pool.map(analyze_job, jobs))
+    check_stock(results, load_stock(args.printer), args.cumulative)
+
+    out = open(args.out, 'w', newline='') if args.out else sys.stdout
+    try:
+        (write_csv if args.format == 'csv' else write_json)(results, out)
+    finally:
+        if args.out:
+            out.close()
+    failed = [r for r in results if not r["ok"]]
+    for r in failed:
+        print(f"⚠️ {r['file']}: {r.get('error') or '; '.join(r['problems'])}", file=sys.stderr)
+    return 2 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Benchmarks ohne Drucker: erzeugt synthetische Jobs (gcode_gen.py) in mehreren Größen und misst
+
+- metadata_ms:        parse_gcode_metadata (Kopf/Ende bzw. voller Durchlauf)
+- analyze_*:          live_analyze_gen ohne Sync (Index + 100 Fortschrittsschritte):
+                      Sekunden, Zeilen/s, MB/s, Spitze der Python-Allokationen (tracemalloc)
+- parallel_*:         build_usage_index_parallel (nur mit --processes > 1)
+- bgcode_decode_*:    .bgcode-Dekodierung mit bgcode_reader.py (BGCODE_DECODER=python)
+- bgcode_convert_s:   convert_bgcode über das CLI-Tool 'bgcode' (nur wenn installiert)
+- <route>_p50_ms/_p95_ms: Flask-Endpoints über app.test_client() mit dem analysierten Job
+- persistence:        Spulen-DB (JSON, SQLite) speichern, Druckhistorie anhängen
+
+Durchsätze sind der beste von --repeat Durchläufen, Latenzen Median/95. Perzentil über --requests.
+Ergebnisse als JSON (--out). --compare vergleicht mit einer früheren Datei, z. B. der Baseline in
+benchmarks/; Abweichungen über --tolerance in die schlechte Richtung werden markiert (Exit-Code 1).
+Gemessen wird in einem temporären Arbeitsverzeichnis, data/ und der Cache bleiben unberührt.
+
+CLI:
+  python bench.py [--sizes 1,10,50] [--tools 5] [--tool-change-every 4000] [--retract 0.05]
+                  [--metadata full|minimal|none] [--seed 0] [--meatpack] [--processes N]
+                  [--repeat 3] [--requests 200] [--spools 50] [--no-memory]
+                  [--out ergebnis.json] [--compare benchmarks/baseline.json] [--tolerance 0.25]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+import tracemalloc
+from datetime import datetime
+import gcode_gen
+
+BASELINE_FILE = os.path.join('benchmarks', 'baseline.json')
+DEFAULT_SIZES = "1,10,50"
+ROUTES = {
+    "status": "/status",
+    "data": "/data",
+    "prognosis": "/prognosis",
+    "snapshot": "/snapshot",
+    "spools": "/spools",
+}
+
+
+_devnull = open(os.devnull, 'w')
+
+
+def quiet():
+    # Fortschrittsmeldungen von monitor/analyzer/app nicht in die Messung und die Ausgabe
+    return contextlib.redirect_stdout(_devnull)
+
+
+def measure(fn, *args, **kwargs):
+    """(Sekunden, Ergebnis) eines Aufrufs."""
+    t0 = time.perf_counter()
+    with quiet():
+        result = fn(*args, **kwargs)
+    return time.perf_counter() - t0, result
+
+
+def best_of(repeat, fn, *args, **kwargs):
+    """Kürzeste Zeit aus repeat Durchläufen (weniger Rauschen als ein einzelner) und das Ergebnis."""
+    runs = [measure(fn, *args, **kwargs) for _ in range(max(1, repeat))]
+    return min(t for t, _ in runs), runs[-1][1]
+
+
+def peak_mb(fn, *args, **kwargs):
+    """Spitze der Python-Allokationen während fn in MB (eigener Durchlauf, tracemalloc bremst)."""
+    tracemalloc.start()
+    try:
+        with quiet():
+            fn(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1] / (1 << 20)
+    finally:
+        tracemalloc.stop()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return pick(0.5) * 1000, pick(0.95) * 1000
+
+
+def sample_spools(n, tools):
+    rng = random.Random(0)
+    return [{
+        "id": f"{i:04X}",
+        "name": f"Spule {i}",
+        "material": "PLA",
+        "color": "Weiß",
+        "data": {"remaining_g": round(rng.uniform(50, 1000), 1), "tare_weight_g": 200,
+                 "first_used": None, "last_used": None},
+        "usage": {"slot": i if i < tools else None},
+    } for i in range(n)]
+
+
+def bench_job(size_mb, args, workdir):
+    from monitor import META_KEYS, INDEX_EVERY, parse_gcode_metadata, live_analyze_gen, convert_bgcode
+    from analyzer import build_usage_index_parallel
+    from printers import Printer
+    import bgcode_reader
+
+    path = os.path.join(workdir, f"job-{size_mb:g}mb.gcode")
+    stats = gcode_gen.generate(path, size_mb, args.tools, args.tool_change_every, args.retract, args.metadata, args.seed)
+    mb = stats["bytes"] / (1 << 20)
+    r = {"bytes": stats["bytes"], "lines": stats["lines"], "tool_changes": stats["tool_changes"]}
+
+    t, meta = best_of(args.repeat, parse_gcode_metadata, path)
+    r["metadata_ms"] = t * 1000
+    if not all(k in meta for k in META_KEYS):
+        # --metadata none: Analyse trotzdem messen, Werte wie bei gcode_gen
+        meta = dict(meta)
+        meta.setdefault('filament_stamping_distance', [gcode_gen.STAMPING_DISTANCE] * 5)
+    mmu = stats["mmu"]
+    stamping = meta['filament_stamping_distance']
+    printer = Printer("bench", None, None)
+    printer.state.update(tool_mmu=mmu)
+
+    def analyze():
+        return list(live_analyze_gen(printer, path, meta.get('filament used [mm]'), meta.get('filament_density'),
+                                     stamping, sync=False))
+
+    t, history = best_of(args.repeat, analyze)
+    r.update(analyze_s=t, analyze_lines_s=stats["lines"] / t, analyze_mb_s=mb / t)
+    if not args.no_memory:
+        r["analyze_peak_mb"] = peak_mb(analyze)
+    if args.processes > 1:
+        t, _ = best_of(args.repeat, build_usage_index_parallel, path, stamping, mmu, every=INDEX_EVERY, workers=args.processes)
+        r.update(parallel_s=t, parallel_lines_s=stats["lines"] / t, parallel_mb_s=mb / t)
+
+    bgcode = gcode_gen.to_bgcode(path, os.path.splitext(path)[0] + '.bgcode', args.meatpack)
+    t, decoded = best_of(args.repeat, lambda: sum(len(block) for block in bgcode_reader.iter_gcode_blocks(bgcode)))
+    r.update(bgcode_bytes=os.path.getsize(bgcode), bgcode_decode_s=t, bgcode_decode_mb_s=decoded / (1 << 20) / t)
+    if shutil.which('bgcode'):
+        t, _ = measure(convert_bgcode, bgcode)
+        r["bgcode_convert_s"] = t
+
+    r.update(bench_routes(meta, history, mmu, args.requests))
+    for f in (path, bgcode):
+        os.remove(f)
+    return r
+
+
+def bench_routes(meta, history, mmu, requests):
+    """Latenz der Dashboard-Endpoints mit dem analysierten Job (Drucker im Zustand PRINTING)."""
+    # erst hier: app.py öffnet data/ relativ zum (temporären) Arbeitsverzeichnis
+    with quiet():
+        import app
+        app.init_spools()
+    printer = app.default_printer()
+    with quiet():
+        printer.reset()
+    printer.state.update(tool_state='PRINTING', tool_progress=50.0, tool_job='bench.gcode', tool_live='yes',
+                         tool_mmu=mmu, slicing_g=meta.get('filament used [g]', []),
+                         densities=meta.get('filament_density', []))
+    printer.set_usage_history(history)
+    client = app.app.test_client()
+    r = {}
+    routes = dict(ROUTES, snapshot_refresh="/snapshot")
+    for name, url in routes.items():
+        samples = []
+        for _ in range(requests):
+            if name == "snapshot_refresh":
+                # Dashboard-Zustand jedes Mal neu berechnen (wie nach einer Änderung)
+                printer.broker.trigger()
+            t, resp = measure(client.get, url)
+            if resp.status_code != 200:
+                raise RuntimeError(f"{url}: HTTP {resp.status_code}")
+            samples.append(t)
+        r[f"{name}_p50_ms"], r[f"{name}_p95_ms"] = percentiles(samples)
+    return r
+
+
+def bench_persistence(args, workdir):
+    from spool_store import JsonSpoolStore, SqliteSpoolStore
+    from history_log import PrintHistory
+
+    db = sample_spools(args.spools, args.tools if args.tools > 1 else 6)
+    stores = {
+        "spool_json": JsonSpoolStore(os.path.join(workdir, 'spools.json')),
+        "spool_sqlite": SqliteSpoolStore(os.path.join(workdir, 'spools.sqlite')),
+    }
+    r = {}
+    for name, store in stores.items():
+        samples = [measure(store.save_all, db)[0] for _ in range(args.requests // 4 or 1)]
+        r[f"{name}_save_all_p50_ms"], r[f"{name}_save_all_p95_ms"] = percentiles(samples)
+        samples = [measure(store.save, db, [db[i % len(db)]])[0] for i in range(args.requests // 4 or 1)]
+        r[f"{name}_save_one_p50_ms"], r[f"{name}_save_one_p95_ms"] = percentiles(samples)
+    with quiet():
+        history = PrintHistory(os.path.join(workdir, 'history.jsonl'), os.path.join(workdir, 'history.idx.json'), None)
+    # Aufbau wie app.log_print_history
+    record = {"timestamp": "2024-01-01T12:00+0100", "printer": "bench", "file": "bench.gcode",
+              "progress": 100, "status": "FINISHED", "spools": {s["id"]: 12.5 for s in db[:5]}}
+    samples = [measure(history.append, record)[0] for _ in range(args.requests // 4 or 1)]
+    r["history_append_p50_ms"], r["history_append_p95_ms"] = percentiles(samples)
+    return r
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    params = {k: getattr(args, k) for k in ('tools', 'tool_change_every', 'retract', 'metadata', 'seed', 'meatpack',
+                                            'processes', 'repeat', 'requests', 'spools')}
+    results = {
+        "meta": {"date": datetime.now().isoformat(timespec='seconds'), "commit": _git_commit(),
+                 "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "params": params,
+        "sizes": {},
+    }
+    home = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="spooli-bench-")
+    try:
+        os.chdir(workdir)
+        os.makedirs('data')
+        with open(os.path.join('data', 'spool_db.json'), 'w') as f:
+            json.dump(sample_spools(args.spools, args.tools if args.tools > 1 else 6), f)
+        for size in args.sizes:
+            print(f"[bench] {size:g} MB ...", file=sys.stderr)
+            results["sizes"][f"{size:g}"] = bench_job(size, args, workdir)
+        print("[bench] Persistenz ...", file=sys.stderr)
+        results["persistence"] = bench_persistence(args, workdir)
+    finally:
+        os.chdir(home)
+        shutil.rmtree(workdir, ignore_errors=True)
+    try:
+        import resource
+        results["meta"]["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:   # Windows
+        pass
+    return results
+
+# ----- Ausgabe und Vergleich -----
+
+def higher_is_better(metric):
+    return metric.endswith(('_lines_s', '_mb_s'))
+
+
+def comparable(metric):
+    return higher_is_better(metric) or metric.endswith(('_s', '_ms', '_peak_mb'))
+
+
+def flatten(results):
+    """{"10 MB analyze_s": wert, "persistence spool_json_save_all_p50_ms": wert, ...}"""
+    flat = {}
+    for size, r in results.get("sizes", {}).items():
+        flat.update({f"{size} MB {k}": v for k, v in r.items()})
+    flat.update({f"persistence {k}": v for k, v in results.get("persistence", {}).items()})
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """Tabelle aktuell vs. Baseline; liefert die Metriken, die um mehr als tolerance schlechter sind."""
+    if baseline.get("params") != results["params"]:
+        print(f"⚠️ Parameter der Baseline weichen ab: {baseline.get('params')}")
+    old = flatten(baseline)
+    worse = []
+    for key, value in flatten(results).items():
+        metric = key.split()[-1]
+        if not comparable(metric) or key not in old or not old[key]:
+            continue
+        change = value / old[key] - 1
+        bad = -change if higher_is_better(metric) else change
+        flag = ""
+        if bad > tolerance:
+            flag = "  ⚠️ schlechter"
+            worse.append(key)
+        elif -bad > tolerance:
+            flag = "  besser"
+        print(f"{key:48} {old[key]:12.3f} → {value:12.3f}  {change:+7.1%}{flag}")
+    return worse
+
+
+def report(results):
+    for key, value in flatten(results).items():
+        print(f"{key:48} {value:12.3f}" if isinstance(value, float) else f"{key:48} {value:>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks mit synthetischem G-Code (ohne Drucker)")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Dateigrößen in MB, kommagetrennt")
+    parser.add_argument('--tools', type=int, default=5, help="1 = ohne MMU")
+    parser.add_argument('--tool-change-every', type=int, default=4000)
+    parser.add_argument('--retract', type=float, default=0.05)
+    parser.add_argument('--metadata', choices=('full', 'minimal', 'none'), default='full')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--meatpack', action='store_true', help=".bgcode mit MeatPack-Encoding")
+    parser.add_argument('--processes', type=int, default=1, help=">1: zusätzlich build_usage_index_parallel")
+    parser.add_argument('--repeat', type=int, default=3, help="Durchläufe je Durchsatz-Messung (bester zählt)")
+    parser.add_argument('--requests', type=int, default=200, help="Anfragen je Endpoint")
+    parser.add_argument('--spools', type=int, default=50, help="Spulen in der DB")
+    parser.add_argument('--no-memory', action='store_true', help="ohne tracemalloc-Durchlauf (schneller)")
+    parser.add_argument('--out', help="Ergebnis als JSON (z. B. neue Baseline)")
+    parser.add_argument('--compare', nargs='?', const=BASELINE_FILE, help="mit früherem Ergebnis vergleichen")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="erlaubte Verschlechterung (Anteil)")
+    args = parser.parse_args(argv)
+    args.sizes = [float(s) for s in args.sizes.split(',')]
+
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    results = run(args)
+    if out:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+    if baseline is None:
+        report(results)
+        return 0
+    print(f"Vergleich mit {args.compare} ({baseline['meta'].get('commit')}, {baseline['meta'].get('date')})")
+    worse = compare(results, baseline, args.tolerance)
+    if worse:
+        print(f"⚠️ {len(worse)} Messwerte mehr als {args.tolerance:.0%} schlechter")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""
+Reiner Python-Leser für Prusa Binary G-Code (.bgcode), ersetzt das CLI-Tool 'bgcode'.
+
+Aufbau laut libbgcode-Spezifikation:
+- Datei-Header: Magic 'GCDE', Version (uint32), Checksummen-Typ (uint16, 0 = keine, 1 = CRC32)
+- Blöcke: Header (Typ, Kompression, unkomprimierte Größe, ggf. komprimierte Größe),
+  Parameter (Encoding bzw. Thumbnail-Format/Größe), Daten, ggf. CRC32
+- Kompression: keine, Deflate, Heatshrink 11/4, Heatshrink 12/4
+- G-Code-Encoding: keins, MeatPack, MeatPack mit Kommentaren
+
+read_metadata() liest nur die Metadaten-Blöcke und überspringt die G-Code-Daten,
+iter_gcode_blocks() dekodiert Block für Block (ca. 64 kB) ohne Zwischendatei,
+iter_gcode_stream() dasselbe über ein Dateiobjekt, das nur vorwärts gelesen wird (Download).
+"""
+import re
+import struct
+import zlib
+
+MAGIC = b'GCDE'
+
+BLOCK_FILE_METADATA = 0
+BLOCK_GCODE = 1
+BLOCK_SLICER_METADATA = 2
+BLOCK_PRINTER_METADATA = 3
+BLOCK_PRINT_METADATA = 4
+BLOCK_THUMBNAIL = 5
+
+METADATA_BLOCKS = {
+    BLOCK_FILE_METADATA: "file",
+    BLOCK_PRINTER_METADATA: "printer",
+    BLOCK_PRINT_METADATA: "print",
+    BLOCK_SLICER_METADATA: "slicer",
+}
+
+COMPRESSION_NONE = 0
+COMPRESSION_DEFLATE = 1
+COMPRESSION_HEATSHRINK_11_4 = 2
+COMPRESSION_HEATSHRINK_12_4 = 3
+
+ENCODING_NONE = 0
+ENCODING_MEATPACK = 1
+ENCODING_MEATPACK_COMMENTS = 2
+
+
+class BGCodeError(ValueError):
+    pass
+
+# ----- Blöcke -----
+
+def read_header(f):
+    data = f.read(10)
+    if len(data) < 10 or data[:4] != MAGIC:
+        raise BGCodeError("Keine bgcode-Datei (Magic 'GCDE' fehlt)")
+    version, checksum_type = struct.unpack('<IH', data[4:])
+    return version, checksum_type
+
+
+def iter_blocks(f, checksum_type, skip=()):
+    """
+    Liefert (typ, parameter, daten) für jeden Block; daten sind bereits dekomprimiert.
+    Für Blocktypen in `skip` werden die Daten nicht gelesen (daten = None).
+    """
+    while True:
+        head = f.read(8)
+        if not head:
+            return
+        if len(head) < 8:
+            raise BGCodeError("Block-Header abgeschnitten")
+        block_type, compression, size = struct.unpack('<HHI', head)
+        comp_size = size
+        if compression != COMPRESSION_NONE:
+            extra = f.read(4)
+            head += extra
+            comp_size, = struct.unpack('<I', extra)
+        params = f.read(6 if block_type == BLOCK_THUMBNAIL else 2)
+        crc_size = 4 if checksum_type == 1 else 0
+        if block_type in skip:
+            f.seek(comp_size + crc_size, 1)
+            yield block_type, params, None
+            continue
+        payload = f.read(comp_size)
+        if len(payload) < comp_size:
+            raise BGCodeError("Block-Daten abgeschnitten")
+        if crc_size:
+            crc, = struct.unpack('<I', f.read(4))
+            if zlib.crc32(payload, zlib.crc32(params, zlib.crc32(head))) != crc:
+                raise BGCodeError(f"CRC-Fehler in Block vom Typ {block_type}")
+        yield block_type, params, _decompress(payload, compression, size)
+
+
+def _decompress(payload, compression, size):
+    if compression == COMPRESSION_NONE:
+        return payload
+    if compression == COMPRESSION_DEFLATE:
+        try:
+            return zlib.decompress(payload)
+        except zlib.error:
+            return zlib.decompress(payload, -15)
+    if compression == COMPRESSION_HEATSHRINK_11_4:
+        return heatshrink_decode(payload, 11, 4, size)
+    if compression == COMPRESSION_HEATSHRINK_12_4:
+        return heatshrink_decode(payload, 12, 4, size)
+    raise BGCodeError(f"Unbekannte Kompression {compression}")
+
+# ----- Heatshrink -----
+
+def heatshrink_decode(data, window_bits, lookahead_bits, size):
+    """
+    LZSS-Dekoder kompatibel zu heatshrink: Bits MSB zuerst, Tag 1 = Literal (8 Bit),
+    Tag 0 = Rückverweis (window_bits Offset-1, lookahead_bits Länge-1).
+    Das Fenster ist anfangs mit Nullen gefüllt.
+    """
+    out = bytearray()
+    wmask = (1 << window_bits) - 1
+    lmask = (1 << lookahead_bits) - 1
+    backref_bits = window_bits + lookahead_bits
+    need = 1 + backref_bits
+    n = len(data)
+    pos = 0
+    acc = 0
+    nbits = 0
+    while len(out) < size:
+        if nbits < need:
+            acc &= (1 << nbits) - 1
+            while nbits < need and pos < n:
+                acc = (acc << 8) | data[pos]
+                pos += 1
+                nbits += 8
+        if nbits < 9:
+            break
+        nbits -= 1
+        if (acc >> nbits) & 1:
+            nbits -= 8
+            out.append((acc >> nbits) & 0xFF)
+            continue
+        if nbits < backref_bits:
+            break
+        nbits -= window_bits
+        offset = ((acc >> nbits) & wmask) + 1
+        nbits -= lookahead_bits
+        count = ((acc >> nbits) & lmask) + 1
+        start = len(out) - offset
+        if start >= 0 and offset >= count:
+            out += out[start:start + count]
+        else:
+            for i in range(count):
+                p = start + i
+                out.append(out[p] if p >= 0 else 0)
+    return bytes(out[:size])
+
+# ----- MeatPack -----
+
+_MP_CHARS = b"0123456789. \nGX"
+_MP_COMMAND = 0xFF
+_MP_ENABLE_PACKING = 251
+_MP_DISABLE_PACKING = 250
+_MP_RESET_ALL = 249
+_MP_ENABLE_NO_SPACES = 247
+_MP_DISABLE_NO_SPACES = 246
+
+
+def _mp_chars(no_spaces):
+    # im No-Spaces-Modus steht der Code für ' ' für 'E'
+    return _MP_CHARS.replace(b' ', b'E') if no_spaces else _MP_CHARS
+
+
+def _mp_table(no_spaces):
+    chars = _mp_chars(no_spaces)
+    table = []
+    for b in range(256):
+        lo, hi = b & 0xF, b >> 4
+        if lo == 0xF or hi == 0xF:
+            table.append(None)
+        elif chars[lo] == 0x0A:
+            # nach einem Zeilenende wird das zweite Zeichen verworfen
+            table.append(b'\n')
+        else:
+            table.append(bytes((chars[lo], chars[hi])))
+    return table
+
+
+_MP_TABLES = (_mp_table(False), _mp_table(True))
+# Bytes mit einem 0xF-Nibble (Literal folgt / Kommando) brauchen die Zustandsmaschine
+_MP_SPECIAL_RE = re.compile(b'[' + re.escape(bytes(b for b in range(256) if b & 0xF == 0xF or b >> 4 == 0xF)) + b']')
+
+
+def meatpack_decode(data):
+    """Entpackt einen MeatPack-Datenblock zu Text (Kommandos 0xFF 0xFF <cmd> werden ausgewertet)."""
+    out = []
+    packing = False
+    no_spaces = False
+    i = 0
+    n = len(data)
+
+    def literal(i):
+        if i >= n:
+            return b''
+        c = data[i:i + 1]
+        # im No-Spaces-Modus wird ein Leerzeichen als Literal 'E' übertragen
+        return b' ' if no_spaces and c == b'E' else c
+
+    while i < n:
+        if packing:
+            m = _MP_SPECIAL_RE.search(data, i)
+            end = m.start() if m else n
+            if end > i:
+                out.append(b''.join(map(_MP_TABLES[no_spaces].__getitem__, data[i:end])))
+                i = end
+                continue
+        b = data[i]
+        if b == _MP_COMMAND and i + 2 < n and data[i + 1] == _MP_COMMAND:
+            cmd = data[i + 2]
+            if cmd == _MP_ENABLE_PACKING:
+                packing = True
+            elif cmd in (_MP_DISABLE_PACKING, _MP_RESET_ALL):
+                packing = False
+            elif cmd == _MP_ENABLE_NO_SPACES:
+                no_spaces = True
+            elif cmd == _MP_DISABLE_NO_SPACES:
+                no_spaces = False
+            i += 3
+            continue
+        i += 1
+        if not packing:
+            out.append(data[i - 1:i])
+            continue
+        # gepacktes Byte mit mindestens einem Literal-Nibble: Literale folgen als ganze Bytes
+        chars = _mp_chars(no_spaces)
+        lo, hi = b & 0xF, b >> 4
+        if lo == 0xF:
+            out.append(literal(i))
+            i += 1
+            if hi == 0xF:
+                out.append(literal(i))
+                i += 1
+            else:
+                out.append(chars[hi:hi + 1])
+        else:
+            out.append(chars[lo:lo + 1])
+            if chars[lo] != 0x0A:
+                out.append(literal(i))
+                i += 1
+    return b''.join(out).decode('utf-8', errors='ignore')
+
+
+# Parameter, vor die beim Entpacken von G-Zeilen wieder ein Leerzeichen gesetzt wird (wie libbgcode)
+_GLINE_PARAM_RE = re.compile(r'(?<=[^ ])([XYZEFIJRPWHCA])')
+
+
+def _respace(line):
+    return _GLINE_PARAM_RE.sub(r' \1', line) if line.startswith('G') else line
+
+# ----- Öffentliche Funktionen -----
+
+def _parse_ini(data):
+    meta = {}
+    for line in data.decode('utf-8', errors='ignore').splitlines():
+        key, sep, value = line.partition('=')
+        if sep:
+            meta[key.strip()] = value.strip()
+    return meta
+
+
+def read_metadata(path):
+    """
+    Liest die Metadaten-Blöcke ({"file"|"printer"|"print"|"slicer": {key: value}}) als Strings.
+    G-Code-Blöcke werden übersprungen, ohne ihre Daten zu lesen.
+    """
+    meta = {}
+    with open(path, 'rb') as f:
+        _, checksum_type = read_header(f)
+        for block_type, params, data in iter_blocks(f, checksum_type, skip=(BLOCK_GCODE, BLOCK_THUMBNAIL)):
+            if block_type in METADATA_BLOCKS:
+                meta[METADATA_BLOCKS[block_type]] = _parse_ini(data)
+            elif block_type == BLOCK_GCODE and "slicer" in meta:
+                # Slicer-Metadaten stehen vor dem G-Code – ab hier kommt nichts mehr
+                break
+    return meta
+
+
+def iter_gcode_blocks(path):
+    """Liefert den dekodierten G-Code Block für Block als UTF-8-Bytes (jeweils mit Zeilenende)."""
+    with open(path, 'rb') as f:
+        yield from iter_gcode_stream(f)
+
+
+def iter_gcode_stream(f, on_metadata=None):
+    """
+    Wie iter_gcode_blocks, aber über ein Objekt mit read() und seek(n, 1).
+    on_metadata(meta) wird mit den bis dahin gelesenen Metadaten-Blöcken (wie bei
+    read_metadata) aufgerufen, bevor der erste G-Code-Block dekodiert wird.
+    """
+    rest = ''
+    meta = {}
+    _, checksum_type = read_header(f)
+    for block_type, params, data in iter_blocks(f, checksum_type, skip=(BLOCK_THUMBNAIL,)):
+        if block_type in METADATA_BLOCKS:
+            meta[METADATA_BLOCKS[block_type]] = _parse_ini(data)
+            continue
+        if block_type != BLOCK_GCODE:
+            continue
+        if on_metadata:
+            on_metadata(meta)
+            on_metadata = None
+        encoding, = struct.unpack('<H', params)
+        if encoding == ENCODING_NONE:
+            text = data.decode('utf-8', errors='ignore')
+            fix = str   # Klartext bleibt unverändert
+        elif encoding in (ENCODING_MEATPACK, ENCODING_MEATPACK_COMMENTS):
+            text = meatpack_decode(data)
+            fix = _respace
+        else:
+            raise BGCodeError(f"Unbekanntes G-Code-Encoding {encoding}")
+        lines = (rest + text).split('\n')
+        rest = lines.pop()
+        # leere Zeilen entfallen wie beim CLI-Tool
+        yield ''.join(fix(l) + '\n' for l in lines if l).encode('utf-8')
+    if on_metadata:
+        on_metadata(meta)
+    if rest:
+        yield (fix(rest) + '\n').encode('utf-8')
+
+
+def iter_gcode_lines(path):
+    """Generator über die dekodierten G-Code-Zeilen (ohne Zeilenende)."""
+    for block in iter_gcode_blocks(path):
+        yield from block.decode('utf-8').split('\n')[:-1]
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Inhaltsadressierter Cache für G-Code-Jobs.
+
+Schlüssel ist der SHA-256 der Originaldatei (.bgcode/.gcode) plus analyzer.PARSER_VERSION.
+Pro Eintrag (Verzeichnis unter CACHE_DIR):
+- gcode.gz     dekodierter G-Code, gzip-komprimiert (nur mit BGCODE_DECODER=cli)
+- meta.json    Ergebnis von parse_gcode_metadata
+- index-<parser>.json  Verbrauchsindex (UsageIndex) je Parser-Modus
+
+aliases.json ordnet Schlüssel, die schon vor dem Download bekannt sind (monitor.remote_key:
+Pfad, Größe und Änderungszeit auf dem Drucker), dem Inhalts-Schlüssel zu.
+
+Aufräumen nach Alter (CACHE_MAX_AGE_DAYS) und Gesamtgröße (CACHE_MAX_MB, älteste Nutzung zuerst)
+nach jedem neuen Eintrag (store_gcode, store_json).
+
+CLI:
+  python cache.py list
+  python cache.py evict
+  python cache.py purge [key]
+"""
+import os
+import sys
+import json
+import time
+import gzip
+import shutil
+import hashlib
+import tempfile
+import threading
+from analyzer import PARSER_VERSION
+
+# ----- Konfiguration -----
+
+CACHE_DIR = os.getenv("GCODE_CACHE_DIR", os.path.join('data', 'cache'))
+CACHE_ENABLED = os.getenv("GCODE_CACHE", "1") != "0"
+CACHE_MAX_MB = float(os.getenv("GCODE_CACHE_MAX_MB", "2048"))
+CACHE_MAX_AGE_DAYS = float(os.getenv("GCODE_CACHE_MAX_AGE_DAYS", "60"))
+HASH_BLOCK = 1 << 20
+ALIAS_FILE = os.path.join(CACHE_DIR, 'aliases.json')
+
+_alias_lock = threading.Lock()
+
+# ----- Schlüssel -----
+
+def content_key(path):
+    """SHA-256 über den Dateiinhalt, blockweise gelesen."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def entry_dir(key):
+    return os.path.join(CACHE_DIR, f"{key}-v{PARSER_VERSION}")
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _atomic_write(dest, write_fn, mode):
+    # eigene Temp-Datei je Schreiber: store_gcode und Index-Schreiber für denselben Schlüssel
+    # können gleichzeitig laufen
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=os.path.basename(dest) + ".", suffix=".tmp")
+    try:
+        with open(fd, mode) as f:
+            write_fn(f)
+        os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+# ----- G-Code -----
+
+def lookup_gcode(key):
+    """Pfad zum gecachten G-Code (gzip) oder None."""
+    if not CACHE_ENABLED or key is None:
+        return None
+    path = os.path.join(entry_dir(key), 'gcode.gz')
+    if not os.path.exists(path):
+        return None
+    _touch(entry_dir(key))
+    print(f"[cache] Treffer G-Code {key[:12]}")
+    return path
+
+
+def store_gcode(key, gcode_path):
+    """Legt eine gzip-Kopie des dekodierten G-Codes ab und räumt danach auf."""
+    if not CACHE_ENABLED or key is None:
+        return None
+    d = entry_dir(key)
+    os.makedirs(d, exist_ok=True)
+    dest = os.path.join(d, 'gcode.gz')
+    t0 = time.time()
+    with open(gcode_path, 'rb') as src:
+        _atomic_write(dest, lambda f: _gzip_copy(src, f), 'wb')
+    print(f"[cache] G-Code {key[:12]} gespeichert ({os.path.getsize(dest)/1e6:.1f} MB, {time.time()-t0:.1f}s)")
+    evict()
+    return dest
+
+
+def _gzip_copy(src, dst):
+    with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=6) as gz:
+        shutil.copyfileobj(src, gz, HASH_BLOCK)
+
+# ----- Analyse-Ergebnisse -----
+
+def load_json(key, name):
+    if not CACHE_ENABLED or key is None:
+        return None
+    path = os.path.join(entry_dir(key), f"{name}.json")
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    _touch(entry_dir(key))
+    print(f"[cache] Treffer {name} {key[:12]}")
+    return data
+
+
+def has_json(key, name):
+    return CACHE_ENABLED and key is not None and os.path.exists(os.path.join(entry_dir(key), f"{name}.json"))
+
+
+def store_json(key, name, data):
+    if not CACHE_ENABLED or key is None:
+        return
+    d = entry_dir(key)
+    os.makedirs(d, exist_ok=True)
+    _atomic_write(os.path.join(d, f"{name}.json"), lambda f: json.dump(data, f), 'w')
+    # ohne BGCODE_DECODER=cli gibt es kein store_gcode, aufgeräumt wird dann nur hier
+    evict()
+
+# ----- Vorab-Schlüssel -----
+
+def _load_aliases():
+    try:
+        with open(ALIAS_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def lookup_alias(alias):
+    """Inhalts-Schlüssel zu einem Vorab-Schlüssel, None ohne (noch vorhandenen) Eintrag."""
+    if not CACHE_ENABLED or alias is None:
+        return None
+    with _alias_lock:
+        key = _load_aliases().get(alias)
+    if key is None or not os.path.isdir(entry_dir(key)):
+        return None
+    return key
+
+
+def store_alias(alias, key):
+    if not CACHE_ENABLED or alias is None or key is None:
+        return
+    with _alias_lock:
+        aliases = _load_aliases()
+        if aliases.get(alias) == key:
+            return
+        aliases[alias] = key
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _atomic_write(ALIAS_FILE, lambda f: json.dump(aliases, f), 'w')
+
+
+def _prune_aliases():
+    with _alias_lock:
+        aliases = _load_aliases()
+        kept = {a: k for a, k in aliases.items() if os.path.isdir(entry_dir(k))}
+        if len(kept) != len(aliases):
+            _atomic_write(ALIAS_FILE, lambda f: json.dump(kept, f), 'w')
+
+# ----- Verwaltung -----
+
+def list_entries():
+    """Alle Einträge mit Größe und letzter Nutzung, zuletzt genutzte zuerst."""
+    entries = []
+    if not os.path.isdir(CACHE_DIR):
+        return entries
+    for name in os.listdir(CACHE_DIR):
+        d = os.path.join(CACHE_DIR, name)
+        if not os.path.isdir(d):
+            continue
+        files = os.listdir(d)
+        entries.append({
+            "key": name,
+            "files": sorted(files),
+            "size_bytes": sum(os.path.getsize(os.path.join(d, x)) for x in files),
+            "last_used": os.path.getmtime(d),
+        })
+    entries.sort(key=lambda e: e["last_used"], reverse=True)
+    return entries
+
+
+def purge(key=None):
+    """Löscht einen Eintrag (key = Verzeichnisname oder Hash-Präfix) oder den ganzen Cache."""
+    removed = []
+    for e in list_entries():
+        if key is None or e["key"].startswith(key):
+            shutil.rmtree(os.path.join(CACHE_DIR, e["key"]), ignore_errors=True)
+            removed.append(e["key"])
+    print(f"[cache] {len(removed)} Einträge gelöscht")
+    return removed
+
+
+def evict(max_mb=None, max_age_days=None):
+    """Entfernt zu alte Einträge und danach die am längsten ungenutzten, bis das Größenlimit passt."""
+    max_bytes = (CACHE_MAX_MB if max_mb is None else max_mb) * 1e6
+    max_age = (CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days) * 86400
+    now = time.time()
+    removed = []
+    total = 0
+    for e in list_entries():
+        if now - e["last_used"] > max_age or total + e["size_bytes"] > max_bytes:
+            shutil.rmtree(os.path.join(CACHE_DIR, e["key"]), ignore_errors=True)
+            removed.append(e["key"])
+        else:
+            total += e["size_bytes"]
+    if removed:
+        _prune_aliases()
+        print(f"[cache] {len(removed)} Einträge verdrängt, Cache {total/1e6:.1f} MB")
+    return removed
+
+
+def main(argv):
+    cmd = argv[1] if len(argv) > 1 else "list"
+    if cmd == "list":
+        entries = list_entries()
+        for e in entries:
+            used = time.strftime('%Y-%m-%d %H:%M', time.localtime(e["last_used"]))
+            print(f"{e['key']}  {e['size_bytes']/1e6:8.1f} MB  {used}  {', '.join(e['files'])}")
+        print(f"{len(entries)} Einträge, {sum(e['size_bytes'] for e in entries)/1e6:.1f} MB in {CACHE_DIR}")
+    elif cmd == "evict":
+        evict()
+    elif cmd == "purge":
+        purge(argv[2] if len(argv) > 2 else None)
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
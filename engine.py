@@ -0,0 +1,192 @@
+"""
+asyncio-Engine für die Drucker-Überwachung (MONITOR_ENGINE=asyncio, Standard).
+
+Statt mehrerer Threads je Drucker, die im Takt nachsehen, läuft ein Event-Loop für alle Drucker:
+- poll_loop: Status/Job-Poll als Task, Intervall vom PollScheduler, abbrechbar über cancel()
+- StateWaiter: Tasks warten auf "Fortschritt geändert", "Druck gestartet" oder "Job beendet",
+  StateStore.watch weckt sie bei der Änderung selbst statt nach bis zu POLL_INTERVAL Sekunden
+- "Datei verfügbar": der Download läuft im Executor, der Task wartet auf dessen Ende
+- Metadaten, Index und bgcode-Konvertierung laufen in parse_executor, Polls und
+  Dashboard-Ereignisse anderer Drucker laufen währenddessen weiter
+
+Die PrusaLink-Aufrufe selbst (requests) blockieren und laufen daher im Standard-Executor.
+MONITOR_ENGINE=threads verwendet die bisherigen Threads (app.run_printer).
+"""
+import os
+import asyncio
+import functools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from monitor import (apply_poll, download_thread_fn, pipeline_download, finish_gcode, download_started,
+                     progress_changed, start_analysis, print_usage, clear_analysis_noti,
+                     usage_segment, index_failed)
+
+MONITOR_ENGINE = os.getenv("MONITOR_ENGINE", "asyncio")   # asyncio | threads
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2"))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+
+# eigene Pools: lange Analysen und Downloads belegen nicht die Threads für die Polls
+parse_executor = ThreadPoolExecutor(PARSE_WORKERS, thread_name_prefix="parse")
+download_executor = ThreadPoolExecutor(DOWNLOAD_WORKERS, thread_name_prefix="download")
+
+
+def in_executor(fn, *args, executor=None, **kwargs):
+    """Blockierenden Aufruf im Executor ausführen (Standard: Default-Executor des Loops)."""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+def parse(fn, *args, **kwargs):
+    return in_executor(fn, *args, executor=parse_executor, **kwargs)
+
+
+class StateWaiter:
+    """Warten auf Bedingungen über einem StateStore innerhalb des Event-Loops."""
+
+    def __init__(self, state):
+        self.state = state
+        self.loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        state.watch(self._notify)
+
+    def _notify(self):
+        # kommt aus beliebigen Threads (Executor, Flask)
+        self.loop.call_soon_threadsafe(self.changed.set)
+
+    def close(self):
+        self.state.unwatch(self._notify)
+
+    async def _until(self, predicate):
+        while True:
+            # erst zurücksetzen, dann prüfen: eine Änderung dazwischen setzt das Event wieder
+            self.changed.clear()
+            cur = self.state.snapshot()
+            if predicate(cur):
+                return cur
+            await self.changed.wait()
+
+    async def wait_for(self, predicate, timeout=None):
+        """Wie StateStore.wait_for: Stand, sobald predicate(stand) wahr ist, None bei timeout."""
+        try:
+            return await asyncio.wait_for(self._until(predicate), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+async def poll_loop(printer):
+    """Gegenstück zu monitor.ProgressMonitor_thread_fn."""
+    state = printer.state
+    tool_state_old = "unk"
+    tool_progress_old = None
+    while True:
+        status, job = await in_executor(printer.client.poll)
+        failure = apply_poll(state, status, job)
+        cur = state.snapshot()
+        if not cur.tool_state in tool_state_old:
+            print(f"[{printer.name}] PRINTER STATE : {cur.tool_state}")
+            tool_state_old = cur.tool_state
+        if failure:
+            print(f"!!!!!!!!!{failure} failure!!!!!!!!!")
+            return
+        if job and 'progress' in job and tool_progress_old != cur.tool_progress:
+            print(f"[{printer.name}] PRINTER PROGRESS WATCH: {cur.tool_progress:.1f}%. State: {cur.tool_state}. File {cur.tool_job}")
+            tool_progress_old = cur.tool_progress
+        await asyncio.sleep(printer.scheduler.next_interval(cur.tool_state, cur.tool_progress, ok=status is not None))
+
+
+async def wait_for_job(printer, waiter):
+    """Gegenstück zu monitor.init_wait_for_job; neuer Versuch, sobald poll_loop eine Änderung meldet."""
+    msgflag = True
+    while True:
+        version = printer.state.snapshot().version
+        job = await in_executor(printer.client.get_job)
+        if job and 'file' in job:
+            return job
+        if msgflag:
+            print(f"[{printer.name}] Kein Job {printer.state.tool_state}")
+            msgflag = False
+        else:
+            print('.', end='')
+        # spätestens nach dem aktuellen Poll-Intervall (langsam bei IDLE, Backoff bei Fehlern)
+        await waiter.wait_for(lambda cur: cur.version != version, printer.scheduler.interval)
+
+
+async def prepare_gcode(printer, waiter, input_path, filename, use_download, pipe=None):
+    """Gegenstück zu monitor.prepare_gcode: (Pfad, Cache-Schlüssel)."""
+    os.makedirs(printer.download_dir, exist_ok=True)
+    dest = os.path.join(printer.download_dir, filename)
+    if pipe and not pipe.claim_source(dest):
+        # ein anderer Drucker lädt dieselbe Datei bereits in diese Pipeline
+        return dest, None
+    if not use_download:
+        await in_executor(subprocess.run, ['cp', input_path, dest], check=True)
+        return await parse(finish_gcode, dest)
+    if pipe:
+        download = in_executor(pipeline_download, printer, filename, pipe, executor=download_executor)
+    else:
+        download = in_executor(download_thread_fn, printer, filename, dest, executor=download_executor)
+    if not download_started(printer.state.snapshot()):
+        print(f"⏳ Warte auf Druckstart... aktueller Zustand: {printer.state.tool_state}")
+    await waiter.wait_for(download_started)
+    if pipe:
+        # Dekodieren und Index laufen parallel zum Download; Hash erst danach bekannt
+        return dest, None
+    # Datei verfügbar
+    await download
+    return await parse(finish_gcode, dest)
+
+
+async def live_analyze(printer, waiter, index, sync=True):
+    """
+    Gegenstück zu monitor.live_analyze_gen als asynchroner Generator: (Fortschritt, {tool: mm}).
+    Wacht bei jedem neuen Fortschritt, Druckende oder reboot sofort auf.
+    PipelineError wie dort, wenn der Pipeline-Index abgebrochen ist.
+    """
+    state = printer.state
+    if not sync:
+        # ohne Drucker-Fortschritt läuft die Analyse durch, dafür muss der Index fertig sein
+        while not index.complete:
+            index_failed(index)
+            await asyncio.sleep(0.1)
+    idx = 0
+    usage = {}
+    prog = 0
+    seen = None
+    start_analysis(state, index, sync)
+    stopped = lambda cur: cur.reboot or cur.reboot_analzye
+    while not stopped(state.snapshot()):
+        if sync:
+            cur = state.snapshot()
+            if cur.tool_progress is None or cur.tool_progress == prog:
+                print(f"wait for progress printer is {cur.tool_state}")
+                changed = progress_changed(prog, seen)
+                cur = await waiter.wait_for(lambda cur: changed(cur) or stopped(cur))
+                clear_analysis_noti(state)
+                if stopped(cur):
+                    break
+            # Druck ohne neuen Fortschritt beendet: letzten Stand noch einmal melden
+            progress = cur.tool_progress if cur.tool_progress is not None else prog
+            target = index.line_at_progress(progress)
+            if target > index.total_lines and not index.complete:
+                index_failed(index)
+                # expected_lines wächst mit, solange pipeline.py noch indexiert
+                print(f"Index erst bei Zeile {index.total_lines}/{index.expected_lines}, warte")
+                await asyncio.sleep(1)
+                continue
+            prog = progress
+        else:
+            prog += 1
+            target = index.line_at_progress(prog)
+
+        if target > idx:
+            print(f"Line {idx} -> {target}")
+            usage = usage_segment(printer, index, idx, target)
+            idx = target
+        seen = cur.version if sync else None
+        yield prog, usage
+        print_usage(prog, usage)
+        if prog >= 100:
+            print("\n SYNC BREAK IN LOOP 100P")
+            break
+    print("\n SYNC BREAK out of looP")
+    clear_analysis_noti(state)
@@ -0,0 +1,111 @@
+"""
+Server-Sent Events für das Dashboard.
+
+Ein Hintergrund-Thread berechnet den Dashboard-Zustand (state_fn → {schlüssel: wert})
+alle SSE_INTERVAL Sekunden – nur solange mindestens ein Client verbunden ist – und
+serialisiert jeden Schlüssel einmal. Jeder Client bekommt beim Verbinden ein
+'snapshot'-Event mit allem, danach 'update'-Events nur mit geänderten Schlüsseln.
+trigger() stößt eine sofortige Neuberechnung an (z. B. nach Spulen-Änderungen).
+
+snapshot() liefert denselben Zustand für pollende Clients (/snapshot) samt Version;
+die Version steigt bei jeder Änderung und ist zusammen mit BOOT_ID das ETag.
+"""
+import os
+import json
+import time
+import threading
+
+SSE_INTERVAL = float(os.getenv("SSE_INTERVAL", "2"))   # Sekunden zwischen Zustandsvergleichen
+SSE_HEARTBEAT = 15.0                                    # Kommentarzeile, damit Proxys/Clients die Verbindung halten
+BOOT_ID = f"{int(time.time()):x}"                       # Versionen sind nur innerhalb eines Prozesses eindeutig
+
+
+class EventBroker:
+
+    def __init__(self, state_fn, interval=SSE_INTERVAL, heartbeat=SSE_HEARTBEAT):
+        self.state_fn = state_fn
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.cond = threading.Condition()
+        self.refresh_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.state = {}       # schlüssel → JSON-Text
+        self.version = 0
+        self.body = '{}'      # alle Schlüssel als ein JSON-Objekt, nur bei Änderungen neu zusammengesetzt
+        self.refreshed_at = 0.0
+        self.clients = 0
+        self.thread = None
+
+    def trigger(self):
+        self.wake.set()
+
+    def refresh(self):
+        """Zustand neu berechnen; benachrichtigt die Clients, wenn sich etwas geändert hat."""
+        with self.refresh_lock:
+            try:
+                state = {k: json.dumps(v) for k, v in self.state_fn().items()}
+            except Exception as e:
+                print(f"[events] Fehler beim Berechnen des Zustands: {e}")
+                return
+            with self.cond:
+                self.refreshed_at = time.monotonic()
+                if state != self.state:
+                    self.state = state
+                    self.version += 1
+                    self.body = '{' + ','.join(f'{json.dumps(k)}:{v}' for k, v in state.items()) + '}'
+                    self.cond.notify_all()
+
+    def etag(self, version):
+        return f'"{BOOT_ID}-{version}"'
+
+    def snapshot(self, max_age=None):
+        """
+        (version, JSON-Text) des aktuellen Zustands. Neu berechnet wird höchstens alle
+        max_age Sekunden (Standard: interval), egal wie viele Clients pollen.
+        """
+        max_age = self.interval if max_age is None else max_age
+        if self.wake.is_set() or time.monotonic() - self.refreshed_at >= max_age:
+            self.wake.clear()
+            self.refresh()
+        with self.cond:
+            return self.version, self.body
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if self.clients:
+                self.refresh()
+
+    def _start(self):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def stream(self):
+        """Generator für eine SSE-Antwort (text/event-stream)."""
+        self._start()
+        with self.cond:
+            self.clients += 1
+        try:
+            self.refresh()
+            sent = {}
+            event = 'snapshot'
+            while True:
+                with self.cond:
+                    changed = {k: v for k, v in self.state.items() if sent.get(k) != v}
+                    if not changed:
+                        self.cond.wait(self.heartbeat)
+                        changed = {k: v for k, v in self.state.items() if sent.get(k) != v}
+                    version = self.version
+                if not changed:
+                    yield ": ping\n\n"
+                    continue
+                body = ','.join(f'{json.dumps(k)}:{v}' for k, v in changed.items())
+                yield f"id: {version}\nevent: {event}\ndata: {{{body}}}\n\n"
+                sent.update(changed)
+                event = 'update'
+        finally:
+            with self.cond:
+                self.clients -= 1
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Synthetischer G-Code im Stil von PrusaSlicer (für bench.py, ohne Drucker und ohne Slicer).
+
+- generate: .gcode mit einstellbarer Größe, Tool-Anzahl (1 = ohne MMU, Tool 5), Abstand der
+  Werkzeugwechsel, Retraktions-Dichte und Slicer-Metadaten (full | minimal | none)
+- to_bgcode: schreibt eine .gcode-Datei als Prusa Binary G-Code (Deflate, optional MeatPack),
+  lesbar mit bgcode_reader.py; Metadaten-Kommentare landen in den Metadaten-Blöcken
+
+Mit festem seed entsteht bei gleichen Parametern immer dieselbe Datei.
+
+CLI:
+  python gcode_gen.py job.gcode [--size-mb 50] [--tools 5] [--tool-change-every 4000]
+                      [--retract 0.05] [--metadata full|minimal|none] [--seed 0]
+                      [--bgcode job.bgcode] [--meatpack]
+"""
+import re
+import sys
+import json
+import zlib
+import random
+import struct
+import argparse
+import bgcode_reader
+
+FILAMENT_DIAMETER = 1.75
+DENSITY = 1.24              # PLA, g/cm³
+STAMPING_DISTANCE = 20.0    # mm je Werkzeugwechsel (MMU3)
+CONFIG_KEYS = 300           # Umfang der Slicer-Konfiguration am Dateiende (PrusaSlicer: einige hundert)
+BED = (250.0, 210.0)
+WRITE_LINES = 10000         # Zeilen pro Schreibvorgang
+BGCODE_BLOCK = 64 << 10     # Bytes G-Code je bgcode-Block (wie PrusaSlicer)
+
+_META_RE = re.compile(r";\s*(.+?)\s*=\s*(.+)")
+
+
+def _list(values, fmt):
+    return ",".join(fmt % v for v in values)
+
+
+def _metadata_lines(tools, used_mm, level):
+    """Kommentare am Dateiende: Verbrauch, dann die Slicer-Konfiguration (prusaslicer_config)."""
+    if level == "none":
+        return []
+    mmu = tools > 1
+    grams = [mm * 3.14159 * (FILAMENT_DIAMETER / 2) ** 2 / 1000 * DENSITY for mm in used_mm]
+    if mmu:
+        used = [f"; filament used [mm] = {_list(used_mm, '%.2f')}",
+                f"; filament used [g] = {_list(grams, '%.2f')}"]
+        config = [f"; filament_density = {_list([DENSITY] * tools, '%.2f')}",
+                  f"; filament_stamping_distance = {_list([STAMPING_DISTANCE] * tools, '%g')}",
+                  f"; nozzle_diameter = {_list([0.4] * tools, '%g')}"]
+    else:
+        used = [f"; filament used [mm] = {used_mm[0]:.2f}",
+                f"; filament used [g] = {grams[0]:.2f}"]
+        config = [f"; filament_density = {DENSITY:.2f}",
+                  "; filament_stamping_distance = 0,0,0,0,0",
+                  "; nozzle_diameter = 0.4"]
+    if level == "minimal":
+        return used + config
+    lines = used + [f"; filament used [cm3] = {sum(used_mm) * 0.0024:.2f}",
+                    f"; total filament used [g] = {sum(grams):.2f}",
+                    f"; total filament changes = {0 if not mmu else len(used_mm)}",
+                    "; estimated printing time (normal mode) = 5h 12m 3s",
+                    "; prusaslicer_config = begin"]
+    # alphabetisch wie bei PrusaSlicer, die benötigten Schlüssel mittendrin
+    filler = [f"; setting_{i:03d} = {i * 0.25:g}" for i in range(CONFIG_KEYS)]
+    return lines + sorted(filler + config) + ["; prusaslicer_config = end"]
+
+
+def generate(path, size_mb=10, tools=5, tool_change_every=4000, retract=0.05, metadata="full", seed=0):
+    """
+    Schreibt einen Druckjob von etwa size_mb MB nach path und liefert Kennzahlen
+    ({"bytes", "lines", "tool_changes", "used_mm", ...}).
+    tools > 1 erzeugt einen MMU-Job (T-Wechsel etwa alle tool_change_every Zeilen, 0 = keine),
+    retract ist der Anteil der Fahrbewegungen mit Retraktion.
+    """
+    rng = random.Random(seed)
+    target = int(size_mb * (1 << 20))
+    mmu = tools > 1
+    used = [0.0] * tools
+    tool = 0
+    stats = {"path": path, "tools": tools, "mmu": mmu, "tool_changes": 0, "retractions": 0}
+    head = ["; generated by PrusaSlicer 2.7.1+linux-x64 (synthetisch, gcode_gen.py)", ";",
+            "; external perimeters extrusion width = 0.45mm",
+            "; perimeters extrusion width = 0.45mm", "",
+            "M73 P0 R312", "M73 Q0 S318", "M201 X4000 Y4000 Z200 E2500",
+            "M104 S215", "M140 S60", "G28", "G90", "M83 ; use relative distances for extrusion"]
+    if mmu:
+        head += ["T0"]
+    buf = head
+    size = sum(len(l) + 1 for l in head)
+    lines = len(head)
+    pct = 0
+    z = 0.2
+    x, y = BED[0] / 2, BED[1] / 2
+    next_change = tool_change_every
+    with open(path, 'w', newline='\n') as f:
+        while size < target:
+            out = [";LAYER_CHANGE", f";Z:{z:.2f}", ";HEIGHT:0.2", f"G1 Z{z:.2f} F720", ";TYPE:External perimeter"]
+            for _ in range(rng.randint(200, 2000)):
+                if mmu and tool_change_every and lines + len(out) >= next_change:
+                    new = rng.choice([t for t in range(tools) if t != tool])
+                    out += ["; CP TOOLCHANGE START", "M220 B", "G1 E-2 F2100", f"T{new}",
+                            "G1 E20 F1000", "M220 R", "; CP TOOLCHANGE END"]
+                    used[tool] += STAMPING_DISTANCE - 2.0
+                    used[new] += 20.0
+                    tool = new
+                    stats["tool_changes"] += 1
+                    next_change += max(1, int(rng.uniform(0.5, 1.5) * tool_change_every))
+                x = min(max(x + rng.uniform(-15, 15), 0), BED[0])
+                y = min(max(y + rng.uniform(-15, 15), 0), BED[1])
+                if rng.random() < retract:
+                    out += ["G1 E-.8 F2100", f"G1 X{x:.3f} Y{y:.3f} F10800", "G1 E.8 F2100"]
+                    stats["retractions"] += 1
+                elif rng.random() < 0.02:
+                    out += [";TYPE:Perimeter", ";WIDTH:0.45", "G1 F1800"]
+                else:
+                    e = rng.uniform(0.01, 0.6)
+                    used[tool] += e
+                    out.append(f"G1 X{x:.3f} Y{y:.3f} E{e:.5f}")
+            z += 0.2
+            # Fortschritt über die Bytes: M73 für jedes volle Prozent (normal und Silent-Modus)
+            step = sum(len(l) + 1 for l in out)
+            while pct < 99 and (size + step) * 100 // target > pct:
+                pct += 1
+                out += [f"M73 P{pct} R{312 * (100 - pct) // 100}", f"M73 Q{pct} S{318 * (100 - pct) // 100}"]
+            buf += out
+            size += sum(len(l) + 1 for l in out)
+            lines += len(out)
+            if len(buf) >= WRITE_LINES:
+                f.write("\n".join(buf) + "\n")
+                buf = []
+        tail = ["M73 P100 R0", "M73 Q100 S0", "M107", "M104 S0", "M140 S0", "M84 ; disable motors", ""]
+        tail += _metadata_lines(tools, used if mmu else [sum(used)], metadata)
+        buf += tail
+        f.write("\n".join(buf) + "\n")
+        size += sum(len(l) + 1 for l in tail)
+        lines += len(tail)
+    stats.update(bytes=size, lines=lines, used_mm=[round(mm, 2) for mm in (used if mmu else [sum(used)])])
+    return stats
+
+# ----- Prusa Binary G-Code -----
+
+_MP_CHARS = "0123456789. \nGX"
+
+
+def _meatpack(lines):
+    """MeatPack mit Kommentaren, Leerzeichen in G-Zeilen entfernt (wie PrusaSlicer)."""
+    chars = _MP_CHARS.replace(' ', 'E')
+    out = bytearray(b'\xff\xff\xfb\xff\xff\xf7')
+    for line in lines:
+        s = (line.replace(' ', '') if line.startswith('G') else line) + '\n'
+        i = 0
+        while i < len(s):
+            c1 = s[i]
+            if c1 == '\n':
+                out.append(0x0C)
+                i += 1
+                continue
+            c2 = s[i + 1]
+            k1, k2 = chars.find(c1), chars.find(c2)
+            k1 = 0xF if k1 < 0 else k1
+            k2 = 0xF if k2 < 0 else k2
+            out.append((k2 << 4) | k1)
+            for c, k in ((c1, k1), (c2, k2)):
+                if k == 0xF:
+                    out += b'E' if c == ' ' else c.encode()
+            i += 2
+    return bytes(out)
+
+
+def _block(block_type, data, params, compression=bgcode_reader.COMPRESSION_DEFLATE):
+    payload = zlib.compress(data) if compression == bgcode_reader.COMPRESSION_DEFLATE else data
+    head = struct.pack('<HHI', block_type, compression, len(data))
+    if compression != bgcode_reader.COMPRESSION_NONE:
+        head += struct.pack('<I', len(payload))
+    return head + params + payload + struct.pack('<I', zlib.crc32(head + params + payload))
+
+
+def _split_meta(src):
+    """Zeilen der Datei als (zeile, (key, value) oder None) – Metadaten-Kommentare erkannt."""
+    with open(src, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            m = _META_RE.match(line) if line.startswith(';') else None
+            yield line, (m.groups() if m else None)
+
+
+def to_bgcode(src, dest, meatpack=False):
+    """G-Code-Datei → .bgcode (CRC32, Deflate); '; key = value'-Kommentare werden zu Metadaten."""
+    # 1. Durchlauf: Metadaten (stehen im .bgcode vor dem G-Code), 2. Durchlauf: G-Code-Blöcke
+    print_meta, slicer_meta = {}, {}
+    for _, kv in _split_meta(src):
+        if kv:
+            key, value = kv
+            (print_meta if key.startswith(('filament used', 'total filament', 'estimated')) else slicer_meta)[key] = value
+    ini = lambda meta: "".join(f"{k}={v}\n" for k, v in meta.items()).encode()
+    encoding = bgcode_reader.ENCODING_MEATPACK_COMMENTS if meatpack else bgcode_reader.ENCODING_NONE
+    with open(dest, 'wb') as f:
+        f.write(bgcode_reader.MAGIC + struct.pack('<IH', 1, 1))
+        f.write(_block(bgcode_reader.BLOCK_FILE_METADATA, b"Producer=gcode_gen.py\n", b'\0\0',
+                       bgcode_reader.COMPRESSION_NONE))
+        f.write(_block(bgcode_reader.BLOCK_PRINTER_METADATA, b"printer_model=MK4S\nnozzle_diameter=0.4\n", b'\0\0',
+                       bgcode_reader.COMPRESSION_NONE))
+        f.write(_block(bgcode_reader.BLOCK_PRINT_METADATA, ini(print_meta), b'\0\0'))
+        f.write(_block(bgcode_reader.BLOCK_SLICER_METADATA, ini(slicer_meta), b'\0\0'))
+        params = struct.pack('<H', encoding)
+        chunk, size = [], 0
+
+        def flush():
+            data = _meatpack(chunk) if meatpack else ("\n".join(chunk) + "\n").encode()
+            f.write(_block(bgcode_reader.BLOCK_GCODE, data, params))
+
+        for line, kv in _split_meta(src):
+            if kv:
+                continue
+            chunk.append(line)
+            size += len(line) + 1
+            if size >= BGCODE_BLOCK:
+                flush()
+                chunk, size = [], 0
+        if chunk:
+            flush()
+    return dest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetischen PrusaSlicer-G-Code erzeugen")
+    parser.add_argument('path', help="Ziel (.gcode)")
+    parser.add_argument('--size-mb', type=float, default=10)
+    parser.add_argument('--tools', type=int, default=5, help="1 = ohne MMU")
+    parser.add_argument('--tool-change-every', type=int, default=4000, help="Zeilen zwischen Werkzeugwechseln, 0 = keine")
+    parser.add_argument('--retract', type=float, default=0.05, help="Anteil der Bewegungen mit Retraktion")
+    parser.add_argument('--metadata', choices=('full', 'minimal', 'none'), default='full')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bgcode', help="zusätzlich als .bgcode schreiben")
+    parser.add_argument('--meatpack', action='store_true', help=".bgcode mit MeatPack-Encoding (langsamer zu erzeugen)")
+    args = parser.parse_args(argv)
+    stats = generate(args.path, args.size_mb, args.tools, args.tool_change_every, args.retract, args.metadata, args.seed)
+    if args.bgcode:
+        to_bgcode(args.path, args.bgcode, args.meatpack)
+    json.dump(stats, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
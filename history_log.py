@@ -0,0 +1,163 @@
+"""
+Druckhistorie als Append-only-Log (JSON Lines).
+
+- data/print_history.jsonl   ein Druck-Eintrag je Zeile, wird nur angehängt
+- data/print_history.idx.json  Seitenindex: Byte-Offset und Zeitstempel je Eintrag,
+  Spulen-ID → Eintragsnummern. Gehört zu einer bestimmten Loggröße; passt die nicht
+  (Absturz zwischen Log und Index, Log von Hand bearbeitet), wird er neu aufgebaut.
+
+Abfragen lesen nur die passenden Zeilen (seek auf den Offset), nicht die ganze Datei.
+Die alte data/print_history.json (ein JSON-Array) wird einmalig übernommen, solange
+es noch kein Log gibt; sie selbst bleibt unverändert liegen.
+"""
+import os
+import json
+import threading
+import metrics
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+HISTORY_LOG = os.path.join('data', 'print_history.jsonl')
+HISTORY_INDEX = os.path.join('data', 'print_history.idx.json')
+LEGACY_HISTORY = os.path.join('data', 'print_history.json')
+
+TIMEZONE = ZoneInfo("Europe/Berlin")
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M%z'
+
+
+def parse_time(value):
+    """Zeitstempel (Format der Einträge oder ISO 8601) → Unix-Zeit; ohne Zone Europe/Berlin."""
+    try:
+        t = datetime.strptime(value, TIMESTAMP_FORMAT)
+    except ValueError:
+        t = datetime.fromisoformat(value)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=TIMEZONE)
+    return t.timestamp()
+
+
+class PrintHistory:
+
+    def __init__(self, path=HISTORY_LOG, index_path=HISTORY_INDEX, legacy_path=LEGACY_HISTORY):
+        self.path = path
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.offsets = []     # Byte-Offset je Eintrag (chronologisch)
+        self.times = []       # Unix-Zeit je Eintrag, None wenn nicht lesbar
+        self.spools = {}      # Spulen-ID → [Eintragsnummer]
+        self.size = 0         # Loggröße, zu der der Index passt
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if legacy_path and not os.path.exists(path):
+            self._import(legacy_path)
+        self._load_index()
+
+    # ----- Index -----
+
+    def _add(self, offset, record):
+        n = len(self.offsets)
+        self.offsets.append(offset)
+        try:
+            self.times.append(parse_time(record.get('timestamp')))
+        except (TypeError, ValueError):
+            self.times.append(None)
+        for spool_id in record.get('spools', {}):
+            self.spools.setdefault(spool_id, []).append(n)
+
+    def _load_index(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        try:
+            with open(self.index_path, 'r') as f:
+                idx = json.load(f)
+            if idx['size'] == size:
+                self.offsets, self.times, self.spools, self.size = idx['offsets'], idx['times'], idx['spools'], size
+                return
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        self._rebuild()
+
+    def _rebuild(self):
+        self.offsets, self.times, self.spools = [], [], {}
+        offset = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # abgebrochener Schreibvorgang am Ende → abschneiden
+                        print(f"[history] Unvollständige letzte Zeile ({len(line)} Bytes) entfernt")
+                        f.truncate(offset)
+                        break
+                    if line.strip():
+                        try:
+                            self._add(offset, json.loads(line))
+                        except ValueError:
+                            print(f"[history] Unlesbare Zeile bei Byte {offset} übersprungen")
+                    offset += len(line)
+        self.size = offset
+        self._save_index()
+        print(f"[history] Index neu aufgebaut: {len(self.offsets)} Einträge")
+
+    def _save_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'size': self.size, 'offsets': self.offsets, 'times': self.times, 'spools': self.spools}, f)
+        os.replace(tmp, self.index_path)
+
+    def _import(self, legacy_path):
+        try:
+            with open(legacy_path, 'r') as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        os.replace(tmp, self.path)
+        print(f"[history] {len(records)} Einträge aus {legacy_path} übernommen")
+
+    # ----- Schreiben / Lesen -----
+
+    @metrics.timed(metrics.db_save_seconds, "history", "append")
+    def append(self, record):
+        line = (json.dumps(record) + '\n').encode()
+        with self.lock:
+            if not os.path.exists(self.path) or os.path.getsize(self.path) != self.size:
+                # Log wurde außerhalb verändert → Index passt nicht mehr
+                self._rebuild()
+            with open(self.path, 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(line)
+            self._add(offset, record)
+            self.size = offset + len(line)
+            self._save_index()
+
+    def mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def query(self, spool_id=None, since=None, until=None, limit=None, offset=0):
+        """
+        Einträge in zeitlicher Reihenfolge (älteste zuerst), optional nur die einer Spule
+        und/oder im Zeitraum [since, until] (Unix-Zeit). offset/limit zählen vom neuesten
+        Eintrag aus: offset=0, limit=50 → die 50 neuesten. Liefert (Einträge, Anzahl ohne limit/offset).
+        """
+        with self.lock:
+            rows = self.spools.get(spool_id, []) if spool_id is not None else range(len(self.offsets))
+            if since is not None or until is not None:
+                rows = [n for n in rows
+                        if self.times[n] is not None
+                        and (since is None or self.times[n] >= since)
+                        and (until is None or self.times[n] <= until)]
+            total = len(rows)
+            end = max(total - offset, 0)
+            start = 0 if limit is None else max(end - limit, 0)
+            offsets = [self.offsets[n] for n in rows[start:end]]
+            records = []
+            if offsets:
+                with open(self.path, 'rb') as f:
+                    for pos in offsets:
+                        f.seek(pos)
+                        records.append(json.loads(f.readline()))
+        return records, total
@@ -0,0 +1,213 @@
+"""
+Laufzeit-Kennzahlen im Prometheus-Textformat (GET /metrics).
+
+- Counter und Histogram zählen im Hot Path nur hoch (eine Sperre, kein Formatieren, keine
+  Zeitreihen im Speicher); der Text entsteht erst in render(), also nur wenn jemand abfragt
+- GaugeFn ruft seine Funktion erst beim Abruf auf (z. B. Analyse-Rückstand) und kostet sonst nichts
+- Labels werden positionsweise übergeben: api_seconds.observe(0.02, "mk4-1", "status")
+- METRICS=0 schaltet die Erfassung ab, /metrics liefert dann nur die Callback-Werte
+
+Die Kennzahlen sind unten definiert, die Module zählen nur hoch; GaugeFn für Werte aus
+dem Druckerzustand registriert app.py.
+"""
+import os
+import time
+import functools
+import threading
+from bisect import bisect_left
+
+ENABLED = os.getenv("METRICS", "1") != "0"
+PREFIX = "spooli_"
+
+# Sekunden: von einzelnen API-Aufrufen bis zu Downloads/Analysen großer Dateien
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}   # Label-Werte → Wert bzw. Histogramm-Zustand
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, value=1):
+        if not ENABLED:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self):
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_labels(self.labels, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        if not ENABLED:
+            return
+        with self.lock:
+            self.values[labels] = value
+
+    render = Counter.render
+
+
+class GaugeFn(_Metric):
+    """Wert(e) erst beim Abruf: fn() → {Label-Werte (Tupel): Wert}."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels, fn):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def render(self):
+        try:
+            items = list(self.fn().items())
+        except Exception as e:
+            print(f"[metrics] {self.name}: {e}")
+            return []
+        return [f"{self.name}{_labels(self.labels, k)} {_num(v)}" for k, v in items if v is not None]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            h = self.values.get(labels)
+            if h is None:
+                # Zähler je Bucket (nicht kumuliert, das macht render), Summe, Anzahl
+                h = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        with self.lock:
+            items = [(k, list(h[0]), h[1], h[2]) for k, h in self.values.items()]
+        lines = []
+        for k, counts, total, n in items:
+            acc = 0
+            for le, c in zip(self.buckets + (float('inf'),), counts):
+                acc += c
+                bucket = 'le="%s"' % _num(le)
+                lines.append(f"{self.name}_bucket{_labels(self.labels, k, bucket)} {acc}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, k)} {_num(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, k)} {n}")
+        return lines
+
+
+class _Timer:
+    """with histogram.time(*labels): Dauer des Blocks beobachten (auch bei Ausnahmen)."""
+
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, *self.labels)
+
+
+def timed(hist, *labels):
+    """Decorator: Laufzeit jedes Aufrufs in hist."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with hist.time(*labels):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def record_index(mode, seconds, lines):
+    """Ein Index-Durchlauf (monitor._build_index, pipeline.py)."""
+    index_seconds.observe(seconds, mode)
+    index_lines.inc(mode, value=lines)
+    index_lines_per_second.set(lines / max(seconds, 1e-6), mode)
+
+
+def render():
+    """Alle Kennzahlen im Textformat (text/plain; version=0.0.4)."""
+    out = []
+    for metric in REGISTRY:
+        lines = metric.render()
+        if lines or isinstance(metric, GaugeFn):
+            out += metric.header() + lines
+    return "\n".join(out) + "\n"
+
+# ----- Kennzahlen -----
+
+# PrusaLink (prusalink.py): endpoint = status | job | download | other
+api_seconds = Histogram("printer_api_request_seconds", "Dauer der PrusaLink-Anfragen", ("printer", "endpoint"))
+api_requests = Counter("printer_api_requests_total", "PrusaLink-Anfragen nach HTTP-Status (error = keine Antwort)",
+                       ("printer", "endpoint", "code"))
+
+# Download (monitor.download_thread_fn)
+download_bytes = Counter("download_bytes_total", "Heruntergeladene G-Code-Bytes", ("printer",))
+download_seconds = Histogram("download_seconds", "Dauer vollständiger G-Code-Downloads", ("printer",))
+
+# bgcode-Konvertierung über das CLI-Tool (monitor.convert_bgcode)
+convert_seconds = Histogram("bgcode_convert_seconds", "Dauer der bgcode-Konvertierung (CLI)")
+
+# Index-Durchlauf (monitor._build_index, pipeline.py): mode = sequential | parallel | pipeline
+index_seconds = Histogram("index_build_seconds", "Dauer eines Index-Durchlaufs über den G-Code", ("mode",))
+index_lines = Counter("index_lines_total", "Beim Indexieren gelesene G-Code-Zeilen", ("mode",))
+index_lines_per_second = Gauge("index_lines_per_second", "Zeilen/s des letzten Index-Durchlaufs", ("mode",))
+
+# Live-Analyse (monitor.usage_segment): ein Segment = Fortschrittsschritt → Verbrauch an der Zielzeile
+analyze_segment_seconds = Histogram("analyze_segment_seconds", "Rechenzeit je Analyse-Segment", ("printer",),
+                                    buckets=(0.00001, 0.0001, 0.001, 0.01, 0.1, 1, 10))
+analyze_lines = Counter("analyze_lines_total", "In der Live-Analyse durchlaufene G-Code-Zeilen", ("printer",))
+
+# Flask (app.py)
+http_seconds = Histogram("http_request_seconds", "Antwortzeit der Flask-Endpoints", ("route", "method"))
+http_requests = Counter("http_requests_total", "Anfragen an die Flask-Endpoints", ("route", "method", "code"))
+
+# Speichern (spool_store.py, history_log.py): store = json | sqlite | history
+db_save_seconds = Histogram("db_save_seconds", "Dauer der Schreibvorgänge", ("store", "op"))
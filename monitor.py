@@ -5,7 +5,7 @@ Skript zur Live-Analyse des Filamentverbrauchs beim Druck auf einem Prusa MK4 mi
 Features:
 - Ohne Argument: Download des aktuellen Druckjobs (.bgcode/.gcode) von Prusa-Link API (wartet, bis G-Code verfügbar ist)
 - Mit Argument: Verwendung lokaler Datei
-- Automatische Konvertierung von .bgcode → .gcode via CLI-Tool 'bgcode'
+- .bgcode wird direkt im Prozess dekodiert (bgcode_reader.py), optional über das CLI-Tool 'bgcode'
 - Einlesen von Metadaten aus dem G-Code-Header:
   - filament_density (Liste für Tools 0–5)
   - filament_stamping_distance (Liste für Tools 0–5)
@@ -25,114 +25,207 @@ import os
 import re
 import sys
 import time
+import hashlib
+import weakref
 import threading
-import tempfile
 import subprocess
 import requests
 from collections import defaultdict
-from requests.auth import HTTPDigestAuth
-from pygcode import Line
+from analyzer import build_usage_index, build_usage_index_parallel, get_scanner, iter_line_chunks, iter_tail_chunks, UsageIndex
+import bgcode_reader
+import cache
+import metrics
 import settings
+from pipeline import GcodePipeline, PipelineError
 
 # ----- Konfiguration -----
 
-POLL_INTERVAL = 5    # Sekunden
-settings.tool_count = 5       # Tools 0–4: MMU3, Tool 5: Direktdruck
+POLL_INTERVAL = 5    # Sekunden (Download-Wiederholung, Warten auf Druckstart; Status-Polls: scheduler.py)
+PARSER_MODE = os.getenv("GCODE_PARSER", "fast")   # "fast" (T/E-Scanner) oder "pygcode" (Referenz, langsam)
+INDEX_EVERY = 1000   # Zeilen pro Stützpunkt im Verbrauchsindex
+GCODE_READER = os.getenv("GCODE_READER", "stream")   # "stream" (Blockweise lesen) oder "mmap"
+PARSE_PROCESSES = int(os.getenv("GCODE_PARSE_PROCESSES", "1"))   # >1: große Dateien in mehreren Prozessen indexieren
+PARALLEL_MIN_BYTES = 64 << 20   # kleinere Dateien lohnen den Prozess-Start nicht
+BGCODE_DECODER = os.getenv("BGCODE_DECODER", "python")   # "python" (bgcode_reader.py) oder "cli" (Tool 'bgcode')
+GCODE_PIPELINE = os.getenv("GCODE_PIPELINE", "1") != "0"   # .bgcode-Download parallel dekodieren und indexieren
+DOWNLOAD_CHUNK = 64 << 10  # Bytes pro Schreibvorgang beim Download
+META_KEYS = ('nozzle_diameter', 'filament used [g]', 'filament used [mm]',
+             'filament_density', 'filament_stamping_distance')   # von main() benötigte Metadaten
+META_HEAD_BYTES = 64 << 10   # Header-Kommentare am Dateianfang
+META_TAIL_BYTES = 4 << 20    # max. Bereich am Dateiende (Slicer-Konfiguration)
+META_BLOCK = 64 << 10        # Leseblock rückwärts vom Dateiende
+settings.state.update(tool_count=5)   # Tools 0–4: MMU3, Tool 5: Direktdruck
 
 # Globale Zustände
 
-stop_event = threading.Event()
-# usage_history = []
+download_keys = {}   # Zielpfad → SHA-256 des heruntergeladenen Inhalts (für cache.py)
+# Zustand, Client, PollScheduler und stop_event gehören zum jeweiligen Drucker (printers.Printer)
 
 # ----- API-Funktionen -----
 
-def get_current_status():
-    try:
-        r = requests.get(f"{settings.API_URL}/status", auth=settings.AUTH, timeout=5)
-        r.raise_for_status()
-        return r.json() if r.status_code != 204 else None
-    except requests.RequestException:
-        return None
+def get_current_status(printer):
+    return printer.client.get_status()
 
 
-def get_current_job():
-    try:
-        r = requests.get(f"{settings.API_URL}/job", auth=settings.AUTH, timeout=5)
-        r.raise_for_status()
-        return r.json() if r.status_code != 204 else None
-    except requests.RequestException:
-        return None
+def get_current_job(printer):
+    return printer.client.get_job()
 
 # ----- Download-Thread -----
 
-def ProgressMonitor_thread_fn():
-    global stop_event
-    tool_state_old = "unk"
-    tool_job_old = None
-    tool_progress_old = None
-    while not stop_event.is_set(): 
-        status = get_current_status()
-        if status is not None:
-            settings.tool_state = status['printer'].get('state') #status.get('printer').get('state')
-            #settings.tool_state = state
-        else:
-        	settings.tool_state = "unknown"
-        if not settings.tool_state in tool_state_old:
-              print (f"PRINTER STATE : {settings.tool_state}")
-              tool_state_old = settings.tool_state
-        job = get_current_job()
+def apply_poll(state, status, job):
+    """Ergebnis eines Polls übernehmen; liefert "Progress"/"Job" bei Rücksprung bzw. Jobwechsel, sonst None."""
+    failure = []
+
+    def changes_for(cur):
+        # alle Felder eines Polls in einem Schritt: Leser sehen nie Zustand und Fortschritt aus verschiedenen Polls
+        changes = {'tool_state': status['printer'].get('state') if status is not None else "unknown"}
         if job and 'progress' in job:
             comp = job.get('progress')#.get('completion')
             if comp is not None:
-                if (settings.tool_progress is not None):
-                    if (comp < settings.tool_progress) and settings.tool_progress is not None:
-                      print(f"!!!!!!!!!Progress failure!!!!!!!!!") #MAYBE SET FLAG AND HANDLE THIS LATER
-                      settings.reboot_analzye = True
-                      break
-                settings.tool_progress = comp
-                if (settings.tool_job != job['file']['display_name']) and (settings.tool_job is not None):
-                  print(f"!!!!!!!!!!Job failure!!!!!!!!") #MAYBE SET FLAG AND HANDLE THIS LATER
-                  settings.reboot_analzye = True
-                  break
-                settings.tool_job = job['file']['display_name']    
-                if tool_progress_old != settings.tool_progress:
-                  print(f"PRINTER PROGRESS WATCH: {settings.tool_progress:.1f}%. State: {settings.tool_state}. File {settings.tool_job}")
-                  tool_progress_old = settings.tool_progress
+                if (cur.tool_progress is not None) and (comp < cur.tool_progress):
+                    failure.append("Progress")
+                    changes['reboot_analzye'] = True
+                    return changes
+                changes['tool_progress'] = comp
+                if (cur.tool_job != job['file']['display_name']) and (cur.tool_job is not None):
+                    failure.append("Job")
+                    changes['reboot_analzye'] = True
+                    return changes
+                changes['tool_job'] = job['file']['display_name']
         else:
-        	settings.tool_job = None
-        time.sleep(POLL_INTERVAL)
+            changes['tool_job'] = None
+        return changes
+
+    state.modify(changes_for)
+    return failure[0] if failure else None
 
-def download_thread_fn(filename, dest):
-    global stop_event
-    """Versucht Download, wartet bei Sperre bis Datei verfügbar."""
-    url = f"{settings.FILES_URL}/{filename}"
+def ProgressMonitor_thread_fn(printer):
+    state = printer.state
+    tool_state_old = "unk"
+    tool_progress_old = None
+    while not printer.stop_event.is_set(): 
+        # Status und Job in einem Zyklus, siehe prusalink.py
+        status, job = printer.client.poll()
+        failure = apply_poll(state, status, job)
+        cur = state.snapshot()
+        if not cur.tool_state in tool_state_old:
+              print (f"PRINTER STATE : {cur.tool_state}")
+              tool_state_old = cur.tool_state
+        if failure:
+            print(f"!!!!!!!!!{failure} failure!!!!!!!!!") #MAYBE SET FLAG AND HANDLE THIS LATER
+            break
+        if job and 'progress' in job and tool_progress_old != cur.tool_progress:
+            print(f"PRINTER PROGRESS WATCH: {cur.tool_progress:.1f}%. State: {cur.tool_state}. File {cur.tool_job}")
+            tool_progress_old = cur.tool_progress
+        printer.scheduler.wait(printer.stop_event, cur.tool_state, cur.tool_progress, ok=status is not None)
+
+def _download_total(r, done):
+    """Gesamtgröße aus Content-Range (206) bzw. Content-Length (200), sonst None."""
+    rng = r.headers.get('Content-Range', '')
+    if '/' in rng and rng.rsplit('/', 1)[1].isdigit():
+        return int(rng.rsplit('/', 1)[1])
+    length = r.headers.get('Content-Length')
+    if length and length.isdigit():
+        return int(length) + (done if r.status_code == 206 else 0)
+    return None
+
+
+def download_thread_fn(printer, filename, dest, sink=None):
+    """
+    Versucht Download, wartet bei Sperre bis Datei verfügbar.
+    Der Inhalt wird blockweise auf die Platte geschrieben und dabei gehasht; nach einem
+    Abbruch wird per Range-Header ab dem letzten geschriebenen Byte fortgesetzt.
+    Mit sink (Queue, siehe pipeline.py) geht jeder Block zusätzlich an die nächste Stufe,
+    am Ende None.
+    """
+    state = printer.state
+    url = f"{printer.files_url}/{filename}"
     print(f"⤵️ Starte Download-Thread für {url}")
     blocked_noti_flag = True
-    while not stop_event.is_set():
-        try:
-            r = requests.get(url, auth=settings.AUTH, timeout=10)
-            if r.status_code == 404:
-                # Datei gesperrt, Druck läuft
-                settings.tool_live = 'blocked'
-                if blocked_noti_flag:
-                  print("Datei gesperrt, warte... (Druckstatus: %s)" % (settings.tool_state))
-                  settings.noti = " Datei gesperrt, warte..." 
-                  blocked_noti_flag = False
-            else:
-                r.raise_for_status()
-                with open(dest, 'wb') as f:
-                    f.write(r.content)
-                print("Download erfolgreich")
-                if settings.noti == " Datei gesperrt, warte...": settings.noti = ""  
-                if not settings.tool_live in ('file', 'blocked'): settings.tool_live = 'live'
-                return
-        except requests.RequestException as e:
-            print(f"Download-Fehler: {e}")
-            settings.tool_live = 'error'
-        time.sleep(POLL_INTERVAL)
+    done = 0
+    t_begin = None
+    sha = hashlib.sha256()
+    state.update(download_bytes=0, download_total=None, download_rate=0.0)
+    with open(dest, 'wb') as f:
+        while not printer.stop_event.is_set():
+            try:
+                headers = {'Range': f'bytes={done}-'} if done else {}
+                with printer.client.download(filename, headers) as r:
+                    if r.status_code == 404:
+                        # Datei gesperrt, Druck läuft
+                        state.update(tool_live='blocked')
+                        if blocked_noti_flag:
+                          print("Datei gesperrt, warte... (Druckstatus: %s)" % (state.tool_state))
+                          state.update(noti=" Datei gesperrt, warte...")
+                          blocked_noti_flag = False
+                    elif r.status_code == 416 and done and done == state.download_total:
+                        pass   # Range hinter dem Dateiende: alles schon da
+                    elif r.status_code == 416:
+                        # Datei auf dem Drucker kürzer als das bereits Geladene: geändert, von vorn
+                        print(f"Download: Range ab {done} abgelehnt, Datei geändert – starte neu")
+                        done = 0
+                        f.seek(0)
+                        f.truncate()
+                        sha = hashlib.sha256()
+                        state.update(download_bytes=0, download_total=None, download_rate=0.0)
+                        if sink is not None:
+                            # bereits weitergereichte Blöcke lassen sich nicht zurücknehmen
+                            sink.put(EOFError("Datei während des Downloads geändert"))
+                            sink = None
+                        continue
+                    else:
+                        r.raise_for_status()
+                        skip = 0
+                        if r.status_code != 206 and done:
+                            # Server ignoriert Range → bereits geschriebenen Anfang überspringen
+                            print("Download: kein Range-Support, lese von vorn")
+                            skip = done
+                        elif done:
+                            print(f"Download wird bei {done/1e6:.1f} MB fortgesetzt")
+                        state.update(download_total=_download_total(r, 0 if skip else done))
+                        t0 = time.time()
+                        if t_begin is None:
+                            t_begin = t0   # Dauer ohne das Warten auf die Freigabe
+                        start = done
+                        for block in r.iter_content(DOWNLOAD_CHUNK):
+                            if skip:
+                                cut = min(skip, len(block))
+                                block = block[cut:]
+                                skip -= cut
+                                if not block:
+                                    continue
+                            f.write(block)
+                            if sink is not None:
+                                sink.put(block)
+                            sha.update(block)
+                            metrics.download_bytes.inc(printer.name, value=len(block))
+                            done += len(block)
+                            state.update(download_bytes=done, download_rate=(done - start) / max(time.time() - t0, 1e-3))
+                    if r.status_code != 404 and (state.download_total is None or done >= state.download_total):
+                        f.flush()
+                        download_keys[dest] = sha.hexdigest()
+                        if t_begin is not None:
+                            metrics.download_seconds.observe(time.time() - t_begin, printer.name)
+                        if sink is not None:
+                            sink.put(None)
+                        print(f"Download erfolgreich ({done/1e6:.1f} MB, {state.download_rate/1e6:.2f} MB/s)")
+                        state.modify(lambda cur: dict(
+                            noti="" if cur.noti == " Datei gesperrt, warte..." else cur.noti,
+                            tool_live=cur.tool_live if cur.tool_live in ('file', 'blocked') else 'live'))
+                        return
+                    if r.status_code != 404:
+                        print(f"Download unvollständig ({done}/{state.download_total} Bytes), setze fort")
+            except requests.RequestException as e:
+                print(f"Download-Fehler bei {done} Bytes: {e}")
+                state.update(tool_live='error')
+            # stop_event beendet auch das Warten (asyncio-Engine: Task abgebrochen)
+            printer.stop_event.wait(POLL_INTERVAL)
+    if sink is not None:
+        sink.put(EOFError("Download abgebrochen"))
 
 # ----- G-Code Vorbereitung -----
 
+@metrics.timed(metrics.convert_seconds)
 def convert_bgcode(path):
     out = os.path.splitext(path)[0] + '.gcode'
     print(f"Konvertiere {path} → {out}")
@@ -140,54 +233,198 @@ def convert_bgcode(path):
     return out
 
 
-def prepare_gcode(input_path, filename, use_download):
-    #global settings.tool_state
-    tmp = tempfile.gettempdir()
-    dest = os.path.join(tmp, filename)
+def remote_key(file_info):
+    """
+    Schlüssel aus den Dateiangaben von PrusaLink (/job: path, name, size, m_timestamp), schon
+    vor dem Download bekannt. None, wenn Größe oder Änderungszeit fehlen.
+    """
+    if not file_info or file_info.get('size') is None or file_info.get('m_timestamp') is None:
+        return None
+    name = file_info.get('name') or file_info.get('display_name')
+    ident = f"{file_info.get('path', '')}/{name}|{file_info['size']}|{file_info['m_timestamp']}"
+    return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+
+def start_pipeline(printer, filename, use_download, remote=None):
+    """
+    GcodePipeline für einen .bgcode-Download, sonst None (klassischer Ablauf). Kennt der Cache
+    die Datei schon (remote = remote_key), ebenfalls None: nach dem Download liefert der
+    Inhalts-Hash Metadaten und Index aus dem Cache, Dekodieren und Indexieren entfallen.
+    """
+    if not (GCODE_PIPELINE and use_download and BGCODE_DECODER != "cli" and filename.lower().endswith('.bgcode')):
+        return None
+    key = cache.lookup_alias(remote)
+    if cache.has_json(key, 'meta') and cache.has_json(key, f'index-{PARSER_MODE}'):
+        print(f"[cache] {filename} bereits analysiert ({key[:12]}), ohne Pipeline")
+        return None
+    if remote is None:
+        return GcodePipeline(lambda: printer.state.download_total)
+    with _index_locks_lock:
+        # dieselbe Datei läuft schon auf einem anderen Drucker: Download, Dekodieren und Index teilen
+        pipe = _shared_pipes.get(remote)
+        if pipe is not None and pipe.error is None:
+            print(f"[pipeline] {filename} wird bereits verarbeitet, Index wird geteilt")
+            return pipe
+        pipe = _shared_pipes[remote] = GcodePipeline(lambda: printer.state.download_total, remote_key=remote)
+    return pipe
+
+
+def prepare_gcode(printer, input_path, filename, use_download, pipe=None):
+    state = printer.state
+    os.makedirs(printer.download_dir, exist_ok=True)
+    dest = os.path.join(printer.download_dir, filename)
+    if pipe and not pipe.claim_source(dest):
+        # ein anderer Drucker lädt dieselbe Datei bereits in diese Pipeline
+        return dest, None
     if use_download:
         # Download in eigenem Thread starten
-        dt = threading.Thread(target=download_thread_fn, args=(filename, dest), daemon=True)
+        if pipe:
+            dt = threading.Thread(target=pipeline_download, args=(printer, filename, pipe), daemon=True)
+        else:
+            dt = threading.Thread(target=download_thread_fn, args=(printer, filename, dest), daemon=True)
         dt.start()
         # Warte bis Zustand PRINTING, dann fortlaufend
-        if settings.tool_state not in ('PRINTING', 'PAUSED'):  print(f"⏳ Warte auf Druckstart... aktueller Zustand: {settings.tool_state}",end="")
-        while (settings.tool_state not in ('PRINTING', 'PAUSED')) and (settings.tool_live not in ('file')): # and not stop_event.is_set():
-            #print(f"Warte auf Druckstart... aktueller Zustand: {settings.tool_state}",end="")
+        if not download_started(state.snapshot()):  print(f"⏳ Warte auf Druckstart... aktueller Zustand: {state.tool_state}",end="")
+        while not download_started(state.snapshot()):
             print(".", end="")
-            time.sleep(POLL_INTERVAL)
+            state.wait_for(download_started, POLL_INTERVAL)
+        if pipe:
+            # Dekodieren und Index laufen parallel zum Download; Hash erst danach bekannt
+            return dest, None
         # Warte auf Abschluss des Download-Threads
         dt.join()
     else:
         subprocess.run(['cp', input_path, dest], check=True)
+    return finish_gcode(dest)
+
+
+def pipeline_download(printer, filename, pipe):
+    """download_thread_fn in die Pipeline (Ziel pipe.path); danach pipe.downloaded, auch bei Abbruch."""
+    try:
+        download_thread_fn(printer, filename, pipe.path, pipe.source)
+    finally:
+        pipe.downloaded.set()
+
+
+def pipeline_fallback(printer, pipe):
+    """
+    Nach einem PipelineError: Download (läuft ohne die Pipeline weiter, nach einer Änderung
+    der Datei von vorn) abwarten → (Pfad, Cache-Schlüssel) wie ohne Pipeline.
+    """
+    print(f"[{printer.name}] Pipeline abgebrochen ({pipe.error}), analysiere nach dem Download ohne Pipeline")
+    pipe.downloaded.wait()
+    return finish_gcode(pipe.path)
+
+
+def download_started(cur):
+    """Bedingung für den Download-Start: Druck läuft oder lokale Datei."""
+    return cur.tool_state in ('PRINTING', 'PAUSED') or cur.tool_live in ('file')
+
+
+def finish_gcode(dest):
+    """Vollständige Datei → (Pfad zum Analysieren, Cache-Schlüssel); .bgcode ggf. über das CLI-Tool."""
+    # Gleicher Inhalt → gleiche Konvertierung und Analyse, siehe cache.py
+    key = download_keys.pop(dest, None)
+    if key is None and cache.CACHE_ENABLED:
+        key = cache.content_key(dest)
     ext = os.path.splitext(dest)[1].lower()
-    return convert_bgcode(dest) if ext == '.bgcode' else dest
+    if ext != '.bgcode' or BGCODE_DECODER != "cli":
+        # .bgcode wird beim Lesen direkt dekodiert, keine Zwischendatei nötig
+        return dest, key
+    cached = cache.lookup_gcode(key)
+    if cached:
+        return cached, key
+    out = convert_bgcode(dest)
+    if key:
+        threading.Thread(target=cache.store_gcode, args=(key, out), daemon=True).start()
+    return out, key
 
 # ----- Metadaten einlesen -----
 
-def parse_gcode_metadata(filepath):
+def meta_value(value):
+    """Wert aus dem Slicer-Header: Liste (kommagetrennt), float, int oder Text."""
+    if ',' in value:
+        try:
+            return [float(x.strip()) for x in value.split(',')]
+        except ValueError:
+            return value.strip()
+    try:
+        if '.' in value:
+            return float(value)
+        return int(value)
+    except ValueError:
+        return value.strip()
+
+
+_META_RE = re.compile(r";\s*(.+?)\s*=\s*(.+)")
+
+
+def _meta_from_lines(lines, metadata):
+    for line in lines:
+        line = line.strip()
+        if line.startswith(";"):
+            match = _META_RE.match(line)
+            if match:
+                key, value = match.groups()
+                metadata[key] = meta_value(value)
+    return metadata
+
+
+def read_gcode_metadata_fast(filepath):
+    """
+    Liest nur Dateiende (rückwärts in META_BLOCK-Schritten) und Dateianfang, bis alle
+    META_KEYS gefunden sind. Wie beim vollständigen Durchlauf gilt das letzte Vorkommen
+    eines Schlüssels. None, wenn die Schlüssel nicht im Bereich liegen (→ voller Durchlauf).
+    """
+    if filepath.endswith('.gz') or os.path.getsize(filepath) <= META_HEAD_BYTES + META_TAIL_BYTES:
+        return None
+    metadata = {}
+    for lines in iter_tail_chunks(filepath, META_BLOCK, META_TAIL_BYTES):
+        # weiter hinten gefundene Werte haben Vorrang
+        for key, value in _meta_from_lines(lines, {}).items():
+            metadata.setdefault(key, value)
+        if all(k in metadata for k in META_KEYS):
+            break
+    else:
+        return None
+    head = next(iter_line_chunks(filepath, GCODE_READER, META_HEAD_BYTES), [])
+    for key, value in _meta_from_lines(head, {}).items():
+        metadata.setdefault(key, value)
+    return metadata
+
+
+def _bgcode_metadata(sections):
+    metadata = {}
+    for section in sections.values():
+        for key, value in section.items():
+            if value:
+                metadata[key] = meta_value(value)
+    return metadata
+
+
+def parse_gcode_metadata(filepath, cache_key=None, pipe=None):
+    if pipe:
+        # Metadaten-Blöcke kommen mit den ersten Download-Blöcken
+        return _bgcode_metadata(pipe.metadata())
+    metadata = cache.load_json(cache_key, 'meta')
+    if metadata is not None:
+        return metadata
     metadata = {}
     print(filepath)
-    with open(filepath, "r", encoding="utf-8") as file:
-        for line in file:
-            line = line.strip()
-            if line.startswith(";"):
-                match = re.match(r";\s*(.+?)\s*=\s*(.+)", line)
-                if match:
-                    key, value = match.groups()
-
-                    if ',' in value:
-                        try:
-                            values = [float(x.strip()) for x in value.split(',')]
-                            metadata[key] = values
-                        except ValueError:
-                            metadata[key] = value.strip()
-                    else:
-                        try:
-                            if '.' in value:
-                                metadata[key] = float(value)
-                            else:
-                                metadata[key] = int(value)
-                        except ValueError:
-                            metadata[key] = value.strip()
+    if filepath.lower().endswith('.bgcode'):
+        # Metadaten-Blöcke lesen, G-Code-Daten werden übersprungen
+        metadata = _bgcode_metadata(bgcode_reader.read_metadata(filepath))
+        cache.store_json(cache_key, 'meta', metadata)
+        return metadata
+    t0 = time.time()
+    fast = read_gcode_metadata_fast(filepath)
+    if fast is not None:
+        print(f"Metadaten aus Kopf/Ende gelesen in {(time.time()-t0)*1000:.0f} ms")
+        metadata = fast
+    else:
+        for chunk in iter_line_chunks(filepath, GCODE_READER):
+            _meta_from_lines(chunk, metadata)
+    cache.store_json(cache_key, 'meta', metadata)
     return metadata
 
 # ----- Umrechnung mm → g -----
@@ -198,76 +435,158 @@ def mm_to_g(mm, density, dia=1.75):
     
 # ----- Live-Analyse -----
 
-def live_analyze_gen(path, slicer, densities, stamping, sync=True):
-    #global usage_history, tool_progress
-    lines = open(path, encoding='utf-8', errors='ignore').readlines()
-    total = len([l for l in lines if l.strip() and not l.startswith(';')])
-    total = len(lines)
-    idx = 0; usage = defaultdict(float)
-    first_tool_change = True
-    prog = 0
-    if settings.tool_mmu == False:
-      cur_tool=5
+# Indizes nach (Inhalts-Hash, Parser, MMU): druckt dieselbe Datei auf mehreren Druckern,
+# wird sie nur einmal analysiert und der Index im Speicher geteilt. .bgcode-Downloads teilen
+# sich stattdessen die laufende Pipeline, gefunden über den Vorab-Schlüssel (remote_key).
+_shared_indexes = weakref.WeakValueDictionary()
+_shared_pipes = weakref.WeakValueDictionary()
+_index_locks = defaultdict(threading.Lock)   # nur während ein Index gebaut wird
+_index_locks_lock = threading.Lock()
+
+def index_gcode(path, stamping, mmu, parser=None, cache_key=None, pipe=None):
+    """Einmaliger Durchlauf nach prepare_gcode: kumulierter Verbrauch je Tool als Index."""
+    parser = parser or PARSER_MODE
+    if pipe:
+        def store(index):
+            # nach vollständigem Download: Ergebnisse unter dem Inhalts-Hash ablegen
+            key = download_keys.pop(pipe.path, None)
+            cache.store_json(key, 'meta', _bgcode_metadata(pipe.meta))
+            cache.store_json(key, f'index-{parser}', index.as_dict())
+            cache.store_alias(pipe.remote_key, key)
+        return pipe.start_index(stamping, mmu, get_scanner(parser), INDEX_EVERY, on_done=store)
+    if cache_key is None:
+        return _build_index(path, stamping, mmu, parser, cache_key)
+    shared = (cache_key, parser, mmu)
+    with _index_locks_lock:
+        lock = _index_locks[shared]
+    # zweiter Drucker mit derselben Datei wartet auf den ersten statt parallel zu parsen
+    with lock:
+        index = _shared_indexes.get(shared)
+        if index is None:
+            index = _build_index(path, stamping, mmu, parser, cache_key)
+            _shared_indexes[shared] = index
+        else:
+            print(f"Index {cache_key[:12]} wird mit einem anderen Drucker geteilt")
+        # wer noch auf das alte Lock wartet, findet den Index in _shared_indexes
+        with _index_locks_lock:
+            _index_locks.pop(shared, None)
+    return index
+
+
+def _build_index(path, stamping, mmu, parser, cache_key):
+    cached = cache.load_json(cache_key, f'index-{parser}')
+    if cached is not None:
+        return UsageIndex.from_dict(cached)
+    t0 = time.time()
+    mode = "parallel" if PARSE_PROCESSES > 1 and os.path.getsize(path) >= PARALLEL_MIN_BYTES else "sequential"
+    if mode == "parallel":
+        index = build_usage_index_parallel(path, stamping, mmu, get_scanner(parser), every=INDEX_EVERY,
+                                           workers=PARSE_PROCESSES)
     else:
-      cur_tool=0
-    
+        index = build_usage_index(path, stamping, mmu, get_scanner(parser), every=INDEX_EVERY, reader=GCODE_READER)
+    dt = time.time() - t0
+    metrics.record_index(mode, dt, index.total_lines)
+    print(f"Index erstellt: {index.total_lines} Zeilen, {len(index.lines)} Stützpunkte in {dt:.1f}s")
+    cache.store_json(cache_key, f'index-{parser}', index.as_dict())
+    return index
+
+PRINT_END_STATES = ('CANCELLED', 'ERROR', 'FINISHED', 'STOPPED', 'unknown')
+
+def clear_analysis_noti(state):
+    state.modify(lambda cur: {'noti': ''} if cur.noti in ("Analyse Offline", "Analyse Online") else None)
+
+def job_ended(cur):
+    return cur.tool_state in PRINT_END_STATES
+
+def progress_changed(prog, seen=None):
+    """
+    Bedingung für wait_for: neuer Fortschritt gegenüber prog oder Druck zu Ende. Das Ende zählt
+    nur, wenn sich der Zustand seit Version seen (letzte Meldung) geändert hat – sonst liefe die
+    Analyse bei 'unknown' (Drucker kurz nicht erreichbar) im Kreis.
+    """
+    return lambda cur: (cur.tool_progress is not None and cur.tool_progress != prog) or (job_ended(cur) and cur.version != seen)
+
+def start_analysis(state, index, sync):
+    """Meldung und Zustand zu Beginn einer Live-/Offline-Analyse (beide Engines)."""
+    # Fortschritt → Zeile über die M73-Marken, ohne Marken linear über die Zeilenzahl
+    marks = f"{len(index.progress_pcts)} M73-Marken" if index.progress_pcts else "keine M73-Marken"
     if not sync: 
-      prog = 0
-      print(f"Start  view {prog} Lines: {total}")
-      settings.noti="Analyse Offline"
+      print(f"Start  view 0 Lines: {index.expected_lines} ({marks})")
+      state.update(noti="Analyse Offline")
     else:
-      print(f"Start Live view {settings.tool_live} Lines: {total}")
-      settings.noti="Analyse Online"
-    settings.reboot = False
-    settings.reboot_analzye = False
-    while not settings.reboot and not settings.reboot_analzye: # not stop_event.is_set():
-        if (prog == settings.tool_progress) or (settings.tool_progress is None): print(f"wait for progress printer is {settings.tool_state}")
-        while ((prog == settings.tool_progress) or (settings.tool_progress is None)) and sync:
-          time.sleep(POLL_INTERVAL)
-          if settings.noti=="Analyse Offline" or settings.noti=="Analyse Online": settings.noti=""
+      print(f"Start Live view {state.tool_live} Lines: {index.expected_lines} ({marks})")
+      state.update(noti="Analyse Online")
+    state.update(reboot=False, reboot_analzye=False)
+
+def print_usage(prog, usage):
+    print(f"Fortschritt calc: {prog:.1f}%")
+    for t,mm in usage.items(): 
+      #print(f" T{t}: {mm:.1f}mm(~{mm_to_g(mm,densities[t]):.1f}g)")
+      print(f" T{t}: {mm:.1f}mm")
+
+def usage_segment(printer, index, idx, target):
+    """Verbrauch bis Zeile target (Analyse-Segment idx → target), Dauer und Zeilen an /metrics."""
+    with metrics.analyze_segment_seconds.time(printer.name):
+        usage = index.usage_at(target)
+    metrics.analyze_lines.inc(printer.name, value=target - idx)
+    return usage
+
+def index_failed(index):
+    """PipelineError, wenn der noch wachsende Index (pipeline.py) nicht mehr fertig wird."""
+    if index.error is not None:
+        raise PipelineError(f"Index unvollständig: {index.error}") from index.error
+
+
+def live_analyze_gen(printer, path, slicer, densities, stamping, sync=True, parser=None, index=None):
+    """
+    (Fortschritt, {tool: mm}) je neuem Drucker-Fortschritt. PipelineError, sobald ein Teil
+    gebraucht wird, den der abgebrochene Pipeline-Index nicht enthält (→ pipeline_fallback).
+    """
+    state = printer.state
+    if index is None:
+        index = index_gcode(path, stamping, state.tool_mmu, parser)
+    if not sync:
+        # ohne Drucker-Fortschritt läuft die Analyse durch, dafür muss der Index fertig sein
+        while not index.complete:
+            index_failed(index)
+            time.sleep(0.1)
+    idx = 0
+    usage = {}
+    prog = 0
+    seen = None
+    start_analysis(state, index, sync)
+    while not state.reboot and not state.reboot_analzye: # not stop_event.is_set():
+        if (prog == state.tool_progress) or (state.tool_progress is None): print(f"wait for progress printer is {state.tool_state}")
+        while ((prog == state.tool_progress) or (state.tool_progress is None)) and sync:
+          # bis der ProgressMonitor einen neuen Fortschritt/Zustand meldet, statt im Takt nachzusehen
+          state.wait_for(progress_changed(prog, seen), POLL_INTERVAL)
+          clear_analysis_noti(state)
           print('.', end="")
-          #print(f"wait for progress printer is {settings.tool_state}")
-          if (settings.tool_state in ('CANCELLED', 'ERROR', 'FINISHED', 'STOPPED','unknown')) or (not sync): break
+          #print(f"wait for progress printer is {state.tool_state}")
+          if job_ended(state.snapshot()) or (not sync): break
         if sync:
           #print("SYNC SET ON")
-          prog = settings.tool_progress
-          target = int(total*prog/100)
+          target = index.line_at_progress(state.tool_progress)
+          if target > index.total_lines and not index.complete:
+            index_failed(index)
+            # expected_lines wächst mit, solange pipeline.py noch indexiert
+            print(f"Index erst bei Zeile {index.total_lines}/{index.expected_lines}, warte")
+            time.sleep(1)
+            continue
+          prog = state.tool_progress
         else:
           #print("SYNC SET OFF")
           prog += 1
-          target = int(total*prog/100)# total
+          target = index.line_at_progress(prog)# total
         
         if target>idx:
             print(f"Line {idx} -> {target}")
-            segment = lines[idx:target]
-            for raw in segment:
-                s=raw.strip()
-                if not s or s.startswith(';') or s.startswith('M'): continue
-                try: ln=Line(raw)
-                except: continue
-                fw=ln.block.words[0] if ln.block.words else None
-                if fw and fw.letter=='T':
-                    print(f"Tool change \n {raw}")
-                    if not first_tool_change: 
-                      #no real tool change but mmu is active 
-                      if settings.tool_mmu == False:
-                        print("ERROR MMU RECOGNIZED BUT THERE SHOULD BE NONE!")
-                      usage[cur_tool]+=stamping[cur_tool]
-                    first_tool_change = False
-                    cur_tool=int(fw.value)
-                for w in ln.block.words:
-                    if w.letter=='E':
-                        #print(ln) DEBUG: FOUND ; Extrude purge line is not included in Prusa Slicer Concumptions. 
-                        if ((float(w.value)>0) or float(w.value)<0) and (usage[cur_tool]+float(w.value)>0): usage[cur_tool]+=float(w.value)
-                        break
-                if cur_tool in usage and usage[cur_tool] < 0: usage[cur_tool]=0
+            usage = usage_segment(printer, index, idx, target)
             idx=target#+1
         #usage_history.append((prog,dict(usage)))
-        yield prog, dict(usage)
-        print(f"Fortschritt calc: {prog:.1f}%")
-        for t,mm in usage.items(): 
-          #print(f" T{t}: {mm:.1f}mm(~{mm_to_g(mm,densities[t]):.1f}g)")
-          print(f" T{t}: {mm:.1f}mm")
+        seen = state.snapshot().version
+        yield prog, usage
+        print_usage(prog, usage)
         #if not sync: break
         if prog>=100: 
           print("\n SYNC BREAK IN LOOP 100P")
@@ -275,9 +594,9 @@ def live_analyze_gen(path, slicer, densities, stamping, sync=True):
           break
         #time.sleep(POLL_INTERVAL)
     print("\n SYNC BREAK out of looP")
-    if settings.noti=="Analyse Offline" or settings.noti=="Analyse Online": settings.noti=""
+    clear_analysis_noti(state)
     #print("\nDruck beendet. Vergleich:")
-    #for t in range(settings.tool_count):
+    #for t in range(state.tool_count):
     #    calc=mm_to_g(usage.get(t,0.0),densities[t]); sl=slicer[t] if t<len(slicer) else 0.0
     #    print(f" T{t}: berechnet {calc:.1f}g vs slicer {sl:.1f}g diff {calc-sl:+.1f}g")
     #return prog, dict(usage)
@@ -291,22 +610,18 @@ def add_slicer_to_usage(usage_history, slicer, densities):
   usage_history.append((100 ,dict(usage)))
   return usage_history
   
-def init_wait_for_job():
-    #global settings.tool_state
-    job=get_current_job();
+def init_wait_for_job(printer):
+    job=get_current_job(printer);
   
     if not job or 'file' not in job:
       wait_for_job = True
       msgflag = True
       while wait_for_job:
-        status_api = get_current_status()
+        status_api, job = printer.client.poll()
         if not status_api:
           machine_state='offline'
-          time.sleep(POLL_INTERVAL)
         else:
           machine_state=status_api.get('printer').get('state')
-          time.sleep(POLL_INTERVAL)
-          job=get_current_job();
           if not job or 'file' not in job:
             wait_for_job = True
           else:
@@ -316,4 +631,7 @@ def init_wait_for_job():
             msgflag = False
           else:
           	print('.', end='')
+        if wait_for_job:
+          # langsam bei IDLE/offline, Backoff bei Fehlern (scheduler.py)
+          time.sleep(printer.scheduler.next_interval(machine_state, ok=status_api is not None))
     return job
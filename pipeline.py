@@ -0,0 +1,198 @@
+"""
+Überlappende Verarbeitung eines .bgcode-Downloads: Download → Dekodieren → Index.
+
+Jede Stufe läuft in einem eigenen Thread, verbunden über begrenzte Queues
+(PIPELINE_DEPTH Einträge). Ist eine Stufe langsamer, wartet die vorherige,
+statt dass Daten im Speicher auflaufen.
+
+- source:  Byte-Blöcke vom Download (download_thread_fn mit sink=source), None = Ende
+- Dekodieren: bgcode_reader.iter_gcode_stream über QueueReader, Metadaten sind
+  nach den ersten Blöcken verfügbar (stehen in .bgcode vor dem G-Code)
+- Index: analyzer.index_line_chunks füllt einen UsageIndex, der schon während des
+  Aufbaus abgefragt werden kann (complete=False, expected_lines geschätzt)
+
+Druckt ein zweiter Drucker dieselbe Datei, verwendet er dieselbe Pipeline (monitor.start_pipeline):
+nur der erste lädt herunter (claim_source), Metadaten und Index sind gemeinsam.
+
+Bricht eine Stufe ab (Datei während des Downloads geändert, defekter Block), bleibt der Index
+unvollständig (complete=False, index.error). metadata() und die Live-Analyse melden das als
+PipelineError; die Aufrufer laden die Datei dann fertig und analysieren sie ohne Pipeline.
+
+Für Klartext-G-Code lohnt sich das nicht: die Slicer-Konfiguration steht am Dateiende,
+der Index braucht sie aber vorab (Stamping, MMU).
+"""
+import time
+import queue
+import threading
+import bgcode_reader
+import metrics
+from analyzer import index_line_chunks, split_line_chunks, scan_line, UsageIndex
+
+PIPELINE_DEPTH = 16   # Einträge pro Queue (Download: 64 kB-Blöcke, Dekodieren: ein bgcode-Block)
+
+
+class PipelineError(Exception):
+    """Pipeline abgebrochen, Ergebnisse unvollständig; __cause__ ist der ursprüngliche Fehler."""
+
+
+class QueueReader:
+    """Dateiähnliches Objekt (read, seek vorwärts) über eine Queue von Byte-Blöcken."""
+
+    def __init__(self, q):
+        self.q = q
+        self.buf = bytearray()
+        self.eof = False
+        self.consumed = 0   # bisher gelesene Bytes
+
+    def _fill(self, n):
+        while len(self.buf) < n and not self.eof:
+            item = self.q.get()
+            if item is None:
+                self.eof = True
+            elif isinstance(item, BaseException):
+                self.eof = True
+                raise item
+            else:
+                self.buf += item
+
+    def read(self, n):
+        self._fill(n)
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        self.consumed += len(data)
+        return data
+
+    def seek(self, n, whence=0):
+        if whence != 1 or n < 0:
+            raise OSError("QueueReader kann nur vorwärts springen")
+        while n > 0:
+            data = self.read(min(n, 1 << 20))
+            if not data:
+                break
+            n -= len(data)
+        return self.consumed
+
+    def drain(self):
+        """Restliche Blöcke verwerfen, damit der Download nicht an der vollen Queue hängen bleibt."""
+        while not self.eof:
+            item = self.q.get()
+            self.eof = item is None or isinstance(item, BaseException)
+
+
+def _drain(q):
+    while True:
+        item = q.get()
+        if item is None or isinstance(item, BaseException):
+            return
+
+
+class GcodePipeline:
+    """
+    total_size() liefert die erwartete Dateigröße (oder None) für die Schätzung,
+    wie viele Zeilen der fertige Index haben wird. remote_key: Vorab-Schlüssel der Datei
+    (monitor.remote_key), unter dem die Ergebnisse zusätzlich im Cache auffindbar sind.
+    """
+
+    def __init__(self, total_size=lambda: None, remote_key=None):
+        self.remote_key = remote_key
+        self.lock = threading.Lock()
+        self.path = None   # Download-Ziel des Druckers, der die Pipeline speist
+        self.source = queue.Queue(PIPELINE_DEPTH)
+        self.decoded = queue.Queue(PIPELINE_DEPTH)
+        self.total_size = total_size
+        self.meta = None
+        self.error = None   # erster Fehler einer Stufe
+        self.downloaded = threading.Event()   # Download beendet (monitor.pipeline_download)
+        self.meta_ready = threading.Event()
+        self.done = threading.Event()
+        self.index = None
+        threading.Thread(target=self._decode_fn, daemon=True).start()
+
+    def claim_source(self, path):
+        """True für den ersten Aufrufer: er lädt nach path herunter, alle weiteren teilen das Ergebnis."""
+        with self.lock:
+            if self.path is not None:
+                return False
+            self.path = path
+            return True
+
+    # ----- Stufe 2: Dekodieren -----
+
+    def _set_meta(self, meta):
+        self.meta = meta
+        self.meta_ready.set()
+
+    def _decode_fn(self):
+        reader = QueueReader(self.source)
+        try:
+            blocks = bgcode_reader.iter_gcode_stream(reader, on_metadata=self._set_meta)
+            for lines in split_line_chunks(blocks):
+                size = self.total_size()
+                self.decoded.put((lines, reader.consumed / size if size else 0))
+            self.decoded.put(None)
+        except Exception as e:
+            print(f"[pipeline] Fehler beim Dekodieren: {e}")
+            self.error = e
+            self.meta_ready.set()
+            self.decoded.put(e)
+            reader.drain()
+
+    def metadata(self, timeout=None):
+        """Wartet auf die Metadaten-Blöcke; {"printer"|"print"|"slicer"|"file": {key: value}}."""
+        if not self.meta_ready.wait(timeout):
+            return None
+        if self.meta is None and self.error is not None:
+            raise PipelineError(f"keine Metadaten: {self.error}") from self.error
+        return self.meta
+
+    # ----- Stufe 3: Index -----
+
+    def _chunks(self):
+        frac = 0
+        while True:
+            item = self.decoded.get()
+            if item is None or isinstance(item, BaseException):
+                self.decoded_done = True
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            if frac:
+                # Zeilen bisher / Anteil gelesener Bytes → erwartete Gesamtzeilen
+                self.index.expected_lines = max(self.index.total_lines, int(self.index.total_lines / frac))
+            lines, frac = item
+            yield lines
+
+    def _index_fn(self, stamping, mmu, scan, every, on_done):
+        self.decoded_done = False
+        try:
+            t0 = time.time()
+            index_line_chunks(self._chunks(), stamping, mmu, scan, every, index=self.index)
+            # Dauer wird vom Download begrenzt, Zeilen/s also eher Durchsatz der Pipeline
+            metrics.record_index("pipeline", time.time() - t0, self.index.total_lines)
+            print(f"[pipeline] Index fertig: {self.index.total_lines} Zeilen, {len(self.index.lines)} Stützpunkte")
+            if on_done:
+                on_done(self.index)
+        except Exception as e:
+            print(f"[pipeline] Fehler beim Indexieren: {e}")
+            if self.error is None:
+                self.error = e
+            # Bis hierhin gelesener Teil bleibt abfragbar, aber unvollständig: die Live-Analyse
+            # wechselt an seinem Ende auf den klassischen Ablauf (PipelineError)
+            self.index.error = self.error
+            if not self.decoded_done:
+                _drain(self.decoded)
+        finally:
+            self.done.set()
+
+    def start_index(self, stamping, mmu, scan=scan_line, every=1000, on_done=None):
+        """
+        Startet den Index-Thread und liefert sofort den (noch wachsenden) UsageIndex.
+        Weitere Aufrufe (andere Drucker) bekommen denselben Index.
+        """
+        with self.lock:
+            if self.index is not None:
+                return self.index
+            self.index = UsageIndex(0, [0], [()], [], complete=False)
+        threading.Thread(target=self._index_fn, args=(stamping, mmu, scan, every, on_done), daemon=True).start()
+        return self.index
@@ -0,0 +1,98 @@
+"""
+Drucker-Registry: mehrere Drucker aus einem Prozess überwachen.
+
+Konfiguration (erste passende Quelle):
+- data/printers.json (PRINTERS_FILE): [{"name": "mk4-1", "ip": "192.168.1.20", "password": "..."}, ...]
+- sonst ein Drucker aus PRUSA_IP/PASSWORD, Name PRINTER_NAME (Standard "default")
+
+Jeder Drucker hat eigenen Zustand (StateStore), PrusaLink-Client, PollScheduler,
+Slot-Mapping und Verbrauchsverlauf. Die Spulen-DB ist gemeinsam; eine Spule gehört
+über usage.printer zu einem Drucker (fehlt das Feld: zum ersten Drucker der Registry).
+Der erste Drucker verwendet settings.state, damit settings.tool_state usw. weiter gelten.
+"""
+import os
+import json
+import tempfile
+import threading
+from datetime import datetime
+from requests.auth import HTTPDigestAuth
+import settings
+from prusalink import PrusaLinkClient
+from scheduler import PollScheduler
+from state import StateStore
+
+PRINTERS_FILE = os.getenv("PRINTERS_FILE", os.path.join('data', 'printers.json'))
+
+
+class Printer:
+
+    def __init__(self, name, ip, password, state=None):
+        self.name = name
+        self.ip = ip
+        self.password = password
+        self.state = state if state is not None else StateStore(**settings.initial_state())
+        self.scheduler = PollScheduler()
+        self.stop_event = threading.Event()
+        self.client = None
+        self.files_url = None
+        self.usage_history = []      # (Fortschritt, {tool: mm}) des laufenden Jobs
+        self.usage_history_gen = 0   # erhöht, wenn usage_history ersetzt statt ergänzt wird (Cursor für /data?since=)
+        self.slot_map = {}           # temporäres Mapping Tool → Slot, z. B. {0: 2, 1: 0}
+        self.prognosis_basis = (None, None, None, None, None)   # siehe app.prognosis_totals
+        self.broker = None           # events.EventBroker, von app.py gesetzt
+        self.thread = None
+        # eigenes Download-Verzeichnis: zwei Drucker können dieselbe Datei gleichzeitig laden
+        self.download_dir = os.path.join(tempfile.gettempdir(), f"spooli-{name}")
+
+    def reset(self):
+        """Zustand und PrusaLink-Verbindung für einen neuen Durchlauf (früher settings.init)."""
+        print(f"[INIT {datetime.now().strftime('%H:%M:%S')} ] SETTINGS INIT {self.name} ({self.ip})")
+        self.state.reset(**settings.initial_state())
+        self.files_url = f"http://{self.ip}/usb"
+        auth = HTTPDigestAuth(settings.USERNAME, self.password)
+        # Verbindungspool, Digest-Nonce wird wiederverwendet
+        self.client = PrusaLinkClient(f"http://{self.ip}/api/v1", self.files_url, auth, name=self.name)
+
+    def set_usage_history(self, entries):
+        """Ersetzt usage_history (neuer Job, Remapping); Clients mit altem Cursor bekommen ein reset."""
+        self.usage_history = entries
+        self.usage_history_gen += 1
+
+    def data_cursor(self):
+        return f"{self.usage_history_gen}:{len(self.usage_history)}"
+
+    def owns(self, spool):
+        return spool_printer(spool) == self.name
+
+
+# ----- Registry -----
+
+PRINTERS = {}   # Name → Printer, in Konfigurationsreihenfolge
+
+
+def load_config():
+    if os.path.exists(PRINTERS_FILE):
+        with open(PRINTERS_FILE, 'r') as f:
+            return json.load(f)
+    return [{"name": os.getenv("PRINTER_NAME", "default"), "ip": os.getenv("PRUSA_IP"), "password": os.getenv("PASSWORD")}]
+
+
+def init_registry(config=None):
+    PRINTERS.clear()
+    for i, entry in enumerate(config if config is not None else load_config()):
+        name = entry['name']
+        if name in PRINTERS:
+            raise ValueError(f"Drucker {name} doppelt konfiguriert")
+        # der erste Drucker teilt sich den Zustand mit settings (settings.tool_state usw.)
+        PRINTERS[name] = Printer(name, entry.get('ip'), entry.get('password'), settings.state if i == 0 else None)
+    print(f"[printers] {', '.join(f'{p.name} ({p.ip})' for p in PRINTERS.values())}")
+    return PRINTERS
+
+
+def default_printer():
+    return next(iter(PRINTERS.values()))
+
+
+def spool_printer(spool):
+    """Name des Druckers, zu dem eine Spule gehört."""
+    return spool['usage'].get('printer') or default_printer().name
@@ -0,0 +1,129 @@
+"""
+Client für die PrusaLink-API (v1) mit Verbindungspool.
+
+- requests.Session hält die TCP-Verbindungen zum Drucker offen (keep-alive)
+- HTTPDigestAuth merkt sich die Nonce je Thread; ab der zweiten Anfrage wird der
+  Authorization-Header direkt mitgeschickt, ohne erneute 401-Runde
+- poll() liefert Status und Job in einem Zyklus: solange /status dieselbe Job-ID meldet,
+  wird /job nicht erneut abgefragt, sondern Fortschritt/Restzeit aus /status übernommen
+- Dauer jeder Anfrage wird mitgeschrieben (stats()) und an /metrics gemeldet
+"""
+import time
+import threading
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+POOL_SIZE = 4          # gleichzeitige Verbindungen (Status-Thread, Download, Anfragen der UI)
+TIMING_HISTORY = 200   # gemerkte Anfragen für stats()
+JOB_REFRESH = 60       # /job spätestens nach so vielen Polls neu laden
+
+
+class PrusaLinkClient:
+
+    def __init__(self, api_url, files_url, auth, timeout=5, name="printer"):
+        self.name = name   # Label in /metrics
+        self.api_url = api_url
+        self.files_url = files_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = auth
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.timings = deque(maxlen=TIMING_HISTORY)   # (Pfad, HTTP-Status, Sekunden)
+        self.request_count = 0
+        self.error_count = 0
+        self._job = None
+        self._job_polls = 0
+
+    def _record(self, path, status, seconds, endpoint):
+        metrics.api_seconds.observe(seconds, self.name, endpoint)
+        metrics.api_requests.inc(self.name, endpoint, "error" if status is None else str(status))
+        with self.lock:
+            self.timings.append((path, status, seconds))
+            self.request_count += 1
+            if status is None:
+                self.error_count += 1
+
+    def request(self, method, url, **kwargs):
+        """Anfrage über die Session; Ausnahmen von requests werden weitergereicht."""
+        kwargs.setdefault('timeout', self.timeout)
+        path = url.split('/', 3)[-1]
+        if url.startswith(self.files_url):
+            endpoint = "download"
+        elif url.startswith(self.api_url + '/'):
+            endpoint = url[len(self.api_url) + 1:].split('/')[0]   # status, job
+        else:
+            endpoint = "other"
+        t0 = time.perf_counter()
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._record(path, None, time.perf_counter() - t0, endpoint)
+            raise
+        # bei stream=True nur bis zum Eintreffen der Header gemessen
+        self._record(path, r.status_code, time.perf_counter() - t0, endpoint)
+        return r
+
+    def _get_json(self, endpoint):
+        try:
+            r = self.request('GET', f"{self.api_url}/{endpoint}")
+            r.raise_for_status()
+            return r.json() if r.status_code != 204 else None
+        except requests.RequestException:
+            return None
+
+    # ----- API -----
+
+    def get_status(self):
+        return self._get_json('status')
+
+    def get_job(self):
+        job = self._get_json('job')
+        with self.lock:
+            self._job = job
+            self._job_polls = 0
+        return job
+
+    def poll(self):
+        """(status, job) eines Abfragezyklus; meist genügt dafür eine einzige Anfrage."""
+        status = self.get_status()
+        if status is None:
+            return None, self.get_job()
+        current = status.get('job')
+        if not current:
+            with self.lock:
+                self._job = None
+            return status, None
+        with self.lock:
+            job = self._job
+            self._job_polls += 1
+            fresh = job is not None and job.get('id') == current.get('id') and self._job_polls < JOB_REFRESH
+        if not fresh:
+            return status, self.get_job()
+        job = dict(job)
+        for k in ('progress', 'time_remaining', 'time_printing'):
+            if k in current:
+                job[k] = current[k]
+        if 'state' in status.get('printer', {}):
+            job['state'] = status['printer']['state']
+        return status, job
+
+    def download(self, filename, headers=None, timeout=10):
+        """Streamende GET-Anfrage auf eine Datei (Antwort mit with-Block schließen)."""
+        return self.request('GET', f"{self.files_url}/{filename}", stream=True, headers=headers or {}, timeout=timeout)
+
+    def stats(self):
+        with self.lock:
+            times = [t for _, s, t in self.timings if s is not None]
+            last = self.timings[-1] if self.timings else None
+            return {
+                'requests': self.request_count,
+                'errors': self.error_count,
+                'avg_ms': round(1000 * sum(times) / len(times), 1) if times else None,
+                'max_ms': round(1000 * max(times), 1) if times else None,
+                'last': {'path': last[0], 'status': last[1], 'ms': round(1000 * last[2], 1)} if last else None,
+            }
@@ -0,0 +1,94 @@
+"""
+Adaptives Abfrage-Intervall für die PrusaLink-Polls.
+
+- IDLE/FINISHED/STOPPED …: langsam (POLL_IDLE)
+- PRINTING/PAUSED/ATTENTION: normal (POLL_PRINTING)
+- kurz vor einem Werkzeugwechsel oder dem Leerlaufen einer Spule (laut UsageIndex): schnell (POLL_NEAR)
+- Drucker nicht erreichbar / Fehler: exponentieller Backoff ab POLL_PRINTING bis POLL_MAX
+
+Alle Werte in Sekunden, per Umgebungsvariable einstellbar.
+"""
+import os
+import threading
+from bisect import bisect_right, insort
+
+POLL_IDLE = float(os.getenv("POLL_IDLE", "30"))
+POLL_PRINTING = float(os.getenv("POLL_PRINTING", "5"))
+POLL_NEAR = float(os.getenv("POLL_NEAR", "1"))
+POLL_MAX = float(os.getenv("POLL_MAX", "120"))
+POLL_NEAR_PERCENT = float(os.getenv("POLL_NEAR_PERCENT", "0.5"))   # Abstand zum nächsten Ereignis in % Fortschritt
+
+ACTIVE_STATES = ('PRINTING', 'PAUSED', 'ATTENTION', 'BUSY')
+
+
+class PollScheduler:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.errors = 0
+        self.index = None
+        self.runout_lines = []
+        self.pending = {}   # Tool → mm, im bisher indexierten Teil noch nicht erreicht
+        self.interval = POLL_PRINTING   # zuletzt gewähltes Intervall
+
+    def watch(self, index, runout_mm=None):
+        """
+        Ereignisse für einen Job: Werkzeugwechsel aus index.tool_changes (wächst ggf. noch mit)
+        und die Zeilen, an denen der Verbrauch eines Tools runout_mm[tool] erreicht. Solange der
+        Index noch aufgebaut wird (pipeline.py), sucht jede Abfrage die noch fehlenden Zeilen neu.
+        """
+        with self.lock:
+            self.index = index
+            self.runout_lines = []
+            self.pending = dict(runout_mm or {})
+            self._resolve_runouts()
+
+    def clear(self):
+        with self.lock:
+            self.index = None
+            self.runout_lines = []
+            self.pending = {}
+
+    def _resolve_runouts(self):
+        # der Index wächst nur am Ende: eine gefundene Zeile bleibt gültig
+        index = self.index
+        complete = index.complete
+        for tool, mm in list(self.pending.items()):
+            line = index.line_when(tool, mm)
+            if line is not None:
+                insort(self.runout_lines, line)
+                del self.pending[tool]
+        if complete:
+            # im fertigen Index nicht erreicht: die Spule reicht für den Job
+            self.pending = {}
+
+    def _near_event(self, progress):
+        index = self.index
+        if index is None or progress is None or not index.expected_lines:
+            return False
+        if self.pending:
+            self._resolve_runouts()
+        line = index.line_at_progress(progress)
+        ahead = index.line_at_progress(progress + POLL_NEAR_PERCENT)
+        for events in (index.tool_changes, self.runout_lines):
+            i = bisect_right(events, line)
+            if i < len(events) and events[i] <= ahead:
+                return True
+        return False
+
+    def next_interval(self, state, progress=None, ok=True):
+        """Intervall bis zur nächsten Abfrage; ok=False zählt als Fehler (Backoff)."""
+        with self.lock:
+            self.errors = 0 if ok else self.errors + 1
+            if self.errors:
+                interval = min(POLL_PRINTING * 2 ** (self.errors - 1), POLL_MAX)
+            elif state in ACTIVE_STATES:
+                interval = POLL_NEAR if state == 'PRINTING' and self._near_event(progress) else POLL_PRINTING
+            else:
+                interval = POLL_IDLE
+            self.interval = interval
+            return interval
+
+    def wait(self, stop_event, state, progress=None, ok=True):
+        """Schläft bis zur nächsten Abfrage, kehrt bei stop_event sofort zurück."""
+        return stop_event.wait(self.next_interval(state, progress, ok))
@@ -1,28 +1,51 @@
-from requests.auth import HTTPDigestAuth
-from datetime import datetime
-def init(pw, ip):
-    global tool_progress, tool_state, tool_job, tool_live, tool_mmu, tool_count,tool_count_mmu, USERNAME, PASSWORD, PRUSA_IP, API_URL, FILES_URL, AUTH, prusa_usage, noti, densities, slicing_g,reboot, reboot_analzye
-    print(f"[INIT {datetime.now().strftime('%H:%M:%S')} ] SETTINGS INIT")
-    tool_progress = None
-    tool_state = "unknown"   # PRINTING, PAUSED, etc.
-    tool_job = None # file
-    tool_live = "no"
-    tool_mmu = False
-    tool_count = 6
-    tool_count_mmu = 5
-    
-    noti = "Starting"
-    prusa_usage = False
-    
-    USERNAME = "maker"
-    PASSWORD = pw 
-    PRUSA_IP = ip 
-    API_URL = f"http://{PRUSA_IP}/api/v1"
-    FILES_URL = f"http://{PRUSA_IP}/usb"
-    AUTH = HTTPDigestAuth(USERNAME, PASSWORD)
-    
-    densities = []          # wird in main() gesetzt
-    slicing_g = []          # aus G-Code-Metadaten
-    
-    reboot = False
-    reboot_analzye = False
\ No newline at end of file
+import sys
+import types
+from state import StateStore
+
+# Veränderlicher Zustand (Drucker, Analyse, Download) liegt je Drucker in einem StateStore
+# (printers.py), settings.state ist der des ersten Druckers. Geändert wird er nur über
+# state.update(...) – mehrere Felder atomar. Lesen geht weiter als settings.tool_state
+# (über __getattr__ unten), für zusammenpassende Werte state.snapshot() verwenden.
+def initial_state():
+    return dict(
+        tool_progress = None,
+        tool_state = "unknown",   # PRINTING, PAUSED, etc.
+        tool_job = None, # file
+        tool_live = "no",
+        tool_mmu = False,
+        tool_count = 6,
+        tool_count_mmu = 5,
+
+        noti = "Starting",
+        prusa_usage = False,
+
+        densities = [],          # wird in main() gesetzt
+        slicing_g = [],          # aus G-Code-Metadaten
+
+        reboot = False,
+        reboot_analzye = False,
+
+        download_bytes = 0,      # Fortschritt des G-Code-Downloads
+        download_total = None,   # Gesamtgröße, falls vom Server gemeldet
+        download_rate = 0.0,     # Bytes/s
+    )
+
+state = StateStore(**initial_state())
+
+USERNAME = "maker"   # PrusaLink-Benutzer (Drucker: printers.py)
+
+def __getattr__(name):
+    # settings.tool_state usw. → aktueller Wert aus state
+    try:
+        return state.get(name)
+    except KeyError:
+        raise AttributeError(f"module 'settings' has no attribute '{name}'") from None
+
+class _SettingsModule(types.ModuleType):
+    # settings.tool_state = x würde den Wert nur verdecken statt ihn zu ändern
+    def __setattr__(self, name, value):
+        if name in state.fields:
+            raise AttributeError(f"settings.{name} ist Teil von settings.state – state.update({name}=...) verwenden")
+        super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = _SettingsModule
@@ -0,0 +1,325 @@
+"""
+Speicher für die Spulen-Datenbank.
+
+- json   (Standard): data/spool_db.json, bei jeder Änderung komplett neu geschrieben
+- sqlite (SPOOL_STORE=sqlite): data/spool_db.sqlite im WAL-Modus, eine Zeile je Spule
+  (Primärschlüssel id); Änderungen schreiben nur die betroffenen Zeilen
+
+Geschrieben wird verzögert (WriteBehindStore): eine Änderung markiert die DB nur als
+geändert, ein Hintergrund-Thread fasst alle Änderungen innerhalb von SPOOL_WRITE_DELAY
+Sekunden zu einem Schreibvorgang zusammen. flush() schreibt sofort (nach dem Nachfüllen,
+beim Beenden). SPOOL_WRITE_DELAY=0 schreibt wie früher direkt im aufrufenden Thread.
+
+Die Liste im Speicher (app.spool_db) bleibt in beiden Fällen die Quelle für Anzeige und
+Berechnungen; der Speicher bekommt nur die Änderungen mit. Gesucht wird nach id, Drucker
+und Slot über SpoolIndex (Dicts über dieselben Spulen-Objekte), nicht in der Datenbank.
+
+Beim ersten Öffnen der SQLite-Datei wird eine vorhandene JSON-Datei einmalig übernommen
+(PRAGMA user_version merkt sich das). Die JSON-Datei bleibt liegen, wird danach aber
+nicht mehr aktualisiert.
+"""
+import os
+import copy
+import bisect
+import json
+import sqlite3
+import time
+import atexit
+import threading
+import metrics
+
+SPOOL_STORE = os.getenv("SPOOL_STORE", "json")   # json | sqlite
+SPOOL_SQLITE_FILE = os.getenv("SPOOL_SQLITE_FILE", os.path.join('data', 'spool_db.sqlite'))
+
+SPOOL_WRITE_DELAY = float(os.getenv("SPOOL_WRITE_DELAY", "1.0"))   # Sekunden
+
+SCHEMA_VERSION = 1
+
+
+class JsonSpoolStore:
+
+    row_updates = False   # jede Änderung schreibt die ganze Datei
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()   # mehrere Drucker können gleichzeitig speichern (eine .tmp-Datei)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    @metrics.timed(metrics.db_save_seconds, "json", "save_all")
+    def save_all(self, db):
+        # erst in eine temporäre Datei, dann ersetzen: ein Absturz hinterlässt nie eine halbe Datei
+        tmp = self.path + ".tmp"
+        with self.lock:
+            with open(tmp, 'w') as f:
+                json.dump(db, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+    # einzelne Änderungen: die Datei enthält immer die ganze Liste
+    def save(self, db, spools):
+        self.save_all(db)
+
+    def delete(self, db, spool_id):
+        self.save_all(db)
+
+    def flush(self):
+        pass
+
+
+class SqliteSpoolStore:
+
+    row_updates = True
+
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # eine Verbindung für alle Threads (Flask, main), serialisiert über lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS spools ("
+                " id TEXT PRIMARY KEY,"
+                " pos INTEGER NOT NULL,"      # Reihenfolge wie in der Liste
+                " slot INTEGER,"
+                " doc TEXT NOT NULL)"         # ganze Spule als JSON
+            )
+            # gesucht wird in SpoolIndex; ein Index auf slot würde nur die Schreibvorgänge bremsen
+            self.conn.execute("DROP INDEX IF EXISTS spools_slot")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS spools_pos ON spools(pos)")
+        if json_path:
+            self._migrate(json_path)
+
+    def _migrate(self, json_path):
+        with self.lock, self.conn:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            if os.path.exists(json_path):
+                with open(json_path, 'r') as f:
+                    db = json.load(f)
+                self.conn.execute("DELETE FROM spools")
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO spools (id, pos, slot, doc) VALUES (?, ?, ?, ?)",
+                    [self._row(s, pos) for pos, s in enumerate(db)])
+                print(f"[spool_store] {len(db)} Spulen aus {json_path} übernommen")
+            self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    # doppelte IDs in der Liste (zufällige 4-stellige IDs): die spätere Spule gewinnt
+    @staticmethod
+    def _row(spool, pos):
+        return (spool['id'], pos, spool['usage']['slot'], json.dumps(spool))
+
+    def load(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT doc FROM spools ORDER BY pos").fetchall()
+        return [json.loads(doc) for doc, in rows]
+
+    @metrics.timed(metrics.db_save_seconds, "sqlite", "save_all")
+    def save_all(self, db):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM spools")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO spools (id, pos, slot, doc) VALUES (?, ?, ?, ?)",
+                [self._row(s, pos) for pos, s in enumerate(db)])
+
+    @metrics.timed(metrics.db_save_seconds, "sqlite", "save")
+    def save(self, db, spools):
+        """Nur die geänderten (oder neuen) Spulen schreiben."""
+        with self.lock, self.conn:
+            for spool in spools:
+                cur = self.conn.execute(
+                    "UPDATE spools SET slot = ?, doc = ? WHERE id = ?",
+                    (spool['usage']['slot'], json.dumps(spool), spool['id']))
+                if cur.rowcount == 0:
+                    pos = self.conn.execute("SELECT COALESCE(MAX(pos) + 1, 0) FROM spools").fetchone()[0]
+                    self.conn.execute(
+                        "INSERT INTO spools (id, pos, slot, doc) VALUES (?, ?, ?, ?)",
+                        self._row(spool, pos))
+
+    @metrics.timed(metrics.db_save_seconds, "sqlite", "delete")
+    def delete(self, db, spool_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM spools WHERE id = ?", (spool_id,))
+
+    def flush(self):
+        pass
+
+
+class WriteBehindStore:
+    """
+    Gleiche Schnittstelle wie die Stores oben; sammelt Änderungen und schreibt sie
+    gebündelt im Hintergrund, die Anfrage wartet nicht auf die Platte.
+
+    Flask-Anfragen ändern die Spulen-Dicts weiter, während der Hintergrund-Thread schreibt.
+    Die ganze Liste (JSON-Datei, save_all) wird daher nur als geändert markiert und erst im
+    Hintergrund-Thread kopiert, unter data_lock – dem Lock, das app.py beim Ändern von
+    spool_db hält. Einzelne Zeilen (SQLite) werden im aufrufenden Thread kopiert, das sind
+    nur die geänderten Spulen. flush() nie mit gehaltenem data_lock aufrufen.
+    """
+
+    def __init__(self, store, delay=SPOOL_WRITE_DELAY, data_lock=None):
+        self.store = store
+        self.delay = delay
+        self.data_lock = data_lock or threading.RLock()
+        self.lock = threading.Lock()         # ausstehende Änderungen
+        self.write_lock = threading.Lock()   # immer nur ein Schreibvorgang
+        self.dirty = threading.Event()
+        self.db = None           # Liste für den nächsten vollständigen Schreibvorgang (kopiert erst flush)
+        self.full = False        # ganze Liste schreiben
+        self.rows = {}           # id → Kopie der Spule (nur SQLite: einzelne Zeilen, nach db)
+        self.deleted = set()
+        self.writes = 0
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def load(self):
+        self.flush()
+        return self.store.load()
+
+    def save_all(self, db):
+        with self.lock:
+            self.db, self.full = db, True
+            self.rows.clear()
+            self.deleted.clear()
+        self.dirty.set()
+
+    def save(self, db, spools):
+        if not self.store.row_updates:
+            return self.save_all(db)
+        rows = {spool['id']: copy.deepcopy(spool) for spool in spools}
+        with self.lock:
+            self.rows.update(rows)
+            self.deleted.difference_update(rows)
+        self.dirty.set()
+
+    def delete(self, db, spool_id):
+        if not self.store.row_updates:
+            return self.save_all(db)
+        with self.lock:
+            self.rows.pop(spool_id, None)
+            self.deleted.add(spool_id)
+        self.dirty.set()
+
+    def _run(self):
+        while True:
+            self.dirty.wait()
+            # weitere Änderungen im Zeitfenster landen im selben Schreibvorgang
+            time.sleep(self.delay)
+            self.flush()
+
+    def flush(self):
+        """Ausstehende Änderungen sofort schreiben."""
+        with self.write_lock:
+            with self.lock:
+                self.dirty.clear()
+                if not (self.full or self.rows or self.deleted):
+                    return
+                db, full, rows, deleted = self.db, self.full, list(self.rows.values()), list(self.deleted)
+                self.db, self.full = None, False
+                self.rows.clear()
+                self.deleted.clear()
+            if full:
+                with self.data_lock:
+                    snapshot = copy.deepcopy(db)
+            try:
+                if full:
+                    self.store.save_all(snapshot)
+                # einzelne Zeilen (nur SQLite) nach der ganzen Liste: sie sind neuer
+                for spool_id in deleted:
+                    self.store.delete(db, spool_id)
+                if rows:
+                    self.store.save(db, rows)
+                self.writes += 1
+            except Exception as e:
+                print(f"[spool_store] Fehler beim Speichern: {e}")
+                self._retry(db, full, rows, deleted)
+
+    def _retry(self, db, full, rows, deleted):
+        """Fehlgeschlagene Änderungen wieder vormerken; inzwischen neuere haben Vorrang."""
+        with self.lock:
+            if not self.full:
+                # eine neuere ganze Liste enthält auch diese Änderungen
+                if full:
+                    self.db, self.full = db, True
+                for spool in rows:
+                    if spool['id'] not in self.rows and spool['id'] not in self.deleted:
+                        self.rows[spool['id']] = spool
+                self.deleted.update(i for i in deleted if i not in self.rows)
+        self.dirty.set()
+
+
+class SpoolIndex:
+    """
+    Nachschlagetabellen über die Spulen-Liste: id → Spule, Drucker → Spulen und
+    (Drucker, Slot) → Spulen, jeweils in Listenreihenfolge. owner(spool) liefert den
+    Druckernamen (printers.spool_printer). Wie bei next(...) über die Liste gilt bei
+    doppelten IDs die erste Spule.
+
+    Nach dem Ändern von Slot oder Drucker einer Spule update(spool), nach dem Ersetzen der
+    Liste oder dem Löschen rebuild(db).
+    """
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.by_id = {}
+        self.by_printer = {}
+        self.by_slot = {}
+        self.pos = {}    # id(spool) → Position in der Liste
+        self.keys = {}   # id(spool) → (Drucker, Slot) beim letzten Eintragen
+
+    def rebuild(self, db):
+        self.by_id, self.by_printer, self.by_slot, self.pos, self.keys = {}, {}, {}, {}, {}
+        for spool in db:
+            self.pos[id(spool)] = len(self.pos)
+            self._add(spool)
+
+    def _insert(self, spools, spool):
+        positions = [self.pos[id(s)] for s in spools]
+        spools.insert(bisect.bisect(positions, self.pos[id(spool)]), spool)
+
+    def _add(self, spool):
+        key = (self.owner(spool), spool['usage']['slot'])
+        self.keys[id(spool)] = key
+        self.by_id.setdefault(spool['id'], spool)
+        self._insert(self.by_printer.setdefault(key[0], []), spool)
+        self._insert(self.by_slot.setdefault(key, []), spool)
+
+    def update(self, spool):
+        """Neue Spule (am Listenende) oder geänderter Slot/Drucker."""
+        key = self.keys.get(id(spool))
+        if key is None:
+            self.pos[id(spool)] = len(self.pos)
+        elif key != (self.owner(spool), spool['usage']['slot']):
+            # nach Identität: zwei Spulen können gleiche Inhalte haben
+            for spools in (self.by_printer[key[0]], self.by_slot[key]):
+                del spools[next(i for i, s in enumerate(spools) if s is spool)]
+        else:
+            return
+        self._add(spool)
+
+    def get(self, spool_id):
+        return self.by_id.get(spool_id)
+
+    def of_printer(self, name):
+        return self.by_printer.get(name, [])
+
+    def in_slot(self, name, slot):
+        return self.by_slot.get((name, slot), [])
+
+
+def open_store(json_path, kind=SPOOL_STORE, delay=SPOOL_WRITE_DELAY, data_lock=None):
+    if kind == 'sqlite':
+        print(f"[spool_store] SQLite: {SPOOL_SQLITE_FILE}")
+        store = SqliteSpoolStore(SPOOL_SQLITE_FILE, json_path)
+    else:
+        store = JsonSpoolStore(json_path)
+    return WriteBehindStore(store, delay, data_lock) if delay > 0 else store
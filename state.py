@@ -0,0 +1,127 @@
+"""
+Versionierter, threadsicherer Zustandsspeicher.
+
+- update(**felder) ändert mehrere Felder atomar; nur echte Änderungen erhöhen die Version
+- snapshot() liefert einen unveränderlichen Stand (Snapshot) mit Versionsnummer, alle Felder
+  daraus passen zueinander
+- wait(version) / wait_for(bedingung) blockieren bis zur nächsten Änderung statt zu pollen
+- watch(fn) ruft fn bei jeder Änderung auf (engine.py weckt damit wartende asyncio-Tasks)
+
+Verwendet von settings.py für den Drucker-/Analysezustand.
+"""
+import threading
+from types import MappingProxyType
+
+
+class Snapshot:
+    """Unveränderlicher Stand: snap.tool_state, snap['tool_state'], snap.version."""
+
+    __slots__ = ('version', 'fields')
+
+    def __init__(self, version, fields):
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'fields', MappingProxyType(fields))
+
+    def __getattr__(self, name):
+        try:
+            return self.fields[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot ist unveränderlich")
+
+    def as_dict(self):
+        return dict(self.fields)
+
+
+class StateStore:
+
+    def __init__(self, **fields):
+        self.cond = threading.Condition(threading.RLock())
+        self.fields = dict(fields)
+        self.version = 0
+        self._snapshot = None
+        self._watchers = []
+
+    def _check(self, names):
+        unknown = set(names) - self.fields.keys()
+        if unknown:
+            raise KeyError(f"Unbekannte Zustandsfelder: {', '.join(sorted(unknown))}")
+
+    def _changed(self):
+        self.version += 1
+        self._snapshot = None
+        self.cond.notify_all()
+        for fn in self._watchers:
+            fn()
+
+    def watch(self, fn):
+        """fn() nach jeder Änderung (unter der Sperre, muss kurz sein – z. B. loop.call_soon_threadsafe)."""
+        with self.cond:
+            self._watchers.append(fn)
+
+    def unwatch(self, fn):
+        with self.cond:
+            self._watchers.remove(fn)
+
+    def update(self, **changes):
+        """Felder atomar setzen; liefert die (ggf. neue) Version."""
+        with self.cond:
+            self._check(changes)
+            changed = {k: v for k, v in changes.items() if self.fields[k] is not v and self.fields[k] != v}
+            if changed:
+                self.fields.update(changed)
+                self._changed()
+            return self.version
+
+    def modify(self, fn):
+        """fn(snapshot) → {feld: wert} wird unter derselben Sperre angewendet (lesen und ändern in einem Schritt)."""
+        with self.cond:
+            return self.update(**(fn(self._snap()) or {}))
+
+    def reset(self, **fields):
+        """Alle Felder auf einmal ersetzen (Printer.reset)."""
+        with self.cond:
+            self._check(fields)
+            self.fields.update(fields)
+            self._changed()
+            return self.version
+
+    def get(self, name):
+        with self.cond:
+            return self.fields[name]
+
+    def __getattr__(self, name):
+        # state.tool_state: aktueller Wert eines Felds (für mehrere Felder snapshot() nehmen)
+        if name.startswith('_') or 'fields' not in self.__dict__:
+            raise AttributeError(name)
+        try:
+            return self.get(name)
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def _snap(self):
+        if self._snapshot is None:
+            self._snapshot = Snapshot(self.version, dict(self.fields))
+        return self._snapshot
+
+    def snapshot(self):
+        with self.cond:
+            return self._snap()
+
+    def wait(self, version, timeout=None):
+        """Wartet, bis die Version nicht mehr version ist (oder timeout); liefert den aktuellen Stand."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != version, timeout)
+            return self._snap()
+
+    def wait_for(self, predicate, timeout=None):
+        """Wartet, bis predicate(snapshot) wahr ist; liefert den Stand oder None bei timeout."""
+        with self.cond:
+            if self.cond.wait_for(lambda: predicate(self._snap()), timeout):
+                return self._snap()
+            return None
@@ -0,0 +1,18 @@
+import os
+import sys
+import pytest
+
+# Module liegen flach im Projektverzeichnis
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    # app.py legt Spulen-DB und Historie relativ zum Arbeitsverzeichnis an
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    os.makedirs('data', exist_ok=True)
+    os.environ.setdefault('SPOOL_WRITE_DELAY', '0')
+    import app
+    yield app
+    os.chdir(cwd)
@@ -0,0 +1,112 @@
+"""
+Schneller Scanner (scan_line) gegen die Referenz über pygcode (scan_line_pygcode): gleiche
+Treffer je Zeile und gleicher Index (Stützpunkte, Summen je Tool) auf einer von
+gcode_gen.py erzeugten Datei, ergänzt um E0, große Retraktionen und fehlerhafte Zeilen.
+build_usage_index_parallel gegen build_usage_index auf einer MMU-Datei über mehrere Bereiche,
+auch mit einem Bereich, der der Reihe nach nachgerechnet werden muss (need in _merge_range).
+"""
+import io
+import random
+import contextlib
+import pytest
+import gcode_gen
+import analyzer
+from analyzer import (build_usage_index, build_usage_index_parallel, scan_line, scan_line_pygcode,
+                      split_ranges, READ_BLOCK)
+
+if analyzer.Line is None:
+    pytest.skip("pygcode nicht installiert", allow_module_level=True)
+
+STAMPING = [20.0, 15.0, 25.0, 10.0, 30.0]
+
+LINES = [
+    "T1", "T1T1", " T1T1E-5", "T1 E1 T2", "G1 T1", "T0 G92 E0", "T1 G1 E1", "t2",
+    "G1 E1 E2", "E1 E2", "T1 X1 X2", "N1 N2 G1 E1", "G1 X1 E.5", "G1 E-.8 F2100",
+    "G1 E0", "G92 E0", "G1 X1 E1 ; E5", "G1 X1 (E5) E1", "G1 E", "G1 X1 Ea", "M73 P10",
+    "; T1", "", "   ", "O100 T1", "G1 X1 O1 E3", "T-1", "T 3", "G1 e2",
+]
+
+# Zusätzliche Zeilen zwischen den erzeugten: E0, Retraktion unter 0 (Klemmregel), Müll
+EXTRA = ["G92 E0", "G1 E0 F1200", "G1 E-5000 F2100", "T1T1", " T1T1E-5", "G1 X1 (E5) E1",
+         "G1 E1 E2", "t2", "G1 X1 Ea"]
+
+
+@pytest.mark.parametrize("raw", LINES)
+def test_scan_line_matches_pygcode(raw):
+    assert scan_line(raw) == scan_line_pygcode(raw)
+
+
+@pytest.fixture(scope='module', params=[4, 1], ids=["mmu", "single"])
+def job(request, tmp_path_factory):
+    tools = request.param
+    d = tmp_path_factory.mktemp("scan")
+    src, dest = str(d / "gen.gcode"), str(d / "job.gcode")
+    gcode_gen.generate(src, size_mb=0.3, tools=tools, tool_change_every=400, retract=0.2, seed=1)
+    rng = random.Random(1)
+    with open(src) as f, open(dest, 'w') as out:
+        for line in f:
+            out.write(line)
+            if rng.random() < 0.02:
+                extra = rng.choice(EXTRA)
+                if tools == 1 and 't' in extra.lower():
+                    continue   # ohne MMU keine (auch keine fehlerhaften) Werkzeugwechsel
+                out.write(extra + "\n")
+    return dest, tools > 1
+
+
+def test_index_matches_pygcode(job):
+    path, mmu = job
+    stamping = STAMPING if mmu else [0.0] * 5
+    with contextlib.redirect_stdout(io.StringIO()):
+        fast = build_usage_index(path, stamping, mmu, scan_line, every=200)
+        ref = build_usage_index(path, stamping, mmu, scan_line_pygcode, every=200)
+    assert fast.as_dict() == ref.as_dict()
+    assert len(fast.lines) > 10
+    assert bool(fast.tool_changes) == mmu
+    total = fast.usage_at(fast.total_lines)
+    assert total == ref.usage_at(ref.total_lines)
+    assert sorted(total) == ([0, 1, 2, 3] if mmu else [5])
+
+
+@pytest.fixture(scope='module')
+def big_job(tmp_path_factory):
+    # workers=2 → bis zu 4 Bereiche an 1-MB-Blockgrenzen: die Datei braucht mehr als 4 Blöcke
+    d = tmp_path_factory.mktemp("parallel")
+    path = str(d / "job.gcode")
+    gcode_gen.generate(path, size_mb=4.5, tools=4, tool_change_every=400, retract=0.2, seed=23)
+    return path
+
+
+def assert_same_index(path):
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        par = build_usage_index_parallel(path, STAMPING, True, scan_line, every=1000, workers=2)
+        seq = build_usage_index(path, STAMPING, True, scan_line, every=1000)
+    assert par.complete and par.total_lines == seq.total_lines
+    assert par.lines == seq.lines
+    assert par.tool_changes == seq.tool_changes
+    assert par.progress_lines == seq.progress_lines and par.progress_pcts == seq.progress_pcts
+    assert sorted(par.tools) == sorted(seq.tools)
+    for line in par.lines[::50] + [par.total_lines]:
+        assert par.usage_at(line) == pytest.approx(seq.usage_at(line))
+    return log.getvalue()
+
+
+def test_parallel_matches_sequential(big_job):
+    assert len(split_ranges(big_job, 4)) == 4
+    log = assert_same_index(big_job)
+    assert "der Reihe nach" not in log
+
+
+def test_parallel_fallback_on_need(big_job, tmp_path):
+    # Retraktion größer als jeder bisherige Verbrauch am Anfang des dritten Bereichs: ToolUsage
+    # verwirft sie, die lineare Summe des Workers nicht → _merge_range liefert None
+    with open(big_job, 'rb') as f:
+        data = f.read()
+    cut = data.index(b'\n', 2 * (len(data) // READ_BLOCK + 1) // 4 * READ_BLOCK) + 1
+    path = str(tmp_path / "retract.gcode")
+    with open(path, 'wb') as f:
+        f.write(data[:cut] + b"G1 E-50000 F2100\n" + data[cut:])
+    ranges = split_ranges(path, 4)
+    assert len(ranges) == 4 and ranges[1][0] <= cut < ranges[2][1]
+    log = assert_same_index(path)
+    assert log.count("der Reihe nach") == 1
@@ -0,0 +1,141 @@
+"""
+download_thread_fn gegen einen lokalen HTTP-Server als Ersatz für PrusaLink:
+Abbruch mitten im Body, Fortsetzen per Range, Server ohne Range-Support und
+Datei, die sich zwischen zwei Versuchen ändert (416).
+"""
+import queue
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import monitor
+from printers import Printer
+from state import StateStore
+import settings
+
+CONTENT = bytes(range(256)) * 4096   # 1 MB
+
+
+class FakeFiles:
+    """Antworten des Servers; cuts: Bytes, nach denen die nächsten Antworten abbrechen."""
+
+    def __init__(self, content, cuts=(), ranges=True):
+        self.content = content
+        self.cuts = list(cuts)
+        self.ranges = ranges
+        self.requests = []   # Range-Header je Anfrage (None = ohne)
+        self.on_request = None
+
+
+def _handler(files):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            rng = self.headers.get('Range')
+            files.requests.append(rng)
+            if files.on_request:
+                files.on_request(len(files.requests))
+            content = files.content
+            start = int(rng[len('bytes='):].rstrip('-')) if rng and files.ranges else 0
+            if start >= len(content) and start:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(content)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = content[start:]
+            if start:
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{len(content) - 1}/{len(content)}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if files.cuts:
+                # Verbindung nach cut Bytes schließen, Content-Length verspricht mehr
+                body = body[:files.cuts.pop(0)]
+                self.close_connection = True
+            self.wfile.write(body)
+            self.wfile.flush()
+    return Handler
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(files):
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), _handler(files))
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        return f"127.0.0.1:{httpd.server_address[1]}"
+    yield start
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(monitor, 'POLL_INTERVAL', 0.01)
+
+
+def run_download(address, tmp_path, sink=None):
+    printer = Printer("test", address, "", state=StateStore(**settings.initial_state()))
+    printer.reset()
+    dest = str(tmp_path / "job.bgcode")
+    t = threading.Thread(target=monitor.download_thread_fn, args=(printer, "job.bgcode", dest, sink))
+    t.start()
+    t.join(20)
+    printer.stop_event.set()
+    assert not t.is_alive(), "Download hängt"
+    with open(dest, 'rb') as f:
+        data = f.read()
+    return data, monitor.download_keys.pop(dest, None), printer.state.snapshot()
+
+
+def test_resume_after_cut(server, tmp_path):
+    files = FakeFiles(CONTENT, cuts=[300_000, 200_000])
+    sink = queue.Queue()
+    data, key, cur = run_download(server(files), tmp_path, sink)
+    assert data == CONTENT
+    assert key == hashlib.sha256(CONTENT).hexdigest()
+    assert cur.download_bytes == cur.download_total == len(CONTENT)
+    # fortgesetzt statt von vorn
+    assert files.requests[0] is None
+    assert len(files.requests) == 3 and all(r.startswith('bytes=') for r in files.requests[1:])
+    blocks = []
+    while (block := sink.get_nowait()) is not None:
+        blocks.append(block)
+    assert b''.join(blocks) == CONTENT
+
+
+def test_server_without_range_support(server, tmp_path):
+    files = FakeFiles(CONTENT, cuts=[300_000], ranges=False)
+    data, key, _ = run_download(server(files), tmp_path)
+    assert data == CONTENT
+    assert key == hashlib.sha256(CONTENT).hexdigest()
+
+
+def test_file_changed_restarts_from_zero(server, tmp_path):
+    shorter = CONTENT[:100_000][::-1]
+    files = FakeFiles(CONTENT, cuts=[300_000])
+
+    def change(n):
+        if n == 2:
+            # neue, kürzere Datei: Range ab 300 000 liegt hinter dem Ende → 416
+            files.content = shorter
+    files.on_request = change
+    sink = queue.Queue()
+    data, key, cur = run_download(server(files), tmp_path, sink)
+    assert data == shorter
+    assert key == hashlib.sha256(shorter).hexdigest()
+    assert cur.download_bytes == len(shorter)
+    assert files.requests[2] is None
+    # der Pipeline wird der Abbruch gemeldet, bereits weitergereichte Blöcke passen nicht mehr
+    items = []
+    while not sink.empty():
+        items.append(sink.get_nowait())
+    assert isinstance(items[-1], EOFError)
@@ -0,0 +1,142 @@
+"""
+GcodePipeline mit Fehlern mitten in der Datei: der Index bleibt unvollständig, die Live-Analyse
+meldet PipelineError, und pipeline_fallback liefert die fertig geladene Datei für den
+klassischen Ablauf (Metadaten und Index ohne Pipeline).
+"""
+import threading
+import pytest
+import cache
+import gcode_gen
+import monitor
+from analyzer import build_usage_index, get_scanner
+from pipeline import GcodePipeline, PipelineError, PIPELINE_DEPTH
+from printers import Printer
+from state import StateStore
+import settings
+from test_download import FakeFiles, server  # noqa: F401 (Fixture)
+
+BLOCK = 64 << 10
+
+
+@pytest.fixture(scope='module')
+def jobs(tmp_path_factory):
+    """Zwei MMU-Jobs als .bgcode: der ursprüngliche und eine kürzere, geänderte Fassung."""
+    d = tmp_path_factory.mktemp("jobs")
+    out = {}
+    for name, size, seed in (("a", 1.0, 8), ("b", 0.1, 9)):
+        gcode = str(d / f"{name}.gcode")
+        gcode_gen.generate(gcode, size_mb=size, tools=4, tool_change_every=2000, seed=seed)
+        out[name] = gcode_gen.to_bgcode(gcode, str(d / f"{name}.bgcode"))
+    return out
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cache, 'CACHE_ENABLED', False)
+    monkeypatch.setattr(monitor, 'POLL_INTERVAL', 0.01)
+
+
+def make_printer(tmp_path, address="127.0.0.1:1"):
+    printer = Printer("test", address, "", state=StateStore(**settings.initial_state()))
+    printer.reset()
+    printer.download_dir = str(tmp_path / "dl")
+    printer.state.update(tool_state="PRINTING", tool_progress=0)
+    return printer
+
+
+def feed(pipe, data, end):
+    for i in range(0, len(data), BLOCK):
+        pipe.source.put(data[i:i + BLOCK])
+    pipe.source.put(end)
+
+
+def start_index(pipe):
+    meta = monitor._bgcode_metadata(pipe.metadata(10))
+    mmu = type(meta['nozzle_diameter']) != float
+    return pipe.start_index(meta['filament_stamping_distance'], mmu, get_scanner("fast"), monitor.INDEX_EVERY)
+
+
+def test_cut_keeps_index_incomplete(jobs, tmp_path):
+    with open(jobs["a"], 'rb') as f:
+        data = f.read()
+    pipe = GcodePipeline(lambda: len(data))
+    cut = len(data) // 2
+    threading.Thread(target=feed, args=(pipe, data[:cut], EOFError("abgebrochen")), daemon=True).start()
+    index = start_index(pipe)
+    assert pipe.done.wait(20)
+    assert not index.complete
+    assert isinstance(index.error, EOFError) and pipe.error is index.error
+    assert 0 < index.total_lines
+    # der bis dahin gelesene Teil bleibt abfragbar, das Ende nicht
+    printer = make_printer(tmp_path)
+    printer.state.update(tool_progress=1)
+    gen = monitor.live_analyze_gen(printer, None, None, None, None, sync=True, index=index)
+    prog, usage = next(gen)
+    assert prog == 1 and usage
+    printer.state.update(tool_progress=99)
+    with pytest.raises(PipelineError):
+        next(gen)
+    # ohne Sync wartet die Analyse nicht auf einen Index, der nicht mehr fertig wird
+    with pytest.raises(PipelineError):
+        next(monitor.live_analyze_gen(printer, None, None, None, None, sync=False, index=index))
+
+
+def test_decode_error_does_not_block_download(jobs):
+    with open(jobs["a"], 'rb') as f:
+        data = f.read()
+    pipe = GcodePipeline(lambda: len(data))
+    # defekter Block nach den Metadaten, danach mehr Blöcke, als die Queue fasst
+    broken = data[:len(data) // 2] + b"\xff" * BLOCK * (PIPELINE_DEPTH * 4)
+    download = threading.Thread(target=feed, args=(pipe, broken, None), daemon=True)
+    download.start()
+    index = start_index(pipe)
+    download.join(20)
+    assert not download.is_alive(), "Download hängt an der vollen Queue"
+    assert pipe.done.wait(20)
+    assert not index.complete and index.error is not None
+
+
+def test_metadata_error_raises_pipeline_error():
+    pipe = GcodePipeline(lambda: None)
+    pipe.source.put(b"kein bgcode")
+    pipe.source.put(None)
+    with pytest.raises(PipelineError):
+        pipe.metadata(10)
+
+
+def test_fallback_after_file_changed(jobs, server, tmp_path):
+    with open(jobs["a"], 'rb') as f:
+        original = f.read()
+    with open(jobs["b"], 'rb') as f:
+        changed = f.read()
+    # kürzer als der Teil, der vor dem Abbruch ankommt
+    assert len(changed) < len(original) // 4
+    files = FakeFiles(original, cuts=[len(original) // 2])
+
+    def change(n):
+        if n == 2:
+            # kürzere Datei: Range ab der Hälfte liegt hinter dem Ende → 416, Download von vorn
+            files.content = changed
+    files.on_request = change
+    printer = make_printer(tmp_path, server(files))
+    pipe = GcodePipeline(lambda: printer.state.download_total)
+    path, key = monitor.prepare_gcode(printer, None, "job.bgcode", True, pipe=pipe)
+    assert key is None
+    index = start_index(pipe)
+    assert pipe.done.wait(20)
+    assert not index.complete and isinstance(index.error, EOFError)
+
+    # klassischer Ablauf: fertig geladene (geänderte) Datei, Metadaten und Index ohne Pipeline
+    path, key = monitor.pipeline_fallback(printer, pipe)
+    printer.stop_event.set()
+    with open(path, 'rb') as f:
+        assert f.read() == changed
+    meta = monitor.parse_gcode_metadata(path, key)
+    stamping = meta['filament_stamping_distance']
+    index = monitor.index_gcode(path, stamping, True, cache_key=key)
+    assert index.complete
+    gcode_b = jobs["b"][:-len(".bgcode")] + ".gcode"
+    expected = build_usage_index(gcode_b, stamping, True, get_scanner("fast"), every=monitor.INDEX_EVERY)
+    # Slicer-Kommentare stehen im .bgcode in den Metadaten-Blöcken, der Verbrauch ist gleich
+    assert index.usage_at(index.total_lines) == pytest.approx(expected.usage_at(expected.total_lines))
@@ -0,0 +1,107 @@
+"""
+prognosis_payload (Slicer-Summen je Slot zwischengespeichert in prognosis_totals) gegen die
+bisherige Implementierung, die bei jeder Anfrage den ganzen Verlauf remappt hat:
+gleicher Verlauf, gleiche Spulen, gleicher Zustand → gleiche Antwort.
+Der Verbrauch aus dem Verlauf (used_g/rest_g) ging nie in die Antwort ein; die Referenz lässt
+ihn weg. Damit liefert eine Dichte-Liste, die kürzer ist als slicing_g, eine Prognose statt
+{} (bisher IndexError bei densities[slot], sobald der Verlauf diesen Slot enthielt).
+"""
+import random
+
+
+def reference_prognosis(app, printer):
+    """Bisherige Berechnung (Verlauf remappen, Verbrauch summieren), an Printer/slot_map angepasst."""
+    cur = printer.state.snapshot()
+    spool_db = [s for s in app.spool_db if printer.owns(s)]
+    try:
+        if not cur.tool_state in ("PRINTING", "PAUSED") or cur.tool_live in ('file', 'blocked'):
+            return {}
+        if not cur.slicing_g:
+            return {}
+        slot_map = printer.slot_map
+        slicing_g = app.remap_metadata_list(cur.slicing_g, slot_map)
+        app.remap_metadata_list(cur.densities, slot_map)
+        prognosis = {}
+        if cur.tool_mmu:
+            for slot in range(len(slicing_g)):
+                total_g = slicing_g[slot] if slot < len(slicing_g) else 0.0
+                for spool in spool_db:
+                    if spool["usage"]["slot"] == slot:
+                        prognosis[slot] = spool["data"]["remaining_g"] - total_g
+        else:
+            total_g = slicing_g if isinstance(slicing_g, float) else sum(slicing_g)
+            non_mmu_spool = next((s for s in spool_db if s["usage"]["slot"] == 5), None)
+            if non_mmu_spool:
+                prognosis[5] = non_mmu_spool["data"]["remaining_g"] - total_g
+        return prognosis
+    except Exception:
+        return {}
+
+
+def random_state(rng, app, printer):
+    # Metadaten wie von begin_job: MMU-Jobs haben Listen je Tool (gleich lang), sonst Einzelwerte
+    mmu = rng.random() < 0.7
+    tools = rng.randint(1, 6)
+
+    def per_tool(lo, hi):
+        if not mmu:
+            return round(rng.uniform(lo, hi), 2)
+        return [round(rng.uniform(lo, hi), 2) for _ in range(tools)]
+    slicing_g = per_tool(0, 80)
+    densities = per_tool(1.0, 1.4)
+    if mmu and rng.random() < 0.1:
+        densities = densities[:rng.randrange(tools)]
+    printer.state.update(
+        tool_state=rng.choice(["PRINTING", "PAUSED", "IDLE", "FINISHED"]),
+        tool_live=rng.choice(["live", "live", "file", "blocked", "no"]),
+        tool_mmu=mmu,
+        slicing_g=slicing_g if rng.random() < 0.95 else None,
+        densities=densities,
+    )
+    printer.slot_map = {t: rng.randrange(6) for t in range(tools) if rng.random() < 0.3}
+    printer.usage_history = [
+        (p, {t: rng.uniform(0, 5000) for t in rng.sample(range(6), rng.randint(0, 3))})
+        for p in sorted(rng.sample(range(101), rng.randint(0, 20)))
+    ]
+    app.spool_db = [
+        {"id": f"S{i}", "data": {"remaining_g": round(rng.uniform(-50, 1000), 1)},
+         "usage": {"slot": rng.choice([None, 0, 1, 2, 3, 4, 5, 6]),
+                   "printer": rng.choice([None, printer.name, "other"])}}
+        for i in range(rng.randint(0, 8))
+    ]
+    app.spool_index.rebuild(app.spool_db)
+
+
+def test_prognosis_matches_reference(app):
+    printer = app.default_printer()
+    rng = random.Random(15)
+    compared = 0
+    for _ in range(2000):
+        random_state(rng, app, printer)
+        expected = reference_prognosis(app, printer)
+        assert app.prognosis_payload(printer) == expected
+        # zweiter Aufruf aus dem Zwischenspeicher, geänderte Spulengewichte zählen trotzdem
+        for spool in app.spool_db:
+            spool["data"]["remaining_g"] -= 1.5
+        assert app.prognosis_payload(printer) == reference_prognosis(app, printer)
+        compared += bool(expected)
+    # nicht nur leere Antworten verglichen
+    assert compared > 200
+
+
+def test_prognosis_short_densities(app):
+    # Dichte nur für Tool 0, Verlauf mit Verbrauch auf allen Slots
+    printer = app.default_printer()
+    printer.state.update(tool_state="PRINTING", tool_live="live", tool_mmu=True,
+                         slicing_g=[10.0, 20.0, 30.0], densities=[1.24])
+    printer.usage_history = [(10, {0: 100.0, 1: 200.0, 2: 300.0})]
+    app.spool_db = [{"id": f"S{slot}", "data": {"remaining_g": 500.0},
+                     "usage": {"slot": slot, "printer": printer.name}} for slot in range(3)]
+    app.spool_index.rebuild(app.spool_db)
+    printer.slot_map = {}
+    assert app.prognosis_payload(printer) == reference_prognosis(app, printer) == {0: 490.0, 1: 480.0, 2: 470.0}
+    # mit Mapping füllt remap_metadata_list die Dichten auf 6 Slots auf
+    printer.slot_map = {0: 2, 1: 4}
+    expected = reference_prognosis(app, printer)
+    assert app.prognosis_payload(printer) == expected
+    assert sorted(expected) == [0, 1, 2]
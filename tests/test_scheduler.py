@@ -0,0 +1,41 @@
+"""
+PollScheduler mit einem noch wachsenden Index (pipeline.py): Run-outs, die beim watch()
+hinter dem indexierten Teil liegen, werden später gefunden und beschleunigen die Polls.
+"""
+import scheduler
+from analyzer import UsageIndex
+
+
+def grow(index, line, value):
+    # wie analyzer._index_chunks: Werte vor den Zeilennummern, total_lines danach
+    index.values.append((value,))
+    index.lines.append(line)
+    index.total_lines = index.expected_lines = line
+
+
+def test_runout_found_after_watch():
+    index = UsageIndex(0, [0], [()], [], complete=False)
+    index.tools.append(0)
+    grow(index, 1000, 100.0)
+    s = scheduler.PollScheduler()
+    s.watch(index, {0: 250.0})
+    assert s.runout_lines == [] and s.pending == {0: 250.0}
+
+    grow(index, 2000, 200.0)
+    grow(index, 3000, 300.0)
+    index.expected_lines = 4000
+    # Zeile 2500 = 62,5 %: kurz davor schnell, sonst normal
+    assert s.next_interval('PRINTING', 62.3) == scheduler.POLL_NEAR
+    assert s.runout_lines == [2500] and s.pending == {}
+    assert s.next_interval('PRINTING', 30) == scheduler.POLL_PRINTING
+
+
+def test_runout_dropped_when_index_complete():
+    index = UsageIndex(0, [0], [()], [], complete=False)
+    index.tools.append(0)
+    grow(index, 1000, 100.0)
+    s = scheduler.PollScheduler()
+    s.watch(index, {0: 250.0})
+    index.complete = True
+    assert s.next_interval('PRINTING', 50) == scheduler.POLL_PRINTING
+    assert s.pending == {} and s.runout_lines == []
@@ -0,0 +1,57 @@
+"""
+SpoolIndex gegen die lineare Suche in spool_db: nach jeder Änderung über die Flask-Routen
+(Spule anlegen, löschen, Slot/Drucker/Gewicht ändern) liefern id-, Drucker- und
+Slot-Lookups dieselben Spulen in derselben Reihenfolge.
+"""
+import random
+import pytest
+from printers import spool_printer
+
+
+@pytest.fixture
+def two_printers(app):
+    app.setup_printers([{"name": "default"}, {"name": "mk4"}])
+    app.spool_db = []
+    app.init_spools()
+    yield app
+    app.setup_printers()
+
+
+def check(app):
+    db = app.spool_db
+    index = app.spool_index
+    for spool in db:
+        assert index.get(spool['id']) is next(s for s in db if s['id'] == spool['id'])
+    for name in app.PRINTERS:
+        assert index.of_printer(name) == [s for s in db if spool_printer(s) == name]
+        for slot in [None] + list(range(6)):
+            expected = [s for s in db if spool_printer(s) == name and s['usage']['slot'] == slot]
+            assert [id(s) for s in index.in_slot(name, slot)] == [id(s) for s in expected]
+
+
+def test_index_follows_changes(two_printers):
+    app = two_printers
+    client = app.app.test_client()
+    rng = random.Random(16)
+    check(app)
+    for _ in range(300):
+        op = rng.random()
+        spool = rng.choice(app.spool_db) if app.spool_db else None
+        if op < 0.2 or spool is None:
+            assert client.post('/add_spool').status_code == 201
+        elif op < 0.3:
+            assert client.post(f"/delete_spool/{spool['id']}").status_code == 204
+        elif op < 0.6:
+            r = client.post('/update_spool', json={"id": spool['id'], "field": "slot", "value": rng.choice(["", 0, 1, 2, 3, 4])})
+            assert r.status_code == 204
+        elif op < 0.8:
+            r = client.post('/update_spool', json={"id": spool['id'], "field": "printer", "value": rng.choice(list(app.PRINTERS))})
+            assert r.status_code == 204
+        else:
+            printer = rng.choice(list(app.PRINTERS))
+            client.post(f"/printer/{printer}/set_spool_weight/{rng.randrange(5)}/{rng.uniform(0, 1000):.1f}")
+        check(app)
+        # je Drucker und Slot höchstens eine Spule (release_slot)
+        for name in app.PRINTERS:
+            for slot in range(5):
+                assert len(app.spool_index.in_slot(name, slot)) <= 1
@@ -0,0 +1,46 @@
+"""
+WriteBehindStore, während andere Threads (wie die Flask-Anfragen in app.py unter spool_lock)
+die Spulen weiter ändern: kein Schreibfehler, nach flush() steht der letzte Stand im Speicher.
+"""
+import io
+import time
+import random
+import threading
+import contextlib
+import pytest
+import spool_store
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_write_behind_while_mutating(kind, tmp_path, monkeypatch):
+    monkeypatch.setattr(spool_store, 'SPOOL_SQLITE_FILE', str(tmp_path / "spools.sqlite"))
+    lock = threading.RLock()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        store = spool_store.open_store(str(tmp_path / "spools.json"), kind=kind, delay=0.001, data_lock=lock)
+        db = [{"id": f"S{i}", "data": {"remaining_g": 1000.0}, "usage": {"slot": i % 6}} for i in range(200)]
+        store.save_all(db)
+        stop = threading.Event()
+
+        def mutate(seed):
+            rng = random.Random(seed)
+            n = 0
+            while not stop.is_set():
+                with lock:
+                    spool = rng.choice(db)
+                    n += 1
+                    spool['usage'][f"k{n % 50}"] = n   # Dict wächst während des Serialisierens
+                    spool['data']['remaining_g'] -= 0.1
+                    store.save(db, [spool])
+
+        threads = [threading.Thread(target=mutate, args=(i,)) for i in range(3)]
+        for t in threads:
+            t.start()
+        time.sleep(0.5)
+        stop.set()
+        for t in threads:
+            t.join()
+        store.flush()
+    assert "Fehler" not in log.getvalue()
+    assert store.writes > 1
+    assert store.store.load() == db